@@ -11,7 +11,7 @@ from aiogram.types import (
 from sqlalchemy import select, func, or_, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from models import Feedback, is_admin
+from models import Feedback, PlaceEnum, is_admin
 import csv
 import json
 import os
@@ -29,8 +29,14 @@ def get_admin_kb():
         inline_keyboard=[
             [InlineKeyboardButton(text="📊 Статистика",
                                   callback_data="admin_stats")],
+            [InlineKeyboardButton(text="📈 Аналитика",
+                                  callback_data="admin_analytics")],
             [InlineKeyboardButton(text="📝 Все отзывы",
                                   callback_data="admin_reviews")],
+            [InlineKeyboardButton(text="🔎 Похожие отзывы",
+                                  callback_data="admin_similar")],
+            [InlineKeyboardButton(text="🧹 Модерация",
+                                  callback_data="admin_moderation")],
             [InlineKeyboardButton(text="📤 Экспорт данных",
                                   callback_data="admin_export")],
             [InlineKeyboardButton(
@@ -61,6 +67,30 @@ def get_export_kb():
         inline_keyboard=[
             [InlineKeyboardButton(text="CSV", callback_data="export_csv")],
             [InlineKeyboardButton(text="JSON", callback_data="export_json")],
+            [InlineKeyboardButton(text="CSV + архив", callback_data="export_csv_archive")],
+            [InlineKeyboardButton(text="JSON + архив", callback_data="export_json_archive")],
             [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")]
         ]
     )
+
+
+def get_analytics_kb():
+    # analytics_<отчёт>_<номер заведения в PlaceEnum или all>
+    rows = []
+    for kind, title in (("nps", "📈 NPS"), ("dist", "📊 Распределение"),
+                        ("heat", "🗓 Тепловая карта"), ("cohort", "👥 Когорты"),
+                        ("mismatch", "🔀 Текст ≠ оценки"), ("trends", "🔥 Тренды")):
+        row = [InlineKeyboardButton(text=title, callback_data=f"analytics_{kind}_all")]
+        for index, place in enumerate(PlaceEnum):
+            row.append(InlineKeyboardButton(
+                text=place.value, callback_data=f"analytics_{kind}_{index}"))
+        rows.append(row)
+    # chart_<график>_<номер заведения или all>
+    for kind, title in (("trend", "📉 График динамики"), ("dist", "📊 График оценок")):
+        row = [InlineKeyboardButton(text=title, callback_data=f"chart_{kind}_all")]
+        for index, place in enumerate(PlaceEnum):
+            row.append(InlineKeyboardButton(
+                text=place.value, callback_data=f"chart_{kind}_{index}"))
+        rows.append(row)
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Dict, Optional
+
+import numpy as np
+from sqlalchemy import select
+
+from models import Feedback, PlaceEnum
+
+logger = logging.getLogger(__name__)
+
+PLACES = list(PlaceEnum)
+CRITERIA = ("menu", "staff", "clean")
+CRITERIA_NAMES = {"menu": "Меню", "staff": "Персонал", "clean": "Чистота"}
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+# Время в БД — UTC, кафе работают по Москве
+MSK_OFFSET = np.timedelta64(3, "h")
+
+
+class AnalyticsSnapshot:
+    """Колоночный снимок отзывов в памяти (без фото и текста).
+
+    Каждая колонка — массив NumPy; refresh() дочитывает только строки
+    с id больше последнего загруженного, поэтому обновление дешёвое.
+
+    overlap — сколько id ниже watermark перечитывать при каждом refresh.
+    На PostgreSQL id выдаётся до коммита, и строка с меньшим id может
+    стать видна позже строки с большим; на SQLite запись идёт одним
+    писателем, там хватает 0.
+
+    Номер поколения (generation) хранится в shared_state: он переживает
+    перезапуск, как и file_id графиков, и сброс в одном процессе
+    замечают остальные воркеры при следующем refresh().
+    """
+
+    _COLUMNS = {
+        "id": np.int64,
+        "user_id": np.int64,
+        "place": np.int8,
+        "menu": np.int8,
+        "staff": np.int8,
+        "clean": np.int8,
+        "recommend": np.bool_,
+        "created_at": "datetime64[s]",
+    }
+
+    GENERATION_KEY = "analytics_generation"
+
+    def __init__(self, shared_state=None, overlap: int = 0):
+        self.shared_state = shared_state
+        self.overlap = overlap
+        self._lock = asyncio.Lock()
+        self.watermark = 0
+        self.generation = 0
+        self.size = 0
+        self._data = {name: np.empty(0, dtype=dtype)
+                      for name, dtype in self._COLUMNS.items()}
+
+    def __getattr__(self, name):
+        data = self.__dict__.get("_data")
+        if data is not None and name in data:
+            return data[name][:self.size]
+        raise AttributeError(name)
+
+    @property
+    def version(self) -> str:
+        """Меняется при любом изменении данных снимка.
+
+        Одного watermark мало: строки из окна overlap его не двигают.
+        """
+        return f"{self.generation}.{self.watermark}.{self.size}"
+
+    def reset(self):
+        """Сбрасывает снимок; следующий refresh загрузит всё заново.
+
+        Нужен, когда меняются уже загруженные строки (например, отзыв
+        сняли с модерации), — догрузка по id этого не увидит.
+        """
+        self.size = 0
+        self.watermark = 0
+        if self.shared_state is not None:
+            self.generation = self.shared_state.incr_sync(self.GENERATION_KEY)
+        else:
+            self.generation += 1
+
+    def append(self, columns: Dict[str, np.ndarray]):
+        """Дописывает новые строки (массив растёт с запасом, как list)"""
+        count = len(columns["id"])
+        if not count:
+            return
+        needed = self.size + count
+        capacity = len(self._data["id"])
+        if needed > capacity:
+            new_capacity = max(needed, capacity * 2, 1024)
+            for name, array in self._data.items():
+                grown = np.empty(new_capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self._data[name] = grown
+        for name, values in columns.items():
+            self._data[name][self.size:needed] = values
+        self.size = needed
+        # Строки из окна overlap приходят с id ниже watermark
+        self.watermark = max(self.watermark, int(columns["id"].max()))
+
+    def _append_rows(self, rows) -> int:
+        """Дописывает строки запроса refresh(); возвращает их число"""
+        if not rows:
+            return 0
+        ids, users, places, menu, staff, clean, recommend, created = zip(*rows)
+        self.append({
+            "id": np.array(ids, dtype=np.int64),
+            "user_id": np.array(users, dtype=np.int64),
+            "place": np.array([PLACES.index(p) for p in places], dtype=np.int8),
+            "menu": np.array(menu, dtype=np.int8),
+            "staff": np.array(staff, dtype=np.int8),
+            "clean": np.array(clean, dtype=np.int8),
+            "recommend": np.array(recommend, dtype=np.bool_),
+            "created_at": np.array(created, dtype="datetime64[s]"),
+        })
+        return len(rows)
+
+    @staticmethod
+    async def _fetch(session_maker, *conditions, limit: Optional[int] = None):
+        async with session_maker() as session:
+            return (await session.execute(
+                select(
+                    Feedback.id, Feedback.user_id, Feedback.place,
+                    Feedback.menu_rating, Feedback.staff_rating,
+                    Feedback.cleanliness_rating, Feedback.recommend,
+                    Feedback.created_at,
+                )
+                .where(*conditions, Feedback.duplicate_of.is_(None))
+                .order_by(Feedback.id)
+                .limit(limit)
+            )).all()
+
+    async def refresh(self, session_maker, batch_size: int = 50000) -> int:
+        """Догружает новые отзывы; возвращает число добавленных строк"""
+        async with self._lock:
+            if self.shared_state is not None:
+                generation = await self.shared_state.get(self.GENERATION_KEY, 0)
+                if generation != self.generation:
+                    self.size = 0
+                    self.watermark = 0
+                    self.generation = generation
+            added = 0
+            if self.overlap and self.watermark:
+                # Перечитываем окно ниже watermark, уже загруженные id отбрасываем
+                low = self.watermark - self.overlap
+                rows = await self._fetch(session_maker, Feedback.id > low,
+                                         Feedback.id <= self.watermark)
+                known = set(self.id[self.id > low].tolist())
+                added += self._append_rows([row for row in rows if row[0] not in known])
+            while True:
+                rows = await self._fetch(session_maker, Feedback.id > self.watermark,
+                                         limit=batch_size)
+                added += self._append_rows(rows)
+                if len(rows) < batch_size:
+                    break
+            if added:
+                logger.debug("Снимок аналитики: +%s строк, всего %s", added, self.size)
+            return added
+
+    def mask(self, place: Optional[PlaceEnum] = None,
+             period: Optional[timedelta] = None) -> np.ndarray:
+        """Булев фильтр строк по заведению и периоду"""
+        result = np.ones(self.size, dtype=np.bool_)
+        if place is not None:
+            result &= self.place == PLACES.index(place)
+        if period is not None:
+            since = np.datetime64("now", "s") - np.timedelta64(int(period.total_seconds()), "s")
+            result &= self.created_at >= since
+        return result
+
+
+# ========== Метрики ==========
+
+def nps(ratings: np.ndarray) -> float:
+    """NPS по пятибалльной шкале: 5 — промоутеры, 1-3 — критики"""
+    if not len(ratings):
+        return 0.0
+    promoters = np.count_nonzero(ratings == 5)
+    detractors = np.count_nonzero(ratings <= 3)
+    return round((promoters - detractors) * 100 / len(ratings), 1)
+
+
+def distribution(ratings: np.ndarray) -> np.ndarray:
+    """Число оценок 1..5"""
+    return np.bincount(ratings, minlength=6)[1:6]
+
+
+def heatmap(created_at: np.ndarray) -> np.ndarray:
+    """Матрица 7×24: день недели × час (МСК)"""
+    local = created_at + MSK_OFFSET
+    hours = (local.astype("datetime64[h]") - local.astype("datetime64[D]")).astype(np.int64)
+    # 1970-01-01 — четверг; приводим к 0 = понедельник
+    weekdays = (local.astype("datetime64[D]").astype(np.int64) + 3) % 7
+    return np.bincount(weekdays * 24 + hours, minlength=7 * 24).reshape(7, 24)
+
+
+def summary(snapshot: AnalyticsSnapshot, place: Optional[PlaceEnum] = None,
+            period: Optional[timedelta] = None) -> Optional[dict]:
+    selected = snapshot.mask(place, period)
+    count = int(np.count_nonzero(selected))
+    if not count:
+        return None
+    result = {"count": count,
+              "recommend_share": round(float(snapshot.recommend[selected].mean()) * 100, 1)}
+    for name in CRITERIA:
+        ratings = getattr(snapshot, name)[selected]
+        result[name] = {
+            "nps": nps(ratings),
+            "avg": round(float(ratings.mean()), 2),
+            "distribution": distribution(ratings).tolist(),
+        }
+    average = (snapshot.menu[selected].astype(np.float32)
+               + snapshot.staff[selected] + snapshot.clean[selected]) / 3
+    result["percentiles"] = dict(zip(
+        ("p10", "p25", "p50", "p75", "p90"),
+        np.round(np.percentile(average, [10, 25, 50, 75, 90]), 2).tolist(),
+    ))
+    return result
+
+
+# ========== Тексты для админки ==========
+
+def _place_title(place: Optional[PlaceEnum]) -> str:
+    return place.value if place else "все заведения"
+
+
+def render_nps(snapshot: AnalyticsSnapshot, place: Optional[PlaceEnum] = None) -> str:
+    stats = summary(snapshot, place)
+    if not stats:
+        return "📭 Нет данных"
+    lines = [f"📈 NPS и перцентили ({_place_title(place)}):", ""]
+    for name in CRITERIA:
+        lines.append(f"• {CRITERIA_NAMES[name]}: NPS {stats[name]['nps']}, "
+                     f"среднее {stats[name]['avg']}/5")
+    lines.append(f"• Рекомендуют: {stats['recommend_share']}%")
+    p = stats["percentiles"]
+    lines.append("")
+    lines.append(f"Средний балл, перцентили: p10 {p['p10']} · p25 {p['p25']} · "
+                 f"p50 {p['p50']} · p75 {p['p75']} · p90 {p['p90']}")
+    lines.append(f"📊 Отзывов: {stats['count']}")
+    return "\n".join(lines)
+
+
+def render_distribution(snapshot: AnalyticsSnapshot,
+                        place: Optional[PlaceEnum] = None) -> str:
+    stats = summary(snapshot, place)
+    if not stats:
+        return "📭 Нет данных"
+    lines = [f"📊 Распределение оценок ({_place_title(place)}):"]
+    for name in CRITERIA:
+        counts = stats[name]["distribution"]
+        top = max(counts) or 1
+        lines.append("")
+        lines.append(f"<b>{CRITERIA_NAMES[name]}</b>")
+        for rating, count in zip(range(1, 6), counts):
+            bar = "█" * round(count * 12 / top)
+            lines.append(f"<code>{rating}★ {bar:<12} {count}</code>")
+    return "\n".join(lines)
+
+
+def render_heatmap(snapshot: AnalyticsSnapshot,
+                   place: Optional[PlaceEnum] = None) -> str:
+    selected = snapshot.mask(place)
+    if not np.count_nonzero(selected):
+        return "📭 Нет данных"
+    matrix = heatmap(snapshot.created_at[selected])
+    shades = " ░▒▓█"
+    top = matrix.max() or 1
+    levels = np.ceil(matrix * (len(shades) - 1) / top).astype(np.int64)
+    rows = ["    " + "".join(str(h % 10) for h in range(24))]
+    for day, row in zip(WEEKDAYS, levels):
+        rows.append(f"{day}  " + "".join(shades[level] for level in row))
+    return (f"🗓 Отзывы по дням и часам, МСК ({_place_title(place)}):\n"
+            f"<pre>{chr(10).join(rows)}</pre>\n"
+            f"Максимум: {top} отзывов в час")
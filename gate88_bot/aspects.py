@@ -0,0 +1,282 @@
+import asyncio
+import logging
+from html import escape
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import and_, bindparam, or_, select, update
+
+from models import Feedback, PlaceEnum
+from text_utils import load_nlp
+
+logger = logging.getLogger(__name__)
+
+# Меняется при правке словарей: отзывы со старой версией пересчитываются
+LEXICON_VERSION = 1
+
+ASPECTS = ("menu", "staff", "cleanliness")
+ASPECT_NAMES = {"menu": "Меню", "staff": "Персонал", "cleanliness": "Чистота"}
+
+# Леммы, по которым предложение относится к аспекту. Оценочные слова,
+# которые говорят только об одном аспекте («вкусный», «грубый»),
+# тоже здесь: «Всё было вкусно» — про меню, даже без слова «еда»
+ASPECT_TERMS = {
+    "menu": {
+        "меню", "еда", "блюдо", "кухня", "вкус", "порция", "паста", "пицца", "суп",
+        "салат", "десерт", "кофе", "чай", "напиток", "мясо", "стейк", "бургер",
+        "завтрак", "обед", "ужин", "хлеб", "соус", "выпечка", "торт", "рыба",
+        "ролл", "суши", "коктейль", "вкусный", "вкусно", "невкусный", "пересоленный",
+        "недосоленный", "сочный", "ароматный", "пригорелый", "подгорелый", "сырой",
+        "несвежий", "остывший", "пресный",
+    },
+    "staff": {
+        "официант", "официантка", "персонал", "обслуживание", "сервис", "бариста",
+        "администратор", "менеджер", "хостес", "сотрудник", "кассир", "работник",
+        "вежливый", "грубый", "хамский", "хамить", "хамство", "грубить", "приветливый",
+        "внимательный", "улыбчивый", "доброжелательный", "равнодушный", "невнимательный",
+        "обслужить", "нахамить",
+    },
+    "cleanliness": {
+        "чистота", "чистый", "чисто", "грязный", "грязно", "грязь", "туалет", "уборка",
+        "пыль", "пыльный", "мусор", "посуда", "скатерть", "запах", "пол", "санузел",
+        "липкий", "вонять", "таракан", "муха", "волос", "убрать", "протереть",
+    },
+}
+
+SENTIMENT = {
+    **dict.fromkeys((
+        "хороший", "хорошо", "отличный", "отлично", "вкусный", "вкусно", "прекрасный",
+        "замечательный", "великолепный", "свежий", "горячий", "вежливый", "приветливый",
+        "внимательный", "быстрый", "быстро", "уютный", "чистый", "чисто", "аккуратный",
+        "любить", "нравиться", "понравиться", "рекомендовать", "супер", "класс",
+        "спасибо", "доброжелательный", "идеальный", "шикарный", "сочный", "ароматный",
+        "профессиональный", "улыбчивый", "приятный", "восторг", "лучший",
+    ), 1.0),
+    **dict.fromkeys((
+        "плохой", "плохо", "ужасный", "ужасно", "отвратительный", "невкусный",
+        "холодный", "остывший", "пересоленный", "недосоленный", "сырой", "грубый",
+        "хамский", "хамить", "хамство", "грубить", "нахамить", "медленный", "медленно",
+        "долго", "долгий", "грязный", "грязно", "грязь", "липкий", "вонять",
+        "неприятный", "кошмар", "ужас", "разочаровать", "разочарование", "пригорелый",
+        "подгорелый", "несвежий", "равнодушный", "невнимательный", "игнорировать",
+        "забыть", "пыльный", "пыль", "мусор", "таракан", "муха", "волос", "пресный",
+        "худший",
+    ), -1.0),
+}
+
+NEGATIONS = {"не", "нет", "ни", "без"}
+# На сколько следующих слов действует отрицание
+NEGATION_SPAN = 3
+
+VOCABULARY = sorted(set(SENTIMENT).union(*ASPECT_TERMS.values()))
+_INDEX = {lemma: i for i, lemma in enumerate(VOCABULARY)}
+# Словарь как матрицы: полярность (V,) и принадлежность аспектам (V, 3)
+POLARITY = np.array([SENTIMENT.get(lemma, 0.0) for lemma in VOCABULARY])
+ASPECT_MATRIX = np.array([[lemma in ASPECT_TERMS[aspect] for aspect in ASPECTS]
+                          for lemma in VOCABULARY], dtype=np.float64)
+
+
+def flatten(sentences_per_review: Iterable[Iterable[Sequence[str]]]
+            ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Леммы → плоские массивы для векторного подсчёта.
+
+    Возвращает (индекс слова в словаре, знак с учётом отрицания, номер
+    предложения) для каждого словарного токена и номер отзыва для
+    каждого предложения. Остальные токены отбрасываются сразу.
+    """
+    tokens, signs, token_sentence, sentence_review = [], [], [], []
+    sentence = 0
+    for review, sentences in enumerate(sentences_per_review):
+        for lemmas in sentences:
+            negated_until = -1
+            for position, lemma in enumerate(lemmas):
+                if lemma in NEGATIONS:
+                    negated_until = position + NEGATION_SPAN
+                    continue
+                index = _INDEX.get(lemma)
+                if index is None:
+                    continue
+                tokens.append(index)
+                signs.append(-1.0 if position <= negated_until else 1.0)
+                token_sentence.append(sentence)
+            sentence_review.append(review)
+            sentence += 1
+    return (np.array(tokens, dtype=np.int64), np.array(signs),
+            np.array(token_sentence, dtype=np.int64),
+            np.array(sentence_review, dtype=np.int64))
+
+
+def score_flat(tokens: np.ndarray, signs: np.ndarray, token_sentence: np.ndarray,
+               sentence_review: np.ndarray, reviews: int) -> np.ndarray:
+    """Оценки аспектов (reviews, 3) в [-1, 1]; NaN — аспект не упоминался.
+
+    Полярность предложения относится ко всем аспектам, упомянутым в нём.
+    Оценка аспекта — (позитивные − негативные) / все оценочные слова по
+    таким предложениям; 0 — аспект упомянут без оценки.
+    """
+    sentences = len(sentence_review)
+    polarity = POLARITY[tokens] * signs
+    # Поток предложений: сумма полярности и число оценочных слов
+    net = np.bincount(token_sentence, weights=polarity, minlength=sentences)
+    magnitude = np.bincount(token_sentence, weights=np.abs(polarity), minlength=sentences)
+    mentions = np.stack([
+        np.bincount(token_sentence, weights=ASPECT_MATRIX[tokens, a], minlength=sentences) > 0
+        for a in range(len(ASPECTS))
+    ], axis=1)
+
+    scores = np.full((reviews, len(ASPECTS)), np.nan)
+    for a in range(len(ASPECTS)):
+        mentioned = mentions[:, a]
+        review_net = np.bincount(sentence_review, weights=net * mentioned, minlength=reviews)
+        review_magnitude = np.bincount(sentence_review, weights=magnitude * mentioned,
+                                       minlength=reviews)
+        review_mentions = np.bincount(sentence_review, weights=mentioned, minlength=reviews)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            value = np.where(review_magnitude > 0, review_net / review_magnitude, 0.0)
+        scores[:, a] = np.where(review_mentions > 0, value, np.nan)
+    return scores
+
+
+class AspectScorer:
+    """Пакетная оценка аспектов по всей истории отзывов"""
+
+    def __init__(self, batch_size: int = 2000):
+        self.batch_size = batch_size
+        self._nlp = None
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    async def ready(self) -> bool:
+        async with self._load_lock:
+            if not self._loaded:
+                self._nlp = await asyncio.to_thread(load_nlp)
+                self._loaded = True
+        return self._nlp is not None
+
+    def score_texts(self, texts: List[str]) -> np.ndarray:
+        # Сырые тексты: clean_text убирает знаки препинания, а с ними и
+        # границы предложений
+        docs = self._nlp.pipe(texts, batch_size=256, disable=["ner"])
+        sentences = ([[token.lemma_.lower() for token in sent if not token.is_punct]
+                      for sent in doc.sents] for doc in docs)
+        return score_flat(*flatten(sentences), reviews=len(texts))
+
+    async def score_history(self, session_maker) -> int:
+        """Один проход по отзывам без оценок (или со старой версией словаря)"""
+        if not await self.ready():
+            return 0
+        table = Feedback.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("row_id"))
+            .values(menu_sentiment=bindparam("menu"), staff_sentiment=bindparam("staff"),
+                    cleanliness_sentiment=bindparam("cleanliness"),
+                    aspects_version=LEXICON_VERSION)
+        )
+        scored, last_id = 0, 0
+        while True:
+            async with session_maker() as session:
+                rows = (await session.execute(
+                    select(Feedback.id, Feedback.review_text)
+                    .where(Feedback.id > last_id,
+                           or_(Feedback.aspects_version.is_(None),
+                               Feedback.aspects_version != LEXICON_VERSION))
+                    .order_by(Feedback.id)
+                    .limit(self.batch_size)
+                )).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            ids, texts = zip(*rows)
+            scores = await asyncio.to_thread(self.score_texts, list(texts))
+            # NaN в БД — NULL
+            params = [{"row_id": feedback_id,
+                       **{aspect: None if np.isnan(value) else round(float(value), 3)
+                          for aspect, value in zip(ASPECTS, row)}}
+                      for feedback_id, row in zip(ids, scores)]
+            async with session_maker() as session:
+                await session.execute(statement, params)
+                await session.commit()
+            scored += len(rows)
+        if scored:
+            logger.info("Оценены аспекты отзывов: %s", scored)
+        return scored
+
+
+async def run_aspect_scoring(scorer: AspectScorer, session_maker, interval: float = 3600):
+    """Фоновая задача: догоняет оценки аспектов по новым отзывам"""
+    while True:
+        try:
+            await scorer.score_history(session_maker)
+        except Exception:
+            logger.exception("Ошибка оценки аспектов")
+        await asyncio.sleep(interval)
+
+
+# ========== Расхождения текста и оценок ==========
+
+_PAIRS = (
+    ("menu", Feedback.menu_rating, Feedback.menu_sentiment),
+    ("staff", Feedback.staff_rating, Feedback.staff_sentiment),
+    ("cleanliness", Feedback.cleanliness_rating, Feedback.cleanliness_sentiment),
+)
+
+
+def mismatch_condition(threshold: float = 0.5):
+    """Высокая оценка при негативном тексте об аспекте — или наоборот"""
+    return or_(*(
+        or_(and_(rating >= 4, sentiment <= -threshold),
+            and_(rating <= 2, sentiment >= threshold))
+        for _, rating, sentiment in _PAIRS
+    ))
+
+
+async def render_mismatches(repository, place: Optional[PlaceEnum],
+                            limit: int = 10) -> str:
+    # Только нужные колонки: фото и превью не читаются
+    feedbacks = await repository.aspect_reviews(mismatch_condition(), place, limit)
+
+    title = place.value if place else "все заведения"
+    if not feedbacks:
+        return f"🔀 Текст и оценки совпадают ({title})"
+    text = f"🔀 <b>Текст расходится с оценками</b> ({title}):\n\n"
+    for fb in feedbacks:
+        details = []
+        for aspect, rating, sentiment in _PAIRS:
+            value = getattr(fb, sentiment.key)
+            if value is not None:
+                details.append(f"{ASPECT_NAMES[aspect]} {getattr(fb, rating.key)}★/"
+                               f"{value:+.1f}")
+        text += (f"#{fb.id} · {fb.place.value} · {', '.join(details)}\n"
+                 f"📝 {escape(fb.review_text[:150])}\n\n")
+    return text
+
+
+# ========== Бенчмарк ==========
+
+def _bench(reviews: int = 200_000):
+    import random
+    import time
+
+    rng = random.Random(3)
+    words = VOCABULARY + ["и", "было", "очень", "мы", "заказали", "в", "зале"] * 20
+    history = [[[rng.choice(words) for _ in range(rng.randint(4, 12))]
+                for _ in range(rng.randint(1, 3))] for _ in range(reviews)]
+
+    start = time.perf_counter()
+    flat = flatten(history)
+    flattened = time.perf_counter() - start
+    start = time.perf_counter()
+    scores = score_flat(*flat, reviews=reviews)
+    print(f"{reviews} отзывов: разбор {flattened:.2f} с, "
+          f"матричный подсчёт {time.perf_counter() - start:.3f} с, "
+          f"оценено аспектов {np.count_nonzero(~np.isnan(scores))}")
+
+    example = [[["официант", "быть", "грубый"], ["паста", "не", "вкусный"],
+                ["зато", "чисто"]]]
+    print({aspect: float(value)
+           for aspect, value in zip(ASPECTS, score_flat(*flatten(example), reviews=1)[0])})
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,254 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DURATION = REGISTRY.histogram(
+    "gate88_backup_duration_seconds",
+    "Длительность снимка базы (копирование, проверка, сжатие)",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+@dataclass
+class Snapshot:
+    path: str
+    size: int
+    seconds: float
+    counts: Dict[str, int]
+
+
+def table_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    tables = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    return {name: conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            for name in sorted(tables)}
+
+
+def check_integrity(conn: sqlite3.Connection):
+    result = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    if result != ["ok"]:
+        raise RuntimeError(f"Снимок повреждён: {'; '.join(result[:5])}")
+
+
+def restore_snapshot(path: str, target: str):
+    """Распаковывает снимок в target (файл должен отсутствовать или быть не нужен)"""
+    tmp = f"{target}.restore"
+    with gzip.open(path, "rb") as src, open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp, target)
+
+
+def verify_snapshot(path: str, expected: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """Восстанавливает снимок во временный файл и проверяет его.
+
+    Возвращает число строк по таблицам; если передан expected,
+    требует совпадения с ним.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        target = os.path.join(directory, "restored.db")
+        restore_snapshot(path, target)
+        conn = sqlite3.connect(target)
+        try:
+            check_integrity(conn)
+            counts = table_counts(conn)
+        finally:
+            conn.close()
+    if expected is not None and counts != expected:
+        raise RuntimeError(f"Строки в снимке не совпадают: {counts} != {expected}")
+    return counts
+
+
+class SQLiteBackup:
+    """Снимки живой базы SQLite через online backup API, в отдельном потоке.
+
+    База бота работает в режиме WAL (make_engine): копия одним шагом
+    читает согласованный срез базы, а бот всё это время продолжает писать.
+    Для базы в режиме rollback journal страницы копируются порциями по
+    pages с паузой sleep между ними, и между шагами бот может писать.
+    Но любая запись другим соединением заставляет SQLite начать
+    копирование заново. После max_restarts таких повторов снимок делается
+    одним шагом, и на время копирования файла запись блокируется.
+    Копия переводится в обычный журнал (один файл), проверяется
+    (integrity_check), сжимается gzip; хранятся последние keep снимков.
+    """
+
+    def __init__(self, db_path: str, directory: str = "backups", keep: int = 7,
+                 pages: int = 1024, sleep: float = 0.01, max_restarts: int = 5):
+        self.db_path = db_path
+        self.directory = directory
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+        self.max_restarts = max_restarts
+        self.last: Optional[Snapshot] = None
+        self._lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def _prefix(self) -> str:
+        return os.path.splitext(os.path.basename(self.db_path))[0] + "-"
+
+    def snapshots(self) -> List[str]:
+        """Снимки, старые первыми"""
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith(self._prefix) and name.endswith(".db.gz"))
+
+    def _copy(self, target: str):
+        # Не mode=ro: читающему соединению WAL-базы может понадобиться создать -shm
+        source = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            restarts = 0
+            last_remaining = None
+
+            def progress(status, remaining, total):
+                nonlocal restarts, last_remaining
+                # Оставшихся страниц стало больше — источник изменился, копия заново
+                if last_remaining is not None and remaining > last_remaining:
+                    restarts += 1
+                    if restarts > self.max_restarts:
+                        raise _TooManyRestarts()
+                last_remaining = remaining
+
+            # В WAL шаг одним куском не мешает записи, а порциями — перезапускается
+            for pages in ((-1,) if wal else (self.pages, -1)):
+                if os.path.exists(target):
+                    os.remove(target)
+                destination = sqlite3.connect(target)
+                try:
+                    source.backup(destination, pages=pages, progress=progress,
+                                  sleep=self.sleep)
+                    return
+                except _TooManyRestarts:
+                    logger.warning("База меняется слишком часто, снимок одним шагом")
+                finally:
+                    destination.close()
+        finally:
+            source.close()
+
+    def snapshot_sync(self) -> Snapshot:
+        started = time.monotonic()
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{self._prefix}{stamp}.db.gz")
+        raw = os.path.join(self.directory, f".{self._prefix}{stamp}.db")
+        try:
+            self._copy(raw)
+            conn = sqlite3.connect(raw)
+            try:
+                # Снимок — один файл, без -wal и -shm рядом
+                conn.execute("PRAGMA journal_mode=DELETE")
+                check_integrity(conn)
+                counts = table_counts(conn)
+            finally:
+                conn.close()
+
+            tmp = f"{path}.tmp"
+            with open(raw, "rb") as src, open(tmp, "wb") as out:
+                with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(raw):
+                os.remove(raw)
+
+        for old in self.snapshots()[:-self.keep]:
+            os.remove(old)
+        seconds = time.monotonic() - started
+        BACKUP_DURATION.observe(seconds)
+        self.last = Snapshot(path, os.path.getsize(path), seconds, counts)
+        logger.info("Снимок базы: %s, %.1f МБ за %.1f с", path,
+                    self.last.size / 1024 / 1024, seconds)
+        return self.last
+
+    async def snapshot(self) -> Snapshot:
+        """Снимок в отдельном потоке; одновременно идёт только один"""
+        async with self._lock:
+            return await asyncio.to_thread(self.snapshot_sync)
+
+
+async def run_backups(backup: SQLiteBackup, interval: float = 86400):
+    """Фоновая задача: снимок базы раз в interval секунд"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await backup.snapshot()
+        except Exception:
+            logger.exception("Ошибка резервного копирования")
+
+
+# ========== Проверка восстановления ==========
+
+def _restore_test(rows: int = 200000):
+    import random
+    import threading
+
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, "gate88.db")
+    conn = sqlite3.connect(db_path)
+    # Как у бота (make_engine)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE feedbacks (id INTEGER PRIMARY KEY, user_id INTEGER, "
+                 "review_text TEXT, created_at TEXT)")
+    rng = random.Random(1)
+    conn.executemany(
+        "INSERT INTO feedbacks (user_id, review_text, created_at) VALUES (?, ?, datetime('now'))",
+        ((rng.randrange(10000), "отзыв " * rng.randint(5, 60)) for _ in range(rows)))
+    conn.commit()
+    conn.close()
+
+    # Бот продолжает писать во время снимка
+    stop = threading.Event()
+    written = 0
+
+    def writer():
+        nonlocal written
+        conn = sqlite3.connect(db_path, timeout=30)
+        while not stop.is_set():
+            conn.execute("INSERT INTO feedbacks (user_id, review_text, created_at) "
+                         "VALUES (1, 'новый отзыв', datetime('now'))")
+            conn.commit()
+            written += 1
+            time.sleep(0.05)
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    backup = SQLiteBackup(db_path, os.path.join(directory, "backups"), keep=2)
+    for _ in range(3):
+        snapshot = backup.snapshot_sync()
+    stop.set()
+    thread.join()
+
+    counts = verify_snapshot(snapshot.path, expected=snapshot.counts)
+    assert rows <= counts["feedbacks"] <= rows + written, counts
+    assert len(backup.snapshots()) == 2
+    size = os.path.getsize(db_path)
+    print(f"База {size / 1024 / 1024:.1f} МБ → снимок {snapshot.size / 1024 / 1024:.1f} МБ "
+          f"за {snapshot.seconds:.1f} с; во время снимков записано {written} строк; "
+          f"восстановлено строк: {counts['feedbacks']}, integrity_check: ok")
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    _restore_test()
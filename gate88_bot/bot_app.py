@@ -0,0 +1,1755 @@
+import os
+import csv
+import asyncio
+import json
+import logging
+import tempfile
+from html import escape
+from datetime import datetime, timezone, timedelta
+from io import BytesIO
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from aiogram import Bot, Dispatcher, types, F
+from aiogram.enums import ParseMode
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import (
+    Message,
+    CallbackQuery,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    ReplyKeyboardRemove,
+    FSInputFile,
+    InputMediaPhoto,
+    BufferedInputFile,
+    InputFile,
+    MessageEntity,
+    User,
+)
+
+from admin import get_admin_kb, get_export_kb, get_analytics_kb
+from models import Base, Feedback, PlaceEnum, migrate_schema
+from metrics import setup_metrics, start_metrics_server
+from logging_setup import setup_logging, shutdown_logging
+from photo_archive import run_photo_archiver
+from images import ImagePipeline, image_extension, shrink_stored_photos
+from backups import SQLiteBackup, run_backups
+from traffic import UpdateRecorder
+from shared_state import SharedState
+from workers import run_supervisor
+from db_backend import make_engine, is_postgres, sqlite_path, copy_query_to_csv, EXPORT_CSV_QUERY
+from write_coalescer import FeedbackWriteCoalescer
+from response_cache import SingleFlightCache
+import analytics
+from cohorts import CohortAnalyzer, render_cohorts
+from digests import DigestScheduler
+from anomaly import AnomalyDetector
+from charts import ChartService
+from throttling import ThrottlingMiddleware
+from read_repository import ReadRepository, ReviewRecord
+from embeddings import EmbeddingIndex, SimilarReviews
+from dedup import DuplicateIndex
+from aspects import AspectScorer, render_mismatches, run_aspect_scoring
+from sketches import TrendSketches, render_trends
+from notifier import ChannelNotifier, Notification
+from profiling import LoopLagMonitor, MemoryTracker, SamplingProfiler, top_functions
+from retention import (ReviewArchive, RetentionManager, archived_totals, hot_totals,
+                       run_retention, to_record, totals_by_place, user_totals)
+
+
+class AdminStates(StatesGroup):
+    waiting_period = State()
+    waiting_broadcast = State()
+    waiting_export_format = State()
+    broadcast = State()
+    waiting_add_admin = State()
+    waiting_similar = State()
+
+
+def is_admin(user_id: int) -> bool:
+    """Проверяет, является ли пользователь администратором"""
+    return user_id in ADMIN_IDS
+
+
+# Настройки
+load_dotenv()
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    json_output=os.getenv("LOG_JSON", "1") == "1",
+    sample_rates=os.getenv("LOG_SAMPLE", ""),  # например "bot_app=0.1"
+    rate_limits=os.getenv("LOG_RATE_LIMIT", ""),  # записей/сек, "aiogram.event=5"
+)
+logger = logging.getLogger(__name__)
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///feedback.db")
+# Размер пула соединений (только для postgresql+asyncpg://)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(","))
+                 ) if os.getenv("ADMIN_IDS") else []
+NOTIFICATION_CHANNEL_ID = os.getenv("NOTIFICATION_CHANNEL_ID")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — метрики выключены
+# Фоновое скачивание фото в БД (по умолчанию храним только file_id)
+PHOTO_ARCHIVE = os.getenv("PHOTO_ARCHIVE", "0") == "1"
+PHOTO_ARCHIVE_INTERVAL = float(os.getenv("PHOTO_ARCHIVE_INTERVAL", "300"))
+# Архивные фото уменьшаются до PHOTO_MAX_SIDE пикселей по длинной стороне
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", "1600"))
+PHOTO_QUALITY = int(os.getenv("PHOTO_QUALITY", "80"))
+PHOTO_THUMB_SIDE = int(os.getenv("PHOTO_THUMB_SIDE", "320"))
+PHOTO_FORMAT = os.getenv("PHOTO_FORMAT", "WEBP")
+# Число процессов-обработчиков; 1 — обычный polling в одном процессе
+WORKERS = int(os.getenv("WORKERS", "1"))
+# Номер процесса-воркера (задаёт workers.py), None — основной процесс
+WORKER_INDEX = int(os.environ["WORKER_INDEX"]) if "WORKER_INDEX" in os.environ else None
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "shared_state.db")
+# Дайджесты в канал: время ежедневного (МСК) и день недели еженедельного (0 — пн)
+DIGESTS = os.getenv("DIGESTS", "1") == "1"
+DIGEST_DAILY_AT = datetime.strptime(os.getenv("DIGEST_DAILY_AT", "04:00"), "%H:%M").time()
+DIGEST_WEEKLY_DAY = int(os.getenv("DIGEST_WEEKLY_DAY", "0"))
+ANOMALY_STATE_PATH = os.getenv("ANOMALY_STATE_PATH", "anomaly_state.json")
+if WORKER_INDEX is not None:
+    # Каждый воркер видит свою часть отзывов и хранит своё состояние
+    ANOMALY_STATE_PATH = f"{ANOMALY_STATE_PATH}.{WORKER_INDEX}"
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR", "chart_cache")
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "embeddings")
+# spaCy-модель с векторами слов (md или lg; в sm их нет)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "ru_core_news_md")
+DEDUP_DIR = os.getenv("DEDUP_DIR", "dedup")
+SKETCHES_DIR = os.getenv("SKETCHES_DIR", "sketches")
+# Файловые индексы дописываются одним процессом: при WORKERS>1 они
+# по умолчанию выключены, а явное включение — ошибка конфигурации
+_INDEXES_DEFAULT = "1" if WORKERS == 1 else "0"
+SIMILAR_REVIEWS = os.getenv("SIMILAR_REVIEWS", _INDEXES_DEFAULT) == "1"
+DUPLICATE_CHECK = os.getenv("DUPLICATE_CHECK", _INDEXES_DEFAULT) == "1"
+TREND_SKETCHES = os.getenv("TREND_SKETCHES", _INDEXES_DEFAULT) == "1"
+_enabled_indexes = [name for name, on in (("SIMILAR_REVIEWS", SIMILAR_REVIEWS),
+                                          ("DUPLICATE_CHECK", DUPLICATE_CHECK),
+                                          ("TREND_SKETCHES", TREND_SKETCHES)) if on]
+if WORKERS > 1 and _enabled_indexes:
+    raise SystemExit(
+        f"WORKERS={WORKERS} несовместимо с {', '.join(_enabled_indexes)}=1: "
+        f"файловые индексы пишутся одним процессом")
+# Отзывы старше RETENTION_DAYS переносятся в месячные архивы (0 — хранить всё)
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "86400"))
+# Снимки базы SQLite: период в секундах (0 — только по команде /backup)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "86400"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# Запись входящих апдейтов (обезличенных) для воспроизведения: traffic.py
+RECORD_UPDATES = os.getenv("RECORD_UPDATES", "0") == "1"
+RECORD_DIR = os.getenv("RECORD_DIR", "traffic")
+# Период пересчёта тональности по аспектам, сек (0 — выключено)
+ASPECTS_INTERVAL = float(os.getenv("ASPECTS_INTERVAL", "3600"))
+# Монитор задержек event loop (выключен — никаких затрат)
+LOOP_LAG_MONITOR = os.getenv("LOOP_LAG_MONITOR", "0") == "1"
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+PROFILE_MAX_SECONDS = 120
+# Лимит канала — около 20 сообщений в минуту; выше порога отзывы
+# собираются в сводки раз в CHANNEL_DIGEST_WINDOW секунд
+CHANNEL_RATE_LIMIT = int(os.getenv("CHANNEL_RATE_LIMIT", "18"))
+CHANNEL_BURST_THRESHOLD = int(os.getenv("CHANNEL_BURST_THRESHOLD", "10"))
+CHANNEL_DIGEST_WINDOW = float(os.getenv("CHANNEL_DIGEST_WINDOW", "30"))
+# Лимиты нажатий: токенов в секунду и размер корзины
+THROTTLE_PUBLIC_RATE = float(os.getenv("THROTTLE_PUBLIC_RATE", "1"))
+THROTTLE_PUBLIC_BURST = int(os.getenv("THROTTLE_PUBLIC_BURST", "5"))
+THROTTLE_ADMIN_RATE = float(os.getenv("THROTTLE_ADMIN_RATE", "5"))
+THROTTLE_ADMIN_BURST = int(os.getenv("THROTTLE_ADMIN_BURST", "20"))
+# Повтор того же нажатия быстрее этого (секунды) отбрасывается; 0 — выключено
+THROTTLE_DEBOUNCE = float(os.getenv("THROTTLE_DEBOUNCE", "0.7"))
+
+
+logger.info("ID канала для уведомлений: %s", NOTIFICATION_CHANNEL_ID)
+if WORKERS > 1:
+    logger.info("WORKERS=%s: похожие отзывы, поиск дубликатов и тренды выключены", WORKERS)
+logger.info("Токен бота: %s", "установлен" if BOT_TOKEN else "отсутствует")
+
+
+# Инициализация БД
+engine = make_engine(DATABASE_URL, pool_size=DB_POOL_SIZE,
+                     max_overflow=DB_MAX_OVERFLOW)
+async_session = sessionmaker(
+    engine, expire_on_commit=False, class_=AsyncSession)
+
+# Чтение без ORM-объектов и фото
+read_repository = ReadRepository(engine)
+
+# Групповая запись отзывов (окно в мс)
+feedback_writer = FeedbackWriteCoalescer(
+    engine, window=float(os.getenv("WRITE_COALESCE_MS", "5")) / 1000)
+
+# Кулдауны и счётчики, общие для всех воркеров
+shared_state = SharedState(SHARED_STATE_PATH)
+
+# Готовый текст публичной статистики: сбрасывается при новом отзыве,
+# после архивации — во всех воркерах
+public_stats_cache = SingleFlightCache(
+    "public_stats", ttl=float(os.getenv("PUBLIC_STATS_TTL", "30")),
+    shared_state=shared_state if WORKERS > 1 else None)
+
+# Колоночный снимок отзывов для аналитики админки
+analytics_snapshot = analytics.AnalyticsSnapshot(
+    shared_state, overlap=int(os.getenv("ANALYTICS_OVERLAP", "1000")) if is_postgres(engine) else 0)
+cohort_analyzer = CohortAnalyzer(analytics_snapshot)
+
+# PNG-графики для админки: рисуются в отдельном процессе
+chart_service = ChartService(analytics_snapshot, shared_state, CHART_CACHE_DIR)
+
+# Пережатие фото и превью: в отдельном процессе
+image_pipeline = ImagePipeline(PHOTO_MAX_SIDE, PHOTO_QUALITY, PHOTO_THUMB_SIDE, PHOTO_FORMAT)
+
+# Векторный индекс отзывов для поиска похожих
+similar_reviews = (SimilarReviews(EmbeddingIndex(EMBEDDINGS_DIR, EMBEDDING_MODEL))
+                   if SIMILAR_REVIEWS else None)
+
+# MinHash-индекс для поиска копий отзывов
+duplicate_index = DuplicateIndex(DEDUP_DIR) if DUPLICATE_CHECK else None
+
+aspect_scorer = AspectScorer()
+
+# Частые фразы и уникальные гости по дням (вероятностные скетчи)
+trend_sketches = TrendSketches(SKETCHES_DIR) if TREND_SKETCHES else None
+
+# Архив старых отзывов; в статистике их заменяют сводки
+review_archive = ReviewArchive(ARCHIVE_DIR)
+retention_manager = (RetentionManager(async_session, review_archive, RETENTION_DAYS)
+                     if RETENTION_DAYS else None)
+
+# Онлайн-снимки файла базы (для PostgreSQL — штатные средства СУБД)
+database_backup = (SQLiteBackup(sqlite_path(engine), BACKUP_DIR, keep=BACKUP_KEEP)
+                   if sqlite_path(engine) else None)
+
+# Профилирование по командам админа
+loop_lag_monitor = LoopLagMonitor(threshold=LOOP_LAG_THRESHOLD_MS / 1000)
+sampling_profiler = SamplingProfiler()
+memory_tracker = MemoryTracker()
+
+# Детектор просадок оценок; состояние переживает перезапуск
+anomaly_detector = AnomalyDetector(ANOMALY_STATE_PATH)
+
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrate_schema)
+
+# Состояния опроса
+
+
+class SurveyStates(StatesGroup):
+    choosing_place = State()
+    rate_menu = State()
+    rate_staff = State()
+    rate_clean = State()
+    ask_recommend = State()
+    ask_review = State()
+    ask_photo = State()
+
+
+bot = Bot(token=BOT_TOKEN)
+dp = Dispatcher()
+
+# Уведомления в канал: по одному, а при всплеске — сводками. Лимит
+# канала общий, поэтому делится между воркерами
+channel_notifier = ChannelNotifier(
+    bot, int(NOTIFICATION_CHANNEL_ID), limit=max(1, CHANNEL_RATE_LIMIT // WORKERS),
+    burst_threshold=max(1, CHANNEL_BURST_THRESHOLD // WORKERS),
+    window=CHANNEL_DIGEST_WINDOW,
+) if NOTIFICATION_CHANNEL_ID else None
+
+throttling = ThrottlingMiddleware(
+    public_limit=(THROTTLE_PUBLIC_RATE, THROTTLE_PUBLIC_BURST),
+    admin_limit=(THROTTLE_ADMIN_RATE, THROTTLE_ADMIN_BURST),
+    debounce=THROTTLE_DEBOUNCE,
+)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+
+update_recorder = UpdateRecorder(RECORD_DIR, ADMIN_IDS) if RECORD_UPDATES else None
+if update_recorder is not None:
+    dp.update.outer_middleware(update_recorder)
+
+digest_scheduler = DigestScheduler(
+    bot, async_session, shared_state, NOTIFICATION_CHANNEL_ID,
+    daily_at=DIGEST_DAILY_AT, weekly_day=DIGEST_WEEKLY_DAY)
+
+# ========== Клавиатуры ==========
+
+
+def get_main_menu_kb(user_id: int = None):
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="🍽 Оставить отзыв",
+                                  callback_data="leave_feedback")],
+            [InlineKeyboardButton(text="⭐ Наши отзывы",
+                                  callback_data="our_feedbacks")],
+            [InlineKeyboardButton(
+                text="🗺️ Показать на карте", callback_data="show_map")],
+            [InlineKeyboardButton(text="ℹ️ О заведениях",
+                                  callback_data="about_cafes")]
+        ]
+    )
+
+    if user_id and user_id in ADMIN_IDS:  # Простая проверка без вызова функции
+        keyboard.inline_keyboard.append(
+            [InlineKeyboardButton(
+                text="👑 Админка", callback_data="admin_panel")]
+        )
+
+    return keyboard
+
+
+def get_cafe_selection_kb():
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(
+                text="🏢 Победа", callback_data="place_Победа")],
+            [InlineKeyboardButton(text="✈️ Парк Взлёт",
+                                  callback_data="place_Парк Взлёт")],
+            [InlineKeyboardButton(
+                text="🔙 Назад", callback_data="back_to_main")]
+        ]
+    )
+
+
+def get_rating_kb():
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(text=str(i), callback_data=f"rate_{i}") for i in range(1, 6)
+        ]]
+    )
+
+
+def get_yesno_kb():
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(text="Да", callback_data="recommend_yes"),
+            InlineKeyboardButton(text="Нет", callback_data="recommend_no")
+        ]]
+    )
+
+
+def get_skip_kb():
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(text="Пропустить", callback_data="skip_photo")
+        ]]
+    )
+
+# ========== Вспомогательные функции ==========
+
+
+async def calculate_average_ratings(user_id=None):
+    async with async_session() as session:
+        if user_id:
+            totals = await user_totals(session, user_id)
+        else:
+            totals = (await hot_totals(session, Feedback.duplicate_of.is_(None))
+                      + await archived_totals(session))
+    return totals.averages()
+
+
+async def save_feedback(data, photo_data=None, photo_skipped=False,
+                        photo_file_id=None, photo_file_unique_id=None):
+    signature, duplicate_of = (duplicate_index.check(data["review_text"])
+                               if duplicate_index is not None else (None, None))
+    # ID возвращается через RETURNING, без отдельного SELECT
+    feedback = await feedback_writer.submit({
+        "user_id": data["user_id"],
+        "place": data["place"],
+        "menu_rating": data["menu_rating"],
+        "staff_rating": data["staff_rating"],
+        "cleanliness_rating": data["cleanliness_rating"],
+        "recommend": data["recommend"],
+        "review_text": data["review_text"],
+        "photo_data": photo_data,
+        "photo_file_id": photo_file_id,
+        "photo_file_unique_id": photo_file_unique_id,
+        "photo_skipped": photo_skipped,
+        "duplicate_of": duplicate_of,
+    })
+    if duplicate_of is None and signature is not None:
+        # Копии из одного всплеска прошли проверку до записи друг друга
+        duplicate_of = duplicate_index.claim(feedback.id, signature)
+        if duplicate_of:
+            async with async_session() as session:
+                await session.execute(
+                    update(Feedback).where(Feedback.id == feedback.id)
+                    .values(duplicate_of=duplicate_of))
+                await session.commit()
+            feedback.duplicate_of = duplicate_of
+    if duplicate_of:
+        # Копия уходит на модерацию и не влияет на статистику
+        logger.warning("Отзыв %s похож на отзыв %s, отправлен на модерацию",
+                       feedback.id, duplicate_of)
+        return feedback
+    public_stats_cache.invalidate()
+    if similar_reviews is not None:
+        asyncio.create_task(similar_reviews.add(feedback.id, feedback.review_text))
+    if trend_sketches is not None:
+        asyncio.create_task(trend_sketches.observe(feedback))
+    for alert in anomaly_detector.observe(feedback):
+        logger.warning("Просадка оценок: %s, %s", alert.place.value, alert.criterion)
+        asyncio.create_task(send_anomaly_alert(alert))
+    return feedback
+
+
+async def send_anomaly_alert(alert):
+    if not NOTIFICATION_CHANNEL_ID:
+        return
+    try:
+        await bot.send_message(chat_id=int(NOTIFICATION_CHANNEL_ID), text=alert.text())
+    except Exception as e:
+        logger.error("Ошибка отправки сигнала о просадке: %s", e)
+
+
+# ========== Обработчики команд ==========
+
+@dp.message(Command("start"))
+async def cmd_start(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer(
+        "🍴 Добро пожаловать в \nсистему отзывов Gate 88!",
+        reply_markup=get_main_menu_kb(message.from_user.id)
+    )
+
+
+@dp.callback_query(F.data == "back_to_main")
+async def back_to_main(callback: types.CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text(
+        "Главное меню:",
+        reply_markup=get_main_menu_kb(callback.from_user.id)
+    )
+    await callback.answer()
+
+
+# ========== Обработчики главного меню ==========
+
+@dp.callback_query(F.data == "leave_feedback")
+async def start_feedback(callback: types.CallbackQuery, state: FSMContext):
+    await callback.message.edit_text(
+        "🏢 Выберите заведение для отзыва:",
+        reply_markup=get_cafe_selection_kb()
+    )
+    await state.set_state(SurveyStates.choosing_place)
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "my_feedbacks")
+async def show_my_feedbacks(callback: types.CallbackQuery):
+    ratings = await calculate_average_ratings(callback.from_user.id)
+
+    if not ratings:
+        text = "📭 У вас пока нет оставленных отзывов"
+    else:
+        text = (
+            "⭐ Ваша статистика:\n\n"
+            f"🍽 Средняя оценка меню: {ratings['avg_menu']}/5\n"
+            f"👔 Средняя оценка персонала: {ratings['avg_staff']}/5\n"
+            f"🧹 Средняя оценка чистоты: {ratings['avg_clean']}/5\n"
+            f"🔢 Общий средний балл: {ratings['avg_total']}/5\n\n"
+            f"📊 Всего отзывов: {ratings['total']}"
+        )
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(
+                    text="🔙 Назад", callback_data="back_to_main")
+            ]]
+        )
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "show_map")
+async def show_map(callback: types.CallbackQuery):
+    await callback.message.edit_text(
+        "🗺️ Наши заведения на карте:\n\n",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(
+                    text="🏢 Победа", url="https://yandex.com/maps/org/gate_88/221466389401"),
+                InlineKeyboardButton(
+                    text="✈️ Парк Взлёт", url="https://yandex.com/maps/org/gate_88/93215603368")
+            ], [
+                InlineKeyboardButton(
+                    text="🔙 Назад", callback_data="back_to_main")
+            ]]
+        ),
+        disable_web_page_preview=True
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "about_cafes")
+async def show_about_cafes(callback: types.CallbackQuery):
+    await callback.message.edit_text(
+        "ℹ️ О наших заведениях:\n\n"
+        "🏢 Победа:\n"
+        "📍 ул. Площадь 30-летия Победы, 2\n"
+        "🕒 10:00-22:00\n\n"
+        "✈️ Парк Взлёт:\n"
+        "📍 Парк Взлёт, городской округ Домодедово\n"
+        "🕒 10:00-22:00",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(
+                    text="🔙 Назад", callback_data="back_to_main")
+            ]]
+        )
+    )
+    await callback.answer()
+
+
+# ========== Обработчики админ-панели ==========
+
+def register_admin_handlers(dp: Dispatcher, session_maker):
+    @dp.callback_query(F.data == "admin_panel")
+    async def admin_panel(callback: CallbackQuery):
+        if not is_admin(callback.from_user.id):
+            await callback.answer("⛔ Доступ запрещен")
+            return
+
+        await callback.message.edit_text(
+            "👑 Админ-панель:",
+            reply_markup=get_admin_kb()
+        )
+        await callback.answer()
+
+
+@dp.callback_query(F.data == "admin_panel")
+async def admin_panel(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    await callback.message.edit_text(
+        "👑 Админ-панель:",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(
+                    text="📊 Статистика", callback_data="admin_stats")],
+                [InlineKeyboardButton(
+                    text="📈 Аналитика", callback_data="admin_analytics")],
+                [InlineKeyboardButton(
+                    text="📝 Все отзывы", callback_data="admin_reviews")],
+                [InlineKeyboardButton(
+                    text="🔎 Похожие отзывы", callback_data="admin_similar")],
+                [InlineKeyboardButton(
+                    text="🧹 Модерация", callback_data="admin_moderation")],
+                [InlineKeyboardButton(
+                    text="📤 Экспорт данных", callback_data="admin_export")],
+                [InlineKeyboardButton(
+                    text="📢 Рассылка", callback_data="admin_broadcast")],
+                [InlineKeyboardButton(
+                    text="➕ Добавить админа", callback_data="admin_add")],
+                [InlineKeyboardButton(
+                    text="🔙 В меню", callback_data="back_to_main")]
+            ]
+        )
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "admin_back")
+async def admin_back(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text(
+        "👑 Админ-панель:",
+        reply_markup=get_admin_kb()
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "admin_broadcast")
+async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    await callback.message.edit_text(
+        "📢 Введите сообщение для рассылки всем пользователям:",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(
+                    text="Отмена", callback_data="admin_back")]
+            ]
+        )
+    )
+
+    await state.set_state(AdminStates.waiting_broadcast)
+    await callback.answer()
+
+
+@dp.message(AdminStates.waiting_broadcast)
+async def process_broadcast(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+
+    async with async_session() as session:
+        user_ids = (await session.execute(
+            select(Feedback.user_id).distinct()
+        )).scalars().all()
+
+        success = 0
+        for user_id in set(user_ids):
+            try:
+                await message.copy_to(user_id)
+                success += 1
+            except:
+                continue
+
+        await message.answer(
+            f"📢 Рассылка завершена!\n"
+            f"Отправлено {success} из {len(set(user_ids))} пользователей",
+            reply_markup=get_admin_kb()
+        )
+    await state.clear()
+
+
+async def export_to_csv(feedbacks: List[ReviewRecord]):
+    filename = "feedbacks.csv"
+    with open(filename, 'w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        writer.writerow(['ID', 'User ID', 'Place', 'Menu',
+                        'Staff', 'Clean', 'Recommend', 'Review', 'Date'])
+        for fb in feedbacks:
+            writer.writerow([
+                fb.id,
+                fb.user_id,
+                fb.place.value,
+                fb.menu_rating,
+                fb.staff_rating,
+                fb.cleanliness_rating,
+                'Да' if fb.recommend else 'Нет',
+                fb.review_text,
+                fb.created_at.strftime('%Y-%m-%d %H:%M')
+            ])
+    return filename
+
+
+async def export_to_json(feedbacks: List[ReviewRecord]):
+    filename = "feedbacks.json"
+    data = [{
+        'id': fb.id,
+        'user_id': fb.user_id,
+        'place': fb.place.value,
+        'ratings': {
+            'menu': fb.menu_rating,
+            'staff': fb.staff_rating,
+            'clean': fb.cleanliness_rating
+        },
+        'recommend': fb.recommend,
+        'review': fb.review_text,
+        'date': fb.created_at.isoformat()
+    } for fb in feedbacks]
+
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+    return filename
+
+
+def get_period_kb():
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="За день", callback_data="period_day")],
+            [InlineKeyboardButton(
+                text="За неделю", callback_data="period_week")],
+            [InlineKeyboardButton(
+                text="За месяц", callback_data="period_month")],
+            [InlineKeyboardButton(text="За всё время",
+                                  callback_data="period_all")],
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")]
+        ]
+    )
+
+
+@dp.callback_query(F.data == "admin_export")
+async def admin_export(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    await callback.message.edit_text(
+        "📤 Выберите формат экспорта:",
+        reply_markup=get_export_kb()
+    )
+    await callback.answer()
+
+
+def get_export_kb():
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="CSV", callback_data="export_csv")],
+            [InlineKeyboardButton(text="JSON", callback_data="export_json")],
+            [InlineKeyboardButton(text="CSV + архив", callback_data="export_csv_archive")],
+            [InlineKeyboardButton(text="JSON + архив", callback_data="export_json_archive")],
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")]
+        ]
+    )
+
+
+@dp.callback_query(F.data.startswith("export_"))
+async def process_export(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    # export_<формат>[_archive]
+    _, format, *archive = callback.data.split("_")
+
+    if format == "csv" and not archive and is_postgres(engine):
+        # COPY ... TO STDOUT: без загрузки ORM-объектов
+        filename = await copy_query_to_csv(engine, EXPORT_CSV_QUERY, "feedbacks.csv")
+        await callback.message.answer_document(FSInputFile(filename))
+        os.remove(filename)
+        await callback.message.answer(
+            "✅ Данные успешно экспортированы",
+            reply_markup=get_admin_kb()
+        )
+        await callback.answer()
+        return
+
+    feedbacks = await read_repository.all_reviews()
+    if archive:
+        # Строка, которая ещё есть в таблице, важнее архивной копии
+        hot_ids = {fb.id for fb in feedbacks}
+        archived = await asyncio.to_thread(review_archive.records)
+        feedbacks += [record for record in archived if record.id not in hot_ids]
+
+    if format == "csv":
+        filename = await export_to_csv(feedbacks)
+    else:
+        filename = await export_to_json(feedbacks)
+
+    await callback.message.answer_document(FSInputFile(filename))
+    os.remove(filename)
+
+    await callback.message.answer(
+        "✅ Данные успешно экспортированы",
+        reply_markup=get_admin_kb()
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "admin_stats")
+async def admin_stats(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    ratings = await calculate_average_ratings() or {
+        "total": 0, "avg_menu": 0, "avg_staff": 0, "avg_clean": 0}
+    text = (
+        "📊 Общая статистика:\n\n"
+        f"• Всего отзывов: {ratings['total']}\n"
+        f"• Средняя оценка меню: {ratings['avg_menu']}/5\n"
+        f"• Средняя оценка персонала: {ratings['avg_staff']}/5\n"
+        f"• Средняя оценка чистоты: {ratings['avg_clean']}/5"
+    )
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(
+                    text="🔙 Назад", callback_data="admin_panel")
+            ]]
+        )
+    )
+    await callback.answer()
+
+
+async def get_stats(session: AsyncSession, period: timedelta = None):
+    conditions = [Feedback.duplicate_of.is_(None)]
+    if period:
+        start_date = datetime.now() - period
+        conditions.append(Feedback.created_at >= start_date)
+    totals = await hot_totals(session, *conditions)
+    if not period:
+        # Заархивированные отзывы учитываются через сводки
+        totals = totals + await archived_totals(session)
+
+    if not totals.reviews:
+        return None
+
+    stats = totals.averages()
+    stats['positive'] = totals.recommended
+    stats['with_photo'] = totals.with_photo
+    return stats
+
+
+@dp.callback_query(F.data == "admin_stats")
+async def admin_stats(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    await callback.message.edit_text(
+        "📊 Выберите период для статистики:",
+        reply_markup=get_period_kb()
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("period_"))
+async def show_stats(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    period = callback.data.split("_")[1]
+    period_map = {
+        'day': timedelta(days=1),
+        'week': timedelta(weeks=1),
+        'month': timedelta(days=30),
+        'all': None
+    }
+
+    async with async_session() as session:
+        stats = await get_stats(session, period_map.get(period))
+
+        if not stats:
+            text = "📭 Нет данных за выбранный период"
+        else:
+            text = (
+                f"📊 Статистика {'за ' + period if period != 'all' else 'за всё время'}:\n\n"
+                f"• Всего отзывов: {stats['total']}\n"
+                f"• Средняя оценка меню: {stats['avg_menu']}/5\n"
+                f"• Средняя оценка персонала: {stats['avg_staff']}/5\n"
+                f"• Средняя оценка чистоты: {stats['avg_clean']}/5\n"
+                f"• Рекомендуют: {stats['positive']} ({round(stats['positive']/stats['total']*100)}%)\n"
+                f"• С фото: {stats['with_photo']}"
+            )
+
+        await callback.message.edit_text(
+            text,
+            reply_markup=get_admin_kb()
+        )
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "admin_analytics")
+async def admin_analytics(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    await callback.message.edit_text(
+        "📈 Выберите отчёт и заведение:",
+        reply_markup=get_analytics_kb()
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("analytics_"))
+async def show_analytics(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    _, kind, place_index = callback.data.split("_")
+    place = None if place_index == "all" else analytics.PLACES[int(place_index)]
+    if kind in ("mismatch", "trends"):
+        # Оценки аспектов хранятся в БД, тренды — в скетчах: снимок не нужен
+        if kind == "mismatch":
+            text = await render_mismatches(read_repository, place)
+        elif trend_sketches is None:
+            text = "Тренды выключены (TREND_SKETCHES=0)"
+        else:
+            text = render_trends(trend_sketches, place)
+        await callback.message.edit_text(
+            text,
+            parse_mode=ParseMode.HTML,
+            reply_markup=get_analytics_kb()
+        )
+        await callback.answer()
+        return
+
+    render = {
+        "nps": analytics.render_nps,
+        "dist": analytics.render_distribution,
+        "heat": analytics.render_heatmap,
+        "cohort": lambda snapshot, place: render_cohorts(cohort_analyzer, place),
+    }[kind]
+
+    # Дочитываем только новые отзывы, дальше — вычисления в памяти
+    await analytics_snapshot.refresh(async_session)
+    text = render(analytics_snapshot, place)
+
+    await callback.message.edit_text(
+        text,
+        parse_mode=ParseMode.HTML,
+        reply_markup=get_analytics_kb()
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("chart_"))
+async def show_chart(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    _, kind, place_index = callback.data.split("_")
+    place = None if place_index == "all" else analytics.PLACES[int(place_index)]
+
+    await analytics_snapshot.refresh(async_session)
+    key = chart_service.cache_key(kind, place)
+
+    # Уже отправляли эту версию — пересылаем по file_id
+    file_id = await chart_service.cached_file_id(key)
+    if file_id:
+        await callback.message.answer_photo(file_id)
+        await callback.answer()
+        return
+
+    await callback.answer("⏳ Рисую график...")
+    path = await chart_service.render(kind, place)
+    result = await callback.message.answer_photo(FSInputFile(path))
+    await chart_service.remember_file_id(key, result.photo[-1].file_id)
+
+
+@dp.callback_query(F.data == "admin_similar")
+async def admin_similar(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+    if similar_reviews is None:
+        await callback.answer("Поиск похожих выключен (SIMILAR_REVIEWS=0)", show_alert=True)
+        return
+
+    await callback.message.edit_text(
+        "🔎 Отправьте текст (например, «холодный кофе») или ID отзыва:",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(
+                    text="Отмена", callback_data="admin_back")]
+            ]
+        )
+    )
+    await state.set_state(AdminStates.waiting_similar)
+    await callback.answer()
+
+
+@dp.message(AdminStates.waiting_similar)
+async def process_similar(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+
+    query = (message.text or "").strip()
+    if query.isdigit():
+        matches = await similar_reviews.similar_to_review(int(query))
+    else:
+        matches = await similar_reviews.similar_to_text(query)
+
+    ids = [i for i, _ in matches]
+    reviews = await read_repository.reviews_by_ids(ids)
+    missing = set(ids) - {fb.id for fb in reviews}
+    if missing:
+        # Индекс помнит и отзывы, уже перенесённые в архив
+        found = await asyncio.to_thread(review_archive.find, missing)
+        by_id = {fb.id: fb for fb in reviews}
+        by_id.update((i, to_record(item)) for i, item in found.items())
+        reviews = [by_id[i] for i in ids if i in by_id]
+    scores = dict(matches)
+    if not reviews:
+        text = "📭 Похожих отзывов не найдено"
+    else:
+        text = "🔎 Похожие отзывы:\n\n"
+        for fb in reviews:
+            text += (
+                f"#{fb.id} · {fb.place.value} · сходство {scores[fb.id]:.2f}\n"
+                f"⭐ {fb.menu_rating}/{fb.staff_rating}/{fb.cleanliness_rating}\n"
+                f"📝 {fb.review_text[:150]}\n\n"
+            )
+
+    await message.answer(text, reply_markup=get_admin_kb())
+    await state.clear()
+
+
+async def render_moderation_queue():
+    async with async_session() as session:
+        flagged = (await session.execute(
+            select(Feedback)
+            .where(Feedback.duplicate_of.is_not(None))
+            .order_by(Feedback.id)
+            .limit(5)
+        )).scalars().all()
+
+    keyboard = []
+    if not flagged:
+        text = "✅ Очередь модерации пуста"
+    else:
+        text = "🧹 Возможные копии отзывов:\n\n"
+        for fb in flagged:
+            text += (
+                f"#{fb.id} · {fb.place.value} · похож на #{fb.duplicate_of}\n"
+                f"👤 {fb.user_id}\n"
+                f"📝 {fb.review_text[:150]}\n\n"
+            )
+            keyboard.append([
+                InlineKeyboardButton(text=f"✅ #{fb.id} не копия",
+                                     callback_data=f"moderate_ok_{fb.id}"),
+                InlineKeyboardButton(text=f"🗑 Удалить #{fb.id}",
+                                     callback_data=f"moderate_del_{fb.id}"),
+            ])
+    keyboard.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel")])
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+@dp.callback_query(F.data == "admin_moderation")
+async def admin_moderation(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    text, keyboard = await render_moderation_queue()
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("moderate_"))
+async def moderate_feedback(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    _, action, feedback_id = callback.data.split("_")
+    async with async_session() as session:
+        feedback = await session.get(Feedback, int(feedback_id))
+        if feedback is None or feedback.duplicate_of is None:
+            await callback.answer("Отзыв уже обработан")
+            return
+        if action == "ok":
+            feedback.duplicate_of = None
+        else:
+            await session.delete(feedback)
+        await session.commit()
+
+    if action == "ok":
+        # Отзыв возвращается в статистику: сбрасываем кэши и снимок
+        public_stats_cache.invalidate()
+        analytics_snapshot.reset()
+        signature = (duplicate_index.signature(feedback.review_text)
+                     if duplicate_index is not None else None)
+        if signature is not None:
+            duplicate_index.add(feedback.id, signature)
+        await send_feedback_notification(feedback)
+        await callback.answer("✅ Отзыв одобрен")
+    else:
+        await callback.answer("🗑 Отзыв удалён")
+
+    text, keyboard = await render_moderation_queue()
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+
+@dp.callback_query(F.data == "admin_reviews")
+async def admin_reviews(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+
+    feedbacks = await read_repository.latest_reviews(10)
+
+    if not feedbacks:
+        text = "📭 Нет отзывов"
+    else:
+        text = "📝 Последние 10 отзывов:\n\n"
+        for fb in feedbacks:
+            text += (
+                f"📅 {fb.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+                f"👤 Пользователь: {fb.user_id}\n"
+                f"🏢 {fb.place.value}\n"
+                f"⭐ Оценки: {fb.menu_rating}/{fb.staff_rating}/{fb.cleanliness_rating}\n"
+                f"📝 {fb.review_text[:100]}{'...' if len(fb.review_text) > 100 else ''}\n\n"
+            )
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(
+                    text="🔙 Назад", callback_data="admin_panel")
+            ]]
+        )
+    )
+
+    # Превью весят килобайты — альбом вместо полноразмерных фото
+    thumbnails = await read_repository.thumbnails([fb.id for fb in feedbacks])
+    media = [
+        InputMediaPhoto(
+            media=BufferedInputFile(thumbnails[fb.id],
+                                    filename=f"thumb_{fb.id}.{image_extension(thumbnails[fb.id])}"),
+            caption=f"{fb.place.value}, {fb.created_at.strftime('%d.%m.%Y %H:%M')}")
+        for fb in feedbacks if fb.id in thumbnails
+    ]
+    if len(media) > 1:
+        await callback.message.answer_media_group(media)
+    elif media:
+        await callback.message.answer_photo(media[0].media, caption=media[0].caption)
+    await callback.answer()
+
+
+async def can_leave_feedback(user_id: int, place: PlaceEnum) -> int:
+    last_created_at = await read_repository.last_feedback_time(user_id, place)
+
+    if not last_created_at:
+        return 0
+
+    elapsed = (datetime.utcnow() - last_created_at).total_seconds()
+    remaining = 600 - int(elapsed)
+    return remaining if remaining > 0 else 0
+
+
+# ========== Обработчики процесса отзыва ==========
+
+@dp.callback_query(F.data.startswith("place_"), SurveyStates.choosing_place)
+async def process_place(callback: types.CallbackQuery, state: FSMContext):
+    try:
+        place_value = callback.data[6:]  # "place_Победа" -> "Победа"
+        place = PlaceEnum(place_value)
+
+        await state.update_data(
+            user_id=callback.from_user.id,
+            place=place
+        )
+
+        await callback.message.edit_text(
+            f"🏢 Заведение: {place.value}\n"
+            "🍽️ Оцените меню от 1 до 5:",
+            reply_markup=get_rating_kb()
+        )
+        await state.set_state(SurveyStates.rate_menu)
+    except ValueError:
+        await callback.answer("Ошибка выбора заведения")
+    finally:
+        await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("rate_"), SurveyStates.rate_menu)
+async def process_menu_rating(callback: types.CallbackQuery, state: FSMContext):
+    try:
+        rating = int(callback.data.split("_")[1])
+        await state.update_data(menu_rating=rating)
+
+        await callback.message.edit_text(
+            f"🍽️ Меню: {rating}/5\n"
+            "👔 Оцените персонал от 1 до 5:",
+            reply_markup=get_rating_kb()
+        )
+        await state.set_state(SurveyStates.rate_staff)
+    except Exception as e:
+        logger.error(f"Error processing menu rating: {e}")
+        await callback.answer("Ошибка обработки оценки")
+    finally:
+        await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("rate_"), SurveyStates.rate_staff)
+async def process_staff_rating(callback: types.CallbackQuery, state: FSMContext):
+    try:
+        rating = int(callback.data.split("_")[1])
+        await state.update_data(staff_rating=rating)
+
+        await callback.message.edit_text(
+            f"👔 Персонал: {rating}/5\n"
+            "🧹 Оцените чистоту от 1 до 5:",
+            reply_markup=get_rating_kb()
+        )
+        await state.set_state(SurveyStates.rate_clean)
+    except Exception as e:
+        logger.error(f"Error processing staff rating: {e}")
+        await callback.answer("Ошибка обработки оценки")
+    finally:
+        await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("rate_"), SurveyStates.rate_clean)
+async def process_clean_rating(callback: types.CallbackQuery, state: FSMContext):
+    try:
+        rating = int(callback.data.split("_")[1])
+        await state.update_data(cleanliness_rating=rating)
+
+        await callback.message.edit_text(
+            f"🧹 Чистота: {rating}/5\n"
+            "Порекомендуете ли вы нас друзьям?",
+            reply_markup=get_yesno_kb()
+        )
+        await state.set_state(SurveyStates.ask_recommend)
+    except Exception as e:
+        logger.error(f"Error processing cleanliness rating: {e}")
+        await callback.answer("Ошибка обработки оценки")
+    finally:
+        await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("recommend_"), SurveyStates.ask_recommend)
+async def process_recommend(callback: types.CallbackQuery, state: FSMContext):
+    try:
+        recommend = callback.data.split("_")[1] == "yes"
+        await state.update_data(recommend=recommend)
+
+        await callback.message.edit_text(
+            f"👍 Рекомендация: {'Да' if recommend else 'Нет'}\n"
+            "📝 Напишите отзыв (или 'нет' если не хотите):"
+        )
+        await state.set_state(SurveyStates.ask_review)
+    except Exception as e:
+        logger.error(f"Error processing recommendation: {e}")
+        await callback.answer("Ошибка обработки рекомендации")
+    finally:
+        await callback.answer()
+
+
+@dp.message(SurveyStates.ask_review)
+async def process_review(message: Message, state: FSMContext):
+    try:
+        review_text = "нет" if message.text.lower() == "нет" else message.text
+        await state.update_data(review_text=review_text)
+
+        await message.answer(
+            "📸 Прикрепите фото блюда или интерьера (или пропустите):",
+            reply_markup=get_skip_kb()
+        )
+        await state.set_state(SurveyStates.ask_photo)
+    except Exception as e:
+        logger.error(f"Error processing review: {e}")
+        await message.answer("Ошибка обработки отзыва")
+
+
+@dp.callback_query(F.data == "skip_photo", SurveyStates.ask_photo)
+async def skip_photo(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    retry = await can_leave_feedback(data["user_id"], data["place"])
+    if retry:
+        await callback.answer(
+            f"🚫 Спам! Следующий отзыв по этому заведению можно оставить через {retry//60} мин и {retry % 60} сек",
+            show_alert=True
+        )
+        return
+    if not is_admin(data["user_id"]):
+        retry = await can_leave_feedback(data["user_id"], data["place"])
+        if retry:
+            await callback.answer(
+                f"🚫 Спам! Следующий отзыв по этому заведению можно оставить "
+                f"через {retry//60} мин {retry % 60} сек",
+                show_alert=True
+            )
+            return
+    try:
+        feedback = await save_feedback(
+            data=data,
+            photo_data=None,
+            photo_skipped=True
+        )
+        logger.info("Отзыв сохранён, ID %s", feedback.id)
+    except Exception:
+        logger.exception("Ошибка создания Feedback")
+        raise
+    await send_feedback_notification(feedback)
+
+    await callback.message.edit_text(
+        "✅ Спасибо за отзыв!",
+        reply_markup=get_main_menu_kb(callback.from_user.id)
+    )
+    await state.clear()
+
+
+@dp.message(SurveyStates.ask_photo, F.photo)
+async def process_photo(message: Message, state: FSMContext):
+    # Сразу достаём данные состояния
+    data = await state.get_data()
+
+    # Спам-проверка (админы без ограничений)
+    if not is_admin(data["user_id"]):
+        retry = await can_leave_feedback(data["user_id"], data["place"])
+        if retry:
+            await message.answer(
+                f"🚫 Спам! Следующий отзыв по этому заведению можно оставить "
+                f"через {retry//60} мин {retry % 60} сек"
+            )
+            return
+
+    try:
+        logger.debug("== Начало обработки фото-отзыва ==")
+
+        # 1. Берём самое большое фото; сам файл остаётся в Telegram
+        photo = message.photo[-1]
+
+        # 2. Теперь data уже есть
+        logger.debug("Данные состояния: %s", data)
+
+        # 3. Сохраняем отзыв
+        feedback = await save_feedback(
+            data=data,
+            photo_file_id=photo.file_id,
+            photo_file_unique_id=photo.file_unique_id
+        )
+        logger.info("Отзыв сохранён, ID %s", feedback.id)
+
+        # 4. Отправляем уведомление
+        if NOTIFICATION_CHANNEL_ID:
+            logger.debug("Отправка в канал %s", NOTIFICATION_CHANNEL_ID)
+            try:
+                success = await send_feedback_notification(feedback)
+                logger.debug("Уведомление %s",
+                             "отправлено" if success else "не отправлено")
+            except Exception as e:
+                logger.error("Ошибка уведомления: %s", e)
+
+        # 5. Подтверждение пользователю
+        await message.answer(
+            "✅ Ваш отзыв сохранён!",
+            reply_markup=get_main_menu_kb(message.from_user.id)
+        )
+
+        # 6. Очистка состояния
+        await state.clear()
+        logger.debug("== Обработка завершена успешно ==")
+
+    except Exception as e:
+        logger.error("!!! ОШИБКА: %s", e, exc_info=True)
+        await message.answer(
+            "⚠️ Произошла ошибка. Попробуйте ещё раз.",
+            reply_markup=get_skip_kb()
+        )
+
+
+async def send_feedback_notification(feedback: Feedback):
+    if not NOTIFICATION_CHANNEL_ID:
+        return False
+    if feedback.duplicate_of:
+        # Опубликуется после одобрения модератором
+        return False
+
+    try:
+        user_chat = await bot.get_chat(feedback.user_id)
+        if user_chat.username:
+            username_disp = f"@{user_chat.username}"
+        else:
+            username_disp = escape(user_chat.first_name or "")
+    except Exception:
+        username_disp = str(feedback.user_id)
+
+    # Проверяем, не тестовый ли это отзыв
+    if feedback.id == 999:  # Наш тестовый ID
+        logger.info("Отправка ТЕСТОВОГО уведомления")
+    else:
+        logger.debug("Отправка реального отзыва ID: %s", feedback.id)
+
+    moscow_tz = timezone(timedelta(hours=3), name="MSC")
+    utc_dt = feedback.created_at.replace(tzinfo=timezone.utc)
+    local_dt = utc_dt.astimezone(moscow_tz)
+
+    date_line = f"📅 Дата отзыва: {local_dt.strftime('%d.%m.%Y %H:%M')} ({moscow_tz.tzname(None)})"
+
+    user_line = f"👤 Пользователь: {username_disp} / {feedback.user_id}"
+    place_line = f"🏢 Заведение: {feedback.place.value}"
+    ratings_line = f"⭐️ Оценки: Меню: {feedback.menu_rating}/5, Персонал: {feedback.staff_rating}/5, Чистота: {feedback.cleanliness_rating}/5"
+    review_line = f"📝 Отзыв: {escape(feedback.review_text[:100])}"
+    photo_line = f"📸 Фото: {'Есть' if feedback.has_photo else 'Нет'}"
+
+    text = "\n".join([
+        "📢 Новый отзыв!",
+        "",
+        date_line,
+        "",
+        user_line,
+        place_line,
+        ratings_line,
+        review_line,
+        photo_line
+    ])
+
+    summary = (
+        f"• {feedback.place.value} · {feedback.menu_rating}/{feedback.staff_rating}/"
+        f"{feedback.cleanliness_rating} · {username_disp}: {escape(feedback.review_text[:80])}"
+    )
+
+    photo = None
+    if feedback.has_photo:
+        # Отправка по file_id не требует скачивания и повторной загрузки;
+        # байты используются только для старых отзывов без file_id
+        photo = feedback.photo_file_id or BufferedInputFile(
+            feedback.photo_data,
+            filename=f"feedback_{feedback.id}.{image_extension(feedback.photo_data)}")
+
+    # Отправкой и лимитами канала занимается очередь
+    await channel_notifier.submit(Notification(text=text, summary=summary, photo=photo))
+    return True
+
+
+async def calculate_stats_per_place():
+    async with async_session() as session:
+        by_place = await totals_by_place(session)
+
+    stats = {}
+    total = 0
+    for place_enum, totals in by_place.items():
+        ratings = totals.averages()
+        if not ratings:
+            continue
+        stats[place_enum.value] = {
+            "count":     totals.reviews,
+            "avg_menu":  ratings["avg_menu"],
+            "avg_staff": ratings["avg_staff"],
+            "avg_clean": ratings["avg_clean"],
+            "avg_total": ratings["avg_total"],
+        }
+        total += totals.reviews
+
+    # Добавим отсутствующие места
+    for place in PlaceEnum:
+        if place.value not in stats:
+            stats[place.value] = {
+                "count":     0,
+                "avg_menu":  0.0,
+                "avg_staff": 0.0,
+                "avg_clean": 0.0,
+                "avg_total": 0.0,
+            }
+
+    return stats, total
+
+
+async def render_public_stats() -> str:
+    stats, total = await calculate_stats_per_place()
+
+    if not stats:
+        text = "📭 Отзывов пока нет"
+    else:
+        lines = ["⭐ Наша статистика:"]
+        # Чтобы порядок был фиксирован (как в enum), пробегаемся по PlaceEnum
+        for place in PlaceEnum:
+            name = place.value
+            s = stats[name]
+            lines.append("")
+            lines.append(f"<b>{name}:</b>")
+            lines.append("")
+            lines.append(f"🍽<i>Средняя оценка меню: {s['avg_menu']}/5</i>")
+            lines.append(
+                f"👔<i>Средняя оценка персонала: {s['avg_staff']}/5</i>")
+            lines.append(
+                f"🧹 <i>Средняя оценка чистоты: {s['avg_clean']}/5</i>")
+            lines.append(f"🔢<i>Общий средний балл: {s['avg_total']}/5</i>")
+
+        lines.append("")
+        lines.append(f"📊<b>Всего отзывов: {total}</b>")
+        text = "\n".join(lines)
+    return text
+
+
+@dp.callback_query(F.data == "our_feedbacks")
+async def show_our_feedbacks(callback: CallbackQuery):
+    # Одновременные нажатия (QR-код на столах) дают один запрос к БД
+    text = await public_stats_cache.get_or_compute("text", render_public_stats)
+
+    await callback.message.edit_text(
+        text=text,
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(
+                text="🔙 Назад", callback_data="back_to_main")]]
+        )
+    )
+    await callback.answer()
+
+
+# Не больше TEST_LIMIT тестов за TEST_WINDOW секунд
+TEST_LIMIT = 3
+TEST_WINDOW = 24 * 3600
+
+
+@dp.message(Command("test_notify"))
+async def test_notification(message: Message, state: FSMContext):
+    """Безопасная тестовая команда с защитой от спама"""
+    # Разрешаем только админам
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+    if await shared_state.incr("test_notify:window", ttl=TEST_WINDOW) > TEST_LIMIT:
+        await message.answer("🚫 Лимит тестов исчерпан, попробуйте завтра")
+        return
+
+    try:
+        # Защита от спама (не чаще 1 раза в 2 минуты)
+        if await shared_state.acquire_cooldown("test_notify:last", 120):
+            await message.answer("🛑 Тестировать можно не чаще чем раз в 2 минуты")
+            return
+
+        # Создаем ТОЛЬКО ОДНО тестовое уведомление
+        test_feedback = Feedback(
+            id=999,
+            user_id=message.from_user.id,  # Используем реальный ID
+            place=PlaceEnum.POBEDA,
+            menu_rating=5,
+            staff_rating=4,
+            cleanliness_rating=5,
+            recommend=True,
+            review_text=f"Тестовый отзыв от {datetime.now().strftime('%H:%M')}",
+            photo_data=None,
+            photo_skipped=True,
+            created_at=datetime.now()
+        )
+
+        # Отправляем только одно уведомление
+        success = await send_feedback_notification(test_feedback)
+
+        # Очищаем состояние, если было активно
+        current_state = await dp.storage.get_state(user=message.from_user.id)
+        if current_state:
+            await dp.storage.delete_data(chat=message.chat.id, user=message.from_user.id)
+
+        await message.answer(
+            f"Тестовое уведомление {'отправлено' if success else 'не отправлено'}\n"
+            f"Канал: {NOTIFICATION_CHANNEL_ID or 'не указан'}"
+        )
+
+    except Exception as e:
+        await message.answer(f"Ошибка теста: {str(e)}")
+        logger.error(f"Тестовая ошибка: {str(e)}", exc_info=True)
+
+
+@dp.message(Command("show_config"))
+async def show_config(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+
+    cache_stats = public_stats_cache.stats()
+    loop_lag = loop_lag_monitor.stats() if LOOP_LAG_MONITOR else "монитор выключен"
+    config = f"""
+    Текущие настройки:
+    BOT_TOKEN: {'установлен' if BOT_TOKEN else 'отсутствует'}
+    CHANNEL_ID: {NOTIFICATION_CHANNEL_ID or 'не указан'}
+    Кэш статистики: {cache_stats['hits']} попаданий, {cache_stats['misses']} промахов, {cache_stats['coalesced']} объединено
+    Event loop: {loop_lag}
+    Архив: {f'отзывы старше {RETENTION_DAYS} дн., месяцев в архиве {len(review_archive.months())}' if RETENTION_DAYS else 'выключен'}
+    Профилирование: /profile [сек], /memory [start|stop]
+    Снимки базы: {f'каждые {BACKUP_INTERVAL / 3600:g} ч, хранится {BACKUP_KEEP}' if database_backup and BACKUP_INTERVAL else 'по команде /backup' if database_backup else 'недоступны'}
+    Фото: до {PHOTO_MAX_SIDE}px, {PHOTO_FORMAT} q{PHOTO_QUALITY}; /shrink_photos — пережать старые
+    """
+    await message.answer(config)
+
+
+@dp.message(Command("shrink_photos"))
+async def shrink_photos(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+
+    await message.answer("🗜 Пережимаю сохранённые фото...")
+    processed, before, after = await shrink_stored_photos(image_pipeline, async_session)
+    if not processed:
+        await message.answer("✅ Все фото уже обработаны")
+        return
+    await message.answer(
+        f"✅ Обработано фото: {processed}\n"
+        f"Было: {before / 1024 / 1024:.1f} МБ, стало: {after / 1024 / 1024:.1f} МБ\n"
+        f"Сэкономлено: {(before - after) / 1024 / 1024:.1f} МБ\n"
+        "Файл SQLite уменьшится после VACUUM"
+    )
+
+
+@dp.message(Command("backup"))
+async def backup_database(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+
+    if database_backup is None:
+        await message.answer("⚠️ Снимки доступны только для SQLite")
+        return
+
+    await message.answer("💾 Делаю снимок базы...")
+    try:
+        snapshot = await database_backup.snapshot()
+    except Exception as e:
+        logger.exception("Ошибка снимка базы по команде")
+        await message.answer(f"❌ Снимок не удался: {e}")
+        return
+    counts = ", ".join(f"{table}: {count}" for table, count in snapshot.counts.items())
+    await message.answer(
+        f"✅ Снимок {os.path.basename(snapshot.path)}\n"
+        f"Размер: {snapshot.size / 1024 / 1024:.1f} МБ, за {snapshot.seconds:.1f} с\n"
+        f"Строк: {counts}\n"
+        f"Хранится снимков: {len(database_backup.snapshots())}"
+    )
+
+
+@dp.message(Command("profile"))
+async def profile_bot(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+
+    parts = message.text.split()
+    seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    await message.answer(f"⏱ Профилирую {seconds} сек (процесс {os.getpid()})...")
+    try:
+        collapsed = await sampling_profiler.profile(seconds)
+    except RuntimeError as e:
+        await message.answer(f"⏳ {e}")
+        return
+    # Файл открывается в speedscope.app или flamegraph.pl
+    await message.answer_document(
+        BufferedInputFile(collapsed.encode("utf-8"),
+                          filename=f"profile_{datetime.now():%Y%m%d_%H%M%S}.collapsed.txt"),
+        caption="🔥 Чаще всего на вершине стека:\n" + "\n".join(top_functions(collapsed, 8))
+    )
+
+
+@dp.message(Command("memory"))
+async def memory_snapshot(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+
+    # /memory start — точка отсчёта, /memory — рост с неё, /memory stop
+    parts = message.text.split()
+    action = parts[1] if len(parts) > 1 else ("diff" if memory_tracker.tracing else "start")
+    if action == "stop":
+        memory_tracker.stop()
+        await message.answer("🧠 Отслеживание памяти остановлено")
+    elif action == "start":
+        await asyncio.to_thread(memory_tracker.start)
+        await message.answer("🧠 Отслеживание памяти запущено. /memory — сравнить, "
+                             "/memory stop — выключить")
+    else:
+        try:
+            lines = await asyncio.to_thread(memory_tracker.diff)
+        except RuntimeError as e:
+            await message.answer(f"❌ {e}")
+            return
+        await message.answer("🧠 Рост памяти:\n<pre>" + escape("\n".join(lines)) + "</pre>",
+                             parse_mode=ParseMode.HTML)
+
+
+@dp.message(Command("digest"))
+async def show_digest(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+
+    # /digest или /digest weekly
+    parts = message.text.split()
+    kind = parts[1] if len(parts) > 1 and parts[1] in ("daily", "weekly") else "daily"
+    text = await digest_scheduler.last(kind)
+    if text is None:
+        await message.answer("Готового дайджеста ещё нет, собираю...")
+        text = await digest_scheduler.publish(kind, post=False)
+    await message.answer(text, parse_mode=ParseMode.HTML)
+
+
+async def alternative_send():
+    try:
+        await bot.send_message(
+            chat_id=int(NOTIFICATION_CHANNEL_ID),
+            text="Тестовое сообщение другим методом"
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Альтернативная отправка: {str(e)}")
+        return False
+
+
+# ========== Запуск бота ==========
+
+async def on_startup(worker: Optional[int] = None) -> List[asyncio.Task]:
+    """Подготовка процесса; возвращает фоновые задачи для on_shutdown.
+
+    worker — номер процесса-воркера: он обрабатывает апдейты, а
+    периодические задачи (архивы, снимки, дайджесты) идут один раз,
+    в основном процессе.
+    """
+    await init_db()
+    background_tasks = []
+    if METRICS_PORT:
+        setup_metrics(dp, bot, engine)
+        # Воркеры отдают свои метрики на следующих портах
+        port = METRICS_PORT if worker is None else METRICS_PORT + 1 + worker
+        await start_metrics_server(METRICS_HOST, port)
+    if LOOP_LAG_MONITOR:
+        background_tasks.append(asyncio.create_task(loop_lag_monitor.run()))
+    # Индексы нужны там, где обрабатываются апдейты
+    if worker is not None or WORKERS == 1:
+        if similar_reviews is not None:
+            background_tasks.append(asyncio.create_task(
+                similar_reviews.backfill(async_session)))
+        if duplicate_index is not None:
+            background_tasks.append(asyncio.create_task(
+                duplicate_index.backfill(async_session)))
+        if trend_sketches is not None:
+            background_tasks.append(asyncio.create_task(
+                trend_sketches.warm_up(read_repository)))
+    if worker is not None:
+        return background_tasks
+
+    if ASPECTS_INTERVAL:
+        background_tasks.append(asyncio.create_task(run_aspect_scoring(
+            aspect_scorer, async_session, interval=ASPECTS_INTERVAL)))
+    if DIGESTS:
+        background_tasks.append(asyncio.create_task(digest_scheduler.run()))
+    if retention_manager is not None:
+        def on_archived():
+            # Архивирует основной процесс: сброс расходится по воркерам
+            # через shared_state
+            analytics_snapshot.reset()
+            public_stats_cache.invalidate(broadcast=True)
+        background_tasks.append(asyncio.create_task(run_retention(
+            retention_manager, interval=RETENTION_INTERVAL, on_archived=on_archived)))
+    if database_backup is not None and BACKUP_INTERVAL:
+        background_tasks.append(asyncio.create_task(run_backups(
+            database_backup, interval=BACKUP_INTERVAL)))
+    if PHOTO_ARCHIVE:
+        background_tasks.append(asyncio.create_task(run_photo_archiver(
+            bot, async_session, interval=PHOTO_ARCHIVE_INTERVAL,
+            pipeline=image_pipeline)))
+    return background_tasks
+
+
+async def on_shutdown(background_tasks: List[asyncio.Task]):
+    """Останавливает задачи и сохраняет состояние процесса"""
+    for task in background_tasks:
+        task.cancel()
+    await feedback_writer.close()
+    if channel_notifier is not None:
+        await channel_notifier.close()
+    await bot.session.close()
+    anomaly_detector.save(ANOMALY_STATE_PATH)
+    if duplicate_index is not None:
+        duplicate_index.save()
+    if trend_sketches is not None:
+        trend_sketches.save()
+    chart_service.shutdown()
+    image_pipeline.shutdown()
+    if update_recorder is not None:
+        update_recorder.close()
+    shutdown_logging()
+
+
+async def main():
+    background_tasks = await on_startup()
+    try:
+        if WORKERS > 1:
+            # Хвост очереди уведомлений уходит сводкой, но может ждать лимита канала
+            stop_timeout = 30 + (CHANNEL_DIGEST_WINDOW + channel_notifier.period
+                                 if channel_notifier is not None else 0)
+            await run_supervisor(bot, dp, WORKERS, stop_timeout=stop_timeout)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await on_shutdown(background_tasks)
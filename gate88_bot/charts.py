@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from analytics import AnalyticsSnapshot, CRITERIA, CRITERIA_NAMES, _place_title
+from models import PlaceEnum
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+TREND_DAYS = 30
+
+
+# ========== Данные для графиков (в процессе бота) ==========
+
+def trend_data(snapshot: AnalyticsSnapshot, place: Optional[PlaceEnum],
+               days: int = TREND_DAYS) -> Dict[str, List]:
+    """Средние оценки по дням за последние days дней"""
+    today = np.datetime64("now", "D")
+    start = today - np.timedelta64(days - 1, "D")
+    selected = snapshot.mask(place) & (snapshot.created_at >= start)
+    day_index = (snapshot.created_at[selected].astype("datetime64[D]") - start).astype(np.int64)
+    counts = np.bincount(day_index, minlength=days)
+    data = {"days": [str(start + np.timedelta64(i, "D")) for i in range(days)],
+            "counts": counts.tolist()}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for name in CRITERIA:
+            sums = np.bincount(day_index, weights=getattr(snapshot, name)[selected],
+                               minlength=days)
+            # Дни без отзывов — пропуск на графике
+            data[name] = np.where(counts > 0, sums / counts, np.nan).tolist()
+    return data
+
+
+def distribution_data(snapshot: AnalyticsSnapshot,
+                      place: Optional[PlaceEnum]) -> Dict[str, List]:
+    selected = snapshot.mask(place)
+    return {name: np.bincount(getattr(snapshot, name)[selected], minlength=6)[1:6].tolist()
+            for name in CRITERIA}
+
+
+# ========== Рендер (в отдельном процессе) ==========
+
+def _render_trend(data: dict, title: str, path: str) -> str:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, (ax, ax_counts) = plt.subplots(
+        2, 1, figsize=(8, 5), sharex=True, gridspec_kw={"height_ratios": [3, 1]})
+    x = np.arange(len(data["days"]))
+    for name in CRITERIA:
+        ax.plot(x, data[name], marker="o", markersize=3, label=CRITERIA_NAMES[name])
+    ax.set_ylim(1, 5.2)
+    ax.set_title(title)
+    ax.legend(loc="lower left")
+    ax.grid(alpha=0.3)
+    ax_counts.bar(x, data["counts"], color="grey")
+    ax_counts.set_ylabel("Отзывов")
+    step = max(1, len(x) // 10)
+    ax_counts.set_xticks(x[::step])
+    ax_counts.set_xticklabels([d[5:] for d in data["days"][::step]], rotation=45)
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+    return path
+
+
+def _render_distribution(data: dict, title: str, path: str) -> str:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 4))
+    x = np.arange(1, 6)
+    width = 0.27
+    for offset, name in zip((-width, 0, width), CRITERIA):
+        ax.bar(x + offset, data[name], width, label=CRITERIA_NAMES[name])
+    ax.set_xticks(x)
+    ax.set_xticklabels([f"{i}★" for i in x])
+    ax.set_title(title)
+    ax.legend()
+    ax.grid(axis="y", alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+    return path
+
+
+CHARTS = {
+    "trend": (trend_data, _render_trend, f"Динамика оценок за {TREND_DAYS} дней", "month"),
+    "dist": (distribution_data, _render_distribution, "Распределение оценок", "all"),
+}
+
+
+class ChartService:
+    """Графики для админки с кэшем по версии данных.
+
+    Ключ кэша — (тип графика, заведение, период, версия данных), где
+    версия — последний id в снимке аналитики. PNG рисуется в отдельном
+    процессе и сохраняется на диск; после первой отправки запоминается
+    file_id из Telegram, и дальше картинка пересылается без загрузки.
+    """
+
+    def __init__(self, snapshot: AnalyticsSnapshot, shared_state: SharedState,
+                 cache_dir: str = "chart_cache", workers: int = 1):
+        self.snapshot = snapshot
+        self.shared_state = shared_state
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def cache_key(self, kind: str, place: Optional[PlaceEnum]) -> str:
+        period = CHARTS[kind][3]
+        place_key = place.name if place else "all"
+        # Трендовый график зависит ещё и от текущей даты
+        if kind == "trend":
+            period = f"{period}-{np.datetime64('now', 'D')}"
+        return f"{kind}_{place_key}_{period}_v{self.snapshot.version}"
+
+    async def cached_file_id(self, key: str) -> Optional[str]:
+        return await self.shared_state.get(f"chart_file_id:{key}")
+
+    async def remember_file_id(self, key: str, file_id: str):
+        # Старые версии не нужны: через неделю запись исчезнет сама
+        await self.shared_state.set(f"chart_file_id:{key}", file_id, ttl=7 * 24 * 3600)
+
+    async def render(self, kind: str, place: Optional[PlaceEnum]) -> str:
+        """Путь к PNG; рисует, только если такой версии ещё нет на диске"""
+        key = self.cache_key(kind, place)
+        path = os.path.join(self.cache_dir, f"{key}.png")
+        if os.path.exists(path):
+            return path
+
+        prepare, draw, title, _ = CHARTS[kind]
+        data = prepare(self.snapshot, place)
+        tmp = f"{path}.{os.getpid()}.tmp.png"
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._executor(), draw, data, f"{title} ({_place_title(place)})", tmp)
+        os.replace(tmp, path)
+        self._prune(kind, place, keep=path)
+        logger.info("График отрисован: %s", path)
+        return path
+
+    def _prune(self, kind: str, place: Optional[PlaceEnum], keep: str):
+        """Удаляет устаревшие версии того же графика"""
+        prefix = f"{kind}_{place.name if place else 'all'}_"
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(prefix) and name.endswith(".png") and path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
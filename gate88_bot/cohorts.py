@@ -0,0 +1,149 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from analytics import AnalyticsSnapshot, _place_title
+from models import PlaceEnum
+
+# Отзыв со средним баллом не выше порога считаем плохим
+BAD_RATING = 3.0
+
+
+def _months(created_at: np.ndarray) -> np.ndarray:
+    """Номер месяца с 1970-01 для каждой строки"""
+    return created_at.astype("datetime64[M]").astype(np.int64)
+
+
+def _month_label(month: int) -> str:
+    return str(np.datetime64(int(month), "M"))
+
+
+def retention_matrix(user_id: np.ndarray, created_at: np.ndarray
+                     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Матрица удержания: месяц первого визита × месяцев спустя.
+
+    Возвращает (месяцы когорт, размеры когорт, доли вернувшихся),
+    где доли[i, k] — часть когорты i, оставившая отзыв через k месяцев.
+    """
+    if not len(user_id):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty((0, 0))
+    users, user_index = np.unique(user_id, return_inverse=True)
+    months = _months(created_at)
+
+    first = np.full(len(users), np.iinfo(np.int64).max)
+    np.minimum.at(first, user_index, months)
+
+    # Уникальные пары (пользователь, месяц активности)
+    span = months.max() - months.min() + 1
+    pairs = np.unique(user_index * span + (months - months.min()))
+    pair_user = pairs // span
+    pair_month = pairs % span + months.min()
+
+    cohort_months, cohort_index = np.unique(first, return_inverse=True)
+    pair_cohort = cohort_index[pair_user]
+    offset = pair_month - first[pair_user]
+    width = int(offset.max()) + 1
+
+    active = np.bincount(pair_cohort * width + offset,
+                         minlength=len(cohort_months) * width
+                         ).reshape(len(cohort_months), width)
+    sizes = active[:, 0]
+    return cohort_months, sizes, active / sizes[:, None]
+
+
+def loyalty(user_id: np.ndarray) -> Dict[str, float]:
+    """Доля вернувшихся и среднее число отзывов на гостя"""
+    if not len(user_id):
+        return {"guests": 0, "repeat_share": 0.0, "visits_per_guest": 0.0}
+    _, counts = np.unique(user_id, return_counts=True)
+    return {
+        "guests": int(len(counts)),
+        "repeat_share": round(float(np.mean(counts > 1)) * 100, 1),
+        "visits_per_guest": round(float(counts.mean()), 2),
+    }
+
+
+def return_after_first_rating(user_id: np.ndarray, created_at: np.ndarray,
+                              average: np.ndarray) -> Dict[str, Optional[float]]:
+    """Доля вернувшихся после плохого и хорошего первого отзыва"""
+    if not len(user_id):
+        return {"bad": None, "good": None, "bad_guests": 0, "good_guests": 0}
+    order = np.lexsort((created_at, user_id))
+    sorted_users = user_id[order]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_users)])
+    first_bad = average[order][starts] <= BAD_RATING
+    returned = counts > 1
+
+    def share(selected):
+        return round(float(returned[selected].mean()) * 100, 1) if selected.any() else None
+
+    return {
+        "bad": share(first_bad),
+        "good": share(~first_bad),
+        "bad_guests": int(first_bad.sum()),
+        "good_guests": int((~first_bad).sum()),
+    }
+
+
+class CohortAnalyzer:
+    """Когортный анализ поверх снимка аналитики.
+
+    Результаты кэшируются по заведению и пересчитываются, только
+    когда в снимке появились новые строки.
+    """
+
+    def __init__(self, snapshot: AnalyticsSnapshot):
+        self.snapshot = snapshot
+        self._cache: Dict[Optional[PlaceEnum], Tuple[str, dict]] = {}
+
+    def report(self, place: Optional[PlaceEnum] = None) -> dict:
+        version = self.snapshot.version
+        cached = self._cache.get(place)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        snapshot = self.snapshot
+        selected = snapshot.mask(place)
+        user_id = snapshot.user_id[selected]
+        created_at = snapshot.created_at[selected]
+        average = (snapshot.menu[selected].astype(np.float32)
+                   + snapshot.staff[selected] + snapshot.clean[selected]) / 3
+
+        cohort_months, sizes, matrix = retention_matrix(user_id, created_at)
+        result = {
+            "cohort_months": cohort_months,
+            "sizes": sizes,
+            "matrix": matrix,
+            "loyalty": loyalty(user_id),
+            "after_first": return_after_first_rating(user_id, created_at, average),
+        }
+        self._cache[place] = (version, result)
+        return result
+
+
+def render_cohorts(analyzer: CohortAnalyzer, place: Optional[PlaceEnum] = None,
+                   cohorts: int = 6, offsets: int = 6) -> str:
+    report = analyzer.report(place)
+    if not len(report["sizes"]):
+        return "📭 Нет данных"
+
+    lines = [f"👥 Удержание гостей ({_place_title(place)}):", ""]
+    header = "Когорта   Гостей " + " ".join(f"+{k}м".rjust(4) for k in range(1, offsets))
+    rows = [header]
+    for month, size, shares in list(zip(report["cohort_months"], report["sizes"],
+                                        report["matrix"]))[-cohorts:]:
+        cells = [f"{share * 100:3.0f}%" for share in shares[1:offsets]]
+        rows.append(f"{_month_label(month)}  {size:6} " + " ".join(cells))
+    lines.append("<pre>" + "\n".join(rows) + "</pre>")
+
+    loyal = report["loyalty"]
+    lines.append(f"• Гостей: {loyal['guests']}, вернулись: {loyal['repeat_share']}%, "
+                 f"отзывов на гостя: {loyal['visits_per_guest']}")
+    after = report["after_first"]
+    if after["bad"] is not None and after["good"] is not None:
+        lines.append(
+            f"• Вернулись после плохого первого отзыва (≤{BAD_RATING:g}): {after['bad']}% "
+            f"из {after['bad_guests']}, после хорошего: {after['good']}% "
+            f"из {after['good_guests']}")
+    return "\n".join(lines)
@@ -0,0 +1,358 @@
+import asyncio
+import json
+import logging
+import os
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, func, select, update
+
+from models import Feedback
+from text_utils import clean_text
+
+logger = logging.getLogger(__name__)
+
+# Простое число Мерсенна 2^31 − 1: a·x + b не переполняет uint64
+_PRIME = np.uint64((1 << 31) - 1)
+_KEY_MULTIPLIER = np.uint64(0x100000001B3)
+
+
+def shingles(text: str, size: int = 5) -> np.ndarray:
+    """Хэши символьных n-грамм очищенного текста"""
+    if len(text) <= size:
+        return np.array([zlib.crc32(text.encode())], dtype=np.uint64)
+    return np.fromiter(
+        (zlib.crc32(text[i:i + size].encode()) for i in range(len(text) - size + 1)),
+        dtype=np.uint64,
+    )
+
+
+class DuplicateIndex:
+    """Поиск почти одинаковых отзывов: MinHash + LSH.
+
+    Сигнатура отзыва — num_perm минимумов хэшей его символьных 5-грамм.
+    Сигнатура режется на bands полос; отзывы, у которых совпала хотя бы
+    одна полоса, — кандидаты, и похожесть проверяется уже по всей
+    сигнатуре. Для каждой полосы хранится отсортированный массив ключей,
+    поэтому поиск — bands двоичных поисков, а не проход по всем отзывам.
+    Новые ключи копятся в словаре и вливаются в массивы пачками.
+
+    Сигнатуры и id дописываются в файлы в directory (как в
+    EmbeddingIndex); таблицы полос сохраняются в save() и
+    пересобираются из сигнатур, если файл устарел.
+    """
+
+    def __init__(self, directory: str = "dedup", num_perm: int = 64, bands: int = 8,
+                 threshold: float = 0.8, min_words: int = 5, seed: int = 88,
+                 merge_every: int = 4096, max_candidates: int = 1000):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._signatures_path = os.path.join(directory, "signatures.u32")
+        self._ids_path = os.path.join(directory, "ids.i64")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._bands_path = os.path.join(directory, "bands.npz")
+        self.threshold = threshold
+        self.min_words = min_words
+        self.merge_every = merge_every
+        self.max_candidates = max_candidates
+
+        if os.path.exists(self._meta_path):
+            # Параметры хэширования должны совпадать с уже сохранёнными
+            with open(self._meta_path, encoding="utf-8") as file:
+                meta = json.load(file)
+            num_perm, bands, seed = meta["num_perm"], meta["bands"], meta["seed"]
+        else:
+            with open(self._meta_path, "w", encoding="utf-8") as file:
+                json.dump({"num_perm": num_perm, "bands": bands, "seed": seed}, file)
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.band_size = num_perm // bands
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+
+        self.ids = np.empty(0, dtype=np.int64)
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._keys: List[np.ndarray] = [np.empty(0, dtype=np.uint64)] * bands
+        self._rows: List[np.ndarray] = [np.empty(0, dtype=np.uint32)] * bands
+        self._pending: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+        self._pending_count = 0
+        self._load()
+
+    # ========== Хранение ==========
+
+    def _load(self):
+        if os.path.exists(self._ids_path):
+            self.ids = np.fromfile(self._ids_path, dtype=np.int64)
+        self._map_signatures()
+        if not len(self.ids):
+            return
+        if os.path.exists(self._bands_path):
+            with np.load(self._bands_path) as saved:
+                if int(saved["count"]) == len(self.ids):
+                    self._keys = list(saved["keys"])
+                    self._rows = list(saved["rows"])
+                    return
+        self._rebuild_bands()
+
+    def _map_signatures(self):
+        if len(self.ids):
+            self.signatures = np.memmap(self._signatures_path, dtype=np.uint32, mode="r",
+                                        shape=(len(self.ids), self.num_perm))
+
+    def _rebuild_bands(self):
+        keys = self.band_keys(np.asarray(self.signatures))
+        for band in range(self.bands):
+            order = np.argsort(keys[:, band], kind="stable")
+            self._keys[band] = keys[order, band]
+            self._rows[band] = order.astype(np.uint32)
+        logger.info("Таблицы LSH пересобраны: %s отзывов", len(self.ids))
+
+    def save(self):
+        """Сохраняет таблицы полос, чтобы не пересобирать их при запуске"""
+        self._merge_pending()
+        tmp = f"{self._bands_path}.tmp.npz"
+        np.savez(tmp, count=len(self.ids), keys=np.array(self._keys),
+                 rows=np.array(self._rows))
+        os.replace(tmp, self._bands_path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def max_id(self) -> int:
+        return int(self.ids.max()) if len(self.ids) else 0
+
+    # ========== MinHash ==========
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Сигнатура отзыва; None для коротких текстов"""
+        cleaned = clean_text(text or "")
+        # Короткие «всё отлично» совпадают у разных людей честно
+        if len(cleaned.split()) < self.min_words:
+            return None
+        hashes = shingles(cleaned) % _PRIME
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """Ключи полос: (N, num_perm) → (N, bands)"""
+        signatures = signatures.reshape(len(signatures), self.bands, self.band_size)
+        keys = np.zeros(signatures.shape[:2], dtype=np.uint64)
+        for row in range(self.band_size):
+            keys = keys * _KEY_MULTIPLIER ^ signatures[:, :, row].astype(np.uint64)
+        return keys
+
+    # ========== LSH ==========
+
+    def find(self, signature: np.ndarray,
+             exclude_id: Optional[int] = None) -> Optional[Tuple[int, float]]:
+        """Самый похожий сохранённый отзыв выше порога: (id, оценка Жаккара)"""
+        if not len(self.ids):
+            return None
+        keys = self.band_keys(signature[None, :])[0]
+        candidates = []
+        for band, key in enumerate(keys):
+            start = np.searchsorted(self._keys[band], key, side="left")
+            end = np.searchsorted(self._keys[band], key, side="right")
+            # У «горячих» ключей смотрим только последние записи
+            candidates.append(self._rows[band][max(start, end - self.max_candidates):end])
+            pending = self._pending[band].get(int(key))
+            if pending:
+                candidates.append(np.array(pending[-self.max_candidates:], dtype=np.uint32))
+        candidates = np.unique(np.concatenate(candidates))
+        if not len(candidates):
+            return None
+        similarity = (self.signatures[candidates] == signature).mean(axis=1)
+        if exclude_id is not None:
+            similarity[self.ids[candidates] == exclude_id] = 0
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return int(self.ids[candidates[best]]), float(similarity[best])
+
+    def add(self, feedback_id: int, signature: np.ndarray):
+        self.add_many([feedback_id], signature[None, :])
+
+    def add_many(self, ids, signatures: np.ndarray):
+        """Дописывает сигнатуры; ключи полос сначала попадают в буфер"""
+        if not len(ids):
+            return
+        signatures = np.asarray(signatures, dtype=np.uint32)
+        first_row = len(self.ids)
+        with open(self._signatures_path, "ab") as file:
+            file.write(signatures.tobytes())
+        with open(self._ids_path, "ab") as file:
+            file.write(np.asarray(ids, dtype=np.int64).tobytes())
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self._map_signatures()
+
+        keys = self.band_keys(signatures)
+        rows = np.arange(first_row, first_row + len(ids), dtype=np.uint32)
+        if len(ids) >= self.merge_every:
+            # Большую пачку (бэкфилл) вливаем сразу, минуя словарь
+            for band in range(self.bands):
+                self._insert_sorted(band, keys[:, band], rows)
+            return
+        for row, row_keys in zip(rows, keys):
+            for band, key in enumerate(row_keys):
+                self._pending[band].setdefault(int(key), []).append(int(row))
+        self._pending_count += len(ids)
+        if self._pending_count >= self.merge_every:
+            self._merge_pending()
+
+    def _insert_sorted(self, band: int, keys: np.ndarray, rows: np.ndarray):
+        """Вставка в отсортированные массивы полосы за O(N)"""
+        order = np.argsort(keys, kind="stable")
+        positions = np.searchsorted(self._keys[band], keys[order], side="right")
+        self._keys[band] = np.insert(self._keys[band], positions, keys[order])
+        self._rows[band] = np.insert(self._rows[band], positions, rows[order])
+
+    def _merge_pending(self):
+        """Вливает буфер новых ключей в отсортированные массивы"""
+        if not self._pending_count:
+            return
+        for band, pending in enumerate(self._pending):
+            keys = np.fromiter((k for k, rows in pending.items() for _ in rows),
+                               dtype=np.uint64)
+            rows = np.fromiter((r for rows in pending.values() for r in rows),
+                               dtype=np.uint32)
+            self._insert_sorted(band, keys, rows)
+            pending.clear()
+        self._pending_count = 0
+
+    # ========== Связь с БД ==========
+
+    def check(self, text: str) -> Tuple[Optional[np.ndarray], Optional[int]]:
+        """(сигнатура, id оригинала) для нового отзыва"""
+        signature = self.signature(text)
+        if signature is None:
+            return None, None
+        match = self.find(signature)
+        return signature, match[0] if match else None
+
+    def contains(self, feedback_id: int) -> bool:
+        return bool((self.ids == feedback_id).any())
+
+    def claim(self, feedback_id: int, signature: np.ndarray) -> Optional[int]:
+        """Повторная проверка уже записанного отзыва и добавление в индекс.
+
+        Копии из одного всплеска проходят check() одновременно, пока
+        ни одна не записана. claim() выполняется без await, поэтому в
+        индекс попадает только первая копия, а остальные получают её id.
+        """
+        match = self.find(signature, exclude_id=feedback_id)
+        if match:
+            return match[0]
+        # Отзыв мог успеть проиндексировать backfill
+        if not self.contains(feedback_id):
+            self.add(feedback_id, signature)
+        return None
+
+    async def backfill(self, session_maker, batch_size: int = 2000) -> int:
+        """Индексирует старые отзывы и помечает дубликаты среди них.
+
+        Обрабатываются только отзывы, существовавшие на момент запуска:
+        новые индексирует save_feedback (claim). Отзыв, записанный во
+        время запуска, может попасть и туда и сюда — такие пропускаются.
+        """
+        last_id = self.max_id
+        start_rows = len(self.ids)
+        async with session_maker() as session:
+            upper = (await session.execute(select(func.max(Feedback.id)))).scalar() or 0
+        flagged = 0
+        while last_id < upper:
+            async with session_maker() as session:
+                rows = (await session.execute(
+                    select(Feedback.id, Feedback.review_text)
+                    .where(Feedback.id > last_id, Feedback.id <= upper,
+                           Feedback.duplicate_of.is_(None))
+                    .order_by(Feedback.id)
+                    .limit(batch_size)
+                )).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            signatures = await asyncio.to_thread(
+                lambda: [self.signature(text) for _, text in rows])
+            duplicates = []
+            # Проиндексированные save_feedback после начала backfill
+            live = set(self.ids[start_rows:].tolist())
+            for (feedback_id, _), signature in zip(rows, signatures):
+                if signature is None or feedback_id in live:
+                    continue
+                match = self.find(signature, exclude_id=feedback_id)
+                if match:
+                    duplicates.append({"row_id": feedback_id, "original": match[0]})
+                else:
+                    self.add(feedback_id, signature)
+            if duplicates:
+                async with session_maker() as session:
+                    await session.execute(
+                        update(Feedback.__table__)
+                        .where(Feedback.__table__.c.id == bindparam("row_id"))
+                        .values(duplicate_of=bindparam("original")),
+                        duplicates,
+                    )
+                    await session.commit()
+                flagged += len(duplicates)
+        if flagged:
+            logger.warning("Среди старых отзывов найдено дубликатов: %s", flagged)
+        self.save()
+        return flagged
+
+
+# ========== Бенчмарк ==========
+
+def _bench(stored: int = 1_000_000, lookups: int = 2000):
+    import shutil
+    import tempfile
+    import time
+
+    directory = tempfile.mkdtemp()
+    try:
+        index = DuplicateIndex(directory)
+        rng = np.random.default_rng(1)
+        # Случайные сигнатуры ведут себя как сигнатуры разных текстов
+        start = time.perf_counter()
+        for chunk in range(0, stored, 100_000):
+            size = min(100_000, stored - chunk)
+            index.add_many(np.arange(chunk + 1, chunk + size + 1),
+                           rng.integers(0, 1 << 31, size=(size, index.num_perm),
+                                        dtype=np.uint32))
+        index.save()
+        print(f"Заполнение: {stored} сигнатур за {time.perf_counter() - start:.1f} с")
+
+        original = ("Заказал пасту карбонара, принесли через сорок минут холодную, "
+                    "официант грубил, больше не приду")
+        copy = original.replace("сорок", "сорок пять").upper() + "!!!"
+        signature = index.signature(original)
+        index.add(stored + 1, signature)
+
+        start = time.perf_counter()
+        for _ in range(lookups):
+            signature, match = index.check(copy)
+        elapsed = time.perf_counter() - start
+        assert match == stored + 1, match
+        print(f"Поиск (сигнатура + LSH): {elapsed / lookups * 1e6:.0f} мкс на отзыв")
+
+        miss = index.signature("Очень понравилось обслуживание, десерты свежие и вкусные")
+        start = time.perf_counter()
+        for _ in range(lookups):
+            assert index.find(miss) is None
+        print(f"Поиск без совпадения: {(time.perf_counter() - start) / lookups * 1e6:.0f} мкс")
+
+        start = time.perf_counter()
+        reloaded = DuplicateIndex(directory)
+        assert reloaded.find(signature)[0] == stored + 1
+        print(f"Загрузка с диска: {time.perf_counter() - start:.2f} с")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    _bench()
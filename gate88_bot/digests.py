@@ -0,0 +1,171 @@
+import asyncio
+import html
+import logging
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, Optional
+
+from aiogram import Bot
+from sqlalchemy import Integer, cast, select, func, or_
+
+from models import Feedback, PlaceEnum
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+MOSCOW_TZ = timezone(timedelta(hours=3), name="MSC")
+PERIODS = {"daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+TITLES = {"daily": "за день", "weekly": "за неделю"}
+WORST_LIMIT = 3
+
+
+async def _aggregates(session, start: datetime, end: datetime) -> Dict[PlaceEnum, dict]:
+    rows = (await session.execute(
+        select(
+            Feedback.place,
+            func.count(Feedback.id),
+            func.avg(Feedback.menu_rating),
+            func.avg(Feedback.staff_rating),
+            func.avg(Feedback.cleanliness_rating),
+            func.sum(cast(Feedback.recommend, Integer)),
+            func.count(Feedback.id).filter(or_(
+                Feedback.photo_file_id.is_not(None), Feedback.photo_data.is_not(None))),
+        )
+        .where(Feedback.created_at >= start, Feedback.created_at < end,
+               Feedback.duplicate_of.is_(None))
+        .group_by(Feedback.place)
+    )).all()
+    return {
+        place: {
+            "count": count,
+            "avg_menu": float(menu or 0),
+            "avg_staff": float(staff or 0),
+            "avg_clean": float(clean or 0),
+            "recommend": int(recommend or 0),
+            "photos": photos,
+        }
+        for place, count, menu, staff, clean, recommend, photos in rows
+    }
+
+
+async def _worst_reviews(session, place: PlaceEnum, start: datetime, end: datetime):
+    total = Feedback.menu_rating + Feedback.staff_rating + Feedback.cleanliness_rating
+    return (await session.execute(
+        select(Feedback.menu_rating, Feedback.staff_rating,
+               Feedback.cleanliness_rating, Feedback.review_text)
+        .where(Feedback.place == place,
+               Feedback.created_at >= start, Feedback.created_at < end,
+               Feedback.duplicate_of.is_(None))
+        .order_by(total, Feedback.created_at.desc())
+        .limit(WORST_LIMIT)
+    )).all()
+
+
+def _trend(current: float, previous: Optional[float]) -> str:
+    if previous is None:
+        return ""
+    delta = round(current - previous, 2)
+    if delta > 0:
+        return f" ↑{delta}"
+    if delta < 0:
+        return f" ↓{abs(delta)}"
+    return " →"
+
+
+async def build_digest(session_maker, kind: str, end: Optional[datetime] = None) -> str:
+    """Собирает дайджест за период, заканчивающийся в end (UTC)"""
+    period = PERIODS[kind]
+    end = end or datetime.utcnow()
+    start = end - period
+
+    async with session_maker() as session:
+        current = await _aggregates(session, start, end)
+        previous = await _aggregates(session, start - period, start)
+        worst = {place: await _worst_reviews(session, place, start, end)
+                 for place in current}
+
+    local_end = end.replace(tzinfo=timezone.utc).astimezone(MOSCOW_TZ)
+    lines = [f"🗞 Дайджест {TITLES[kind]} (по {local_end.strftime('%d.%m.%Y %H:%M')} МСК)"]
+    if not current:
+        lines.append("")
+        lines.append("📭 Новых отзывов нет")
+        return "\n".join(lines)
+
+    for place in PlaceEnum:
+        stats = current.get(place)
+        if not stats:
+            continue
+        before = previous.get(place, {})
+        lines.append("")
+        lines.append(f"<b>{place.value}</b> — отзывов: {stats['count']}, с фото: {stats['photos']}")
+        for key, title in (("avg_menu", "Меню"), ("avg_staff", "Персонал"),
+                           ("avg_clean", "Чистота")):
+            lines.append(f"• {title}: {round(stats[key], 2)}/5{_trend(stats[key], before.get(key))}")
+        lines.append(f"• Рекомендуют: {round(stats['recommend'] * 100 / stats['count'])}%")
+        if worst.get(place):
+            lines.append("Худшие отзывы:")
+            for menu, staff, clean, text in worst[place]:
+                lines.append(f"  {menu}/{staff}/{clean} — {html.escape(text[:80])}")
+    return "\n".join(lines)
+
+
+class DigestScheduler:
+    """Планировщик дайджестов внутри процесса бота.
+
+    Дайджест строится в заданное время (МСК), публикуется в канал
+    и сохраняется в общем хранилище, откуда админ получает его сразу.
+    Запуски, пропущенные пока бот был выключен, не догоняются.
+    """
+
+    def __init__(self, bot: Bot, session_maker, shared_state: SharedState,
+                 channel_id: Optional[str], daily_at: time = time(4, 0),
+                 weekly_day: int = 0):
+        self.bot = bot
+        self.session_maker = session_maker
+        self.shared_state = shared_state
+        self.channel_id = channel_id
+        self.daily_at = daily_at
+        # 0 — понедельник
+        self.weekly_day = weekly_day
+
+    def next_run(self, kind: str, now: datetime) -> datetime:
+        """Ближайший запуск строго после now (aware, МСК)"""
+        now = now.astimezone(MOSCOW_TZ)
+        run = now.replace(hour=self.daily_at.hour, minute=self.daily_at.minute,
+                          second=0, microsecond=0)
+        if kind == "weekly":
+            run += timedelta(days=(self.weekly_day - run.weekday()) % 7)
+            if run <= now:
+                run += timedelta(weeks=1)
+        elif run <= now:
+            run += timedelta(days=1)
+        return run
+
+    async def publish(self, kind: str, post: bool = True) -> str:
+        text = await build_digest(self.session_maker, kind)
+        await self.shared_state.set(f"digest:last:{kind}", text)
+        if post and self.channel_id:
+            await self.bot.send_message(
+                chat_id=int(self.channel_id), text=text, parse_mode="HTML")
+        logger.info("Дайджест %s опубликован", kind)
+        return text
+
+    async def _loop(self, kind: str):
+        while True:
+            run = self.next_run(kind, datetime.now(MOSCOW_TZ))
+            logger.info("Следующий дайджест %s: %s", kind, run.isoformat())
+            await asyncio.sleep((run - datetime.now(MOSCOW_TZ)).total_seconds())
+            # Если процесс был приостановлен и проснулся сильно позже
+            # срока, этот запуск уже неактуален
+            if datetime.now(MOSCOW_TZ) - run > timedelta(hours=1):
+                logger.info("Пропущен просроченный дайджест %s", kind)
+                continue
+            try:
+                await self.publish(kind)
+            except Exception:
+                logger.exception("Ошибка публикации дайджеста %s", kind)
+
+    async def run(self):
+        await asyncio.gather(*(self._loop(kind) for kind in PERIODS))
+
+    async def last(self, kind: str) -> Optional[str]:
+        return await self.shared_state.get(f"digest:last:{kind}")
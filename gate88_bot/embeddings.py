@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from models import Feedback
+from text_utils import clean_text, load_vectors_nlp
+
+logger = logging.getLogger(__name__)
+
+
+def is_meaningful(text: str) -> bool:
+    # "нет" — пользователь отказался писать отзыв
+    return bool(text) and text.strip().lower() != "нет"
+
+
+class EmbeddingIndex:
+    """Индекс векторов отзывов на диске.
+
+    Векторы хранятся нормированными float32-строками в файле, который
+    открывается через np.memmap: в память попадают только читаемые
+    страницы. Новые отзывы дописываются в конец файла. Поиск —
+    косинусная близость одним матричным умножением и argpartition;
+    для больших N строится грубое разбиение (IVF), и смотрятся только
+    ближайшие кластеры. Индекс, построенный другой моделью, при
+    загрузке сбрасывается.
+    """
+
+    def __init__(self, directory: str = "embeddings", model: str = "ru_core_news_md"):
+        self.directory = directory
+        self.model = model
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._ids_path = os.path.join(directory, "ids.i64")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.Lock()
+        self.dim: Optional[int] = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments: Optional[np.ndarray] = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta.get("model") != self.model:
+            logger.info("Индекс похожих отзывов построен моделью %s, строится заново",
+                        meta.get("model"))
+            for path in (self._meta_path, self._vectors_path, self._ids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        self.dim = meta["dim"]
+        ids = (np.fromfile(self._ids_path, dtype=np.int64)
+               if os.path.exists(self._ids_path) else np.empty(0, dtype=np.int64))
+        # После обрыва записи файлы могут разойтись: берём общую часть,
+        # лишний хвост add() обрежет перед следующей дозаписью
+        rows = (os.path.getsize(self._vectors_path) // (self.dim * 4)
+                if os.path.exists(self._vectors_path) else 0)
+        if rows < len(ids):
+            logger.warning("Индекс похожих отзывов: векторов %s при %s id, "
+                           "лишние id отброшены", rows, len(ids))
+        self.ids = ids[:rows]
+        self._map_vectors()
+
+    def _map_vectors(self):
+        count = len(self.ids)
+        if count:
+            self.vectors = np.memmap(self._vectors_path, dtype=np.float32,
+                                     mode="r", shape=(count, self.dim))
+        else:
+            self.vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def max_id(self) -> int:
+        return int(self.ids.max()) if len(self.ids) else 0
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> int:
+        """Дописывает векторы (строки нормируются); возвращает число новых.
+
+        id, уже лежащие в индексе, пропускаются: отзыв, записанный во
+        время backfill, приходит и оттуда, и из save_feedback.
+        """
+        if not len(ids):
+            return 0
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        with self._lock:
+            fresh = ~np.isin(ids, self.ids)
+            if not fresh.all():
+                ids, vectors = ids[fresh], vectors[fresh]
+                if not len(ids):
+                    return 0
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._meta_path, "w", encoding="utf-8") as file:
+                    json.dump({"dim": self.dim, "model": self.model}, file)
+            # Файлы обрезаются до загруженных строк: хвост от оборванной
+            # записи иначе сдвинул бы новые векторы относительно их id
+            with open(self._vectors_path, "ab") as file:
+                file.truncate(len(self.ids) * self.dim * 4)
+                file.write(vectors.tobytes())
+            with open(self._ids_path, "ab") as file:
+                file.truncate(len(self.ids) * 8)
+                file.write(ids.tobytes())
+            self.ids = np.concatenate([self.ids, ids])
+            self._map_vectors()
+            if self.centroids is not None:
+                new_assignments = np.argmax(vectors @ self.centroids.T, axis=1)
+                self.assignments = np.concatenate([self.assignments, new_assignments])
+        return len(ids)
+
+    def build_ivf(self, clusters: Optional[int] = None, iterations: int = 10, seed: int = 0):
+        """Строит грубое разбиение на кластеры (сферический k-means).
+
+        По умолчанию кластеров около sqrt(N).
+        """
+        with self._lock:
+            self._build_ivf(clusters, iterations, seed)
+
+    def _build_ivf(self, clusters: Optional[int], iterations: int, seed: int):
+        clusters = min(clusters or int(np.sqrt(len(self))), len(self))
+        if not clusters:
+            return
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[np.sort(rng.choice(
+            len(self), size=min(len(self), clusters * 40), replace=False))]
+        centroids = sample[rng.choice(len(sample), size=clusters, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(clusters):
+                members = sample[labels == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1)
+        assignments = np.empty(len(self), dtype=np.int64)
+        for start in range(0, len(self), 65536):
+            chunk = self.vectors[start:start + 65536]
+            assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        self.centroids, self.assignments = centroids, assignments
+
+    def search(self, query: np.ndarray, k: int = 5, probes: int = 8,
+               exclude_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """k ближайших отзывов: [(id, косинусная близость)].
+
+        Матричное умножение на всём индексе — вызывать из потока.
+        """
+        with self._lock:
+            ids, vectors = self.ids, self.vectors
+            centroids, assignments = self.centroids, self.assignments
+        if not len(ids):
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+
+        if centroids is not None:
+            nearest = np.argsort(centroids @ query)[-probes:]
+            candidates = np.flatnonzero(np.isin(assignments, nearest))
+            scores = vectors[candidates] @ query
+        else:
+            candidates = None
+            scores = vectors @ query
+
+        if exclude_id is not None:
+            candidate_ids = ids if candidates is None else ids[candidates]
+            scores = np.where(candidate_ids == exclude_id, -np.inf, scores)
+        k = min(k, len(scores))
+        # В выбранных кластерах может не оказаться ни одного отзыва
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return [(int(ids[row]), float(scores[i]))
+                for row, i in zip(rows, top) if np.isfinite(scores[i])]
+
+    def vector_for(self, feedback_id: int) -> Optional[np.ndarray]:
+        rows = np.flatnonzero(self.ids == feedback_id)
+        return np.array(self.vectors[rows[0]]) if len(rows) else None
+
+
+class SimilarReviews:
+    """Связка индекса и локальной spaCy-модели с векторами слов.
+
+    Когда в индексе набирается ivf_min_size отзывов, после догонки
+    строится IVF-разбиение (0 — всегда полный перебор).
+    """
+
+    def __init__(self, index: EmbeddingIndex, batch_size: int = 256,
+                 ivf_min_size: int = 50000):
+        self.index = index
+        self.batch_size = batch_size
+        self.ivf_min_size = ivf_min_size
+        self._nlp = None
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    async def ready(self) -> bool:
+        """Загружает модель при первом обращении (в потоке — это секунды)"""
+        async with self._load_lock:
+            if not self._loaded:
+                self._nlp = await asyncio.to_thread(load_vectors_nlp, self.index.model)
+                self._loaded = True
+        return self._nlp is not None
+
+    def embed(self, texts: Iterable[str]) -> np.ndarray:
+        cleaned = [clean_text(text) for text in texts]
+        return np.array([doc.vector for doc in self._nlp.pipe(cleaned, batch_size=64)],
+                        dtype=np.float32)
+
+    async def add(self, feedback_id: int, text: str):
+        """Индексирует новый отзыв (модель работает в потоке)"""
+        if not is_meaningful(text) or not await self.ready():
+            return
+        vectors = await asyncio.to_thread(self.embed, [text])
+        await asyncio.to_thread(self.index.add, [feedback_id], vectors)
+
+    async def backfill(self, session_maker) -> int:
+        """Догоняет индекс по отзывам, которых в нём ещё нет"""
+        # Граница — до ожидания модели: новые отзывы, проиндексированные
+        # за это время, не должны сдвинуть её мимо старых
+        last_id = self.index.max_id
+        if not await self.ready():
+            return 0
+        added = 0
+        while True:
+            async with session_maker() as session:
+                rows = (await session.execute(
+                    select(Feedback.id, Feedback.review_text)
+                    .where(Feedback.id > last_id)
+                    .order_by(Feedback.id)
+                    .limit(self.batch_size)
+                )).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            # Пустые отзывы ("нет") в индекс не попадают
+            rows = [(i, text) for i, text in rows if is_meaningful(text)]
+            if not rows:
+                continue
+            ids, texts = zip(*rows)
+            vectors = await asyncio.to_thread(self.embed, texts)
+            added += await asyncio.to_thread(self.index.add, ids, vectors)
+        if added:
+            logger.info("В индекс похожих отзывов добавлено: %s", added)
+        if self.ivf_min_size and len(self.index) >= self.ivf_min_size:
+            await asyncio.to_thread(self.index.build_ivf)
+            logger.info("IVF-разбиение построено: %s кластеров",
+                        len(self.index.centroids))
+        return added
+
+    async def similar_to_text(self, text: str, k: int = 5) -> List[Tuple[int, float]]:
+        if not await self.ready():
+            return []
+        vector = (await asyncio.to_thread(self.embed, [text]))[0]
+        return await asyncio.to_thread(self.index.search, vector, k)
+
+    async def similar_to_review(self, feedback_id: int, k: int = 5) -> List[Tuple[int, float]]:
+        vector = await asyncio.to_thread(self.index.vector_for, feedback_id)
+        if vector is None:
+            return []
+        return await asyncio.to_thread(self.index.search, vector, k,
+                                       exclude_id=feedback_id)
@@ -0,0 +1,187 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from sqlalchemy import select
+
+from models import Feedback
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProcessedPhoto:
+    data: bytes
+    thumb: bytes
+    original_size: int
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+# ========== Обработка (в отдельном процессе) ==========
+
+def _encode(image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, fmt, quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def process_image(data: bytes, max_side: int = 1600, quality: int = 80,
+                  thumb_side: int = 320, fmt: str = "WEBP") -> Tuple[bytes, bytes]:
+    """Уменьшает фото до max_side, пережимает в fmt и делает превью.
+
+    Если пережатое фото не меньше исходного, остаётся исходное.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        # JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8)
+        ratio = min(1.0, max_side / max(source.size))
+        source.draft("RGB", (int(source.width * ratio), int(source.height * ratio)))
+        # Ориентация из EXIF применяется до того, как EXIF будет отброшен
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    encoded = _encode(image, fmt, quality)
+    image.thumbnail((thumb_side, thumb_side), Image.LANCZOS)
+    thumb = _encode(image, fmt, quality)
+    return (encoded if len(encoded) < len(data) else data), thumb
+
+
+def image_extension(data: bytes) -> str:
+    """Расширение файла по сигнатуре (для BufferedInputFile)"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    return "jpg"
+
+
+# ========== Пул обработки ==========
+
+class ImagePipeline:
+    """Обработка фото в пуле процессов, не блокируя event loop.
+
+    Декодирование и кодирование изображений занимают десятки
+    миллисекунд процессорного времени, поэтому уходят в отдельные
+    процессы, как и рендер графиков.
+    """
+
+    def __init__(self, max_side: int = 1600, quality: int = 80, thumb_side: int = 320,
+                 fmt: str = "WEBP", workers: int = 1):
+        self.max_side = max_side
+        self.quality = quality
+        self.thumb_side = thumb_side
+        self.fmt = fmt.upper()
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def process(self, data: bytes) -> ProcessedPhoto:
+        loop = asyncio.get_running_loop()
+        encoded, thumb = await loop.run_in_executor(
+            self._executor(), process_image, data, self.max_side, self.quality,
+            self.thumb_side, self.fmt)
+        return ProcessedPhoto(encoded, thumb, len(data))
+
+    async def apply(self, feedback: Feedback, data: bytes) -> bool:
+        """Записывает в отзыв обработанное фото; False — фото не читается"""
+        try:
+            photo = await self.process(data)
+        except Exception as e:
+            logger.warning("Не удалось обработать фото отзыва %s: %s", feedback.id, e)
+            feedback.photo_data = data
+            feedback.photo_original_size = len(data)
+            feedback.photo_size = len(data)
+            return False
+        feedback.photo_data = photo.data
+        feedback.photo_thumb = photo.thumb
+        feedback.photo_original_size = photo.original_size
+        feedback.photo_size = photo.size
+        return True
+
+    def shutdown(self, wait: bool = False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+async def shrink_stored_photos(pipeline: ImagePipeline, session_maker,
+                               batch_size: int = 20) -> Tuple[int, int, int]:
+    """Пережимает фото, сохранённые до появления обработки.
+
+    Возвращает (число фото, байт до, байт после).
+    """
+    processed = before = after = 0
+    last_id = 0
+    while True:
+        async with session_maker() as session:
+            feedbacks = (await session.execute(
+                select(Feedback)
+                .where(Feedback.id > last_id,
+                       Feedback.photo_data.is_not(None),
+                       Feedback.photo_original_size.is_(None))
+                .order_by(Feedback.id)
+                .limit(batch_size)
+            )).scalars().all()
+            if not feedbacks:
+                break
+            for feedback in feedbacks:
+                data = feedback.photo_data
+                await pipeline.apply(feedback, data)
+                processed += 1
+                before += len(data)
+                after += feedback.photo_size
+            last_id = feedbacks[-1].id
+            await session.commit()
+    if processed:
+        logger.info("Пережато фото: %s, %s → %s байт", processed, before, after)
+    return processed, before, after
+
+
+# ========== Проверка ==========
+
+def _demo():
+    import time
+    from PIL import Image, ImageDraw, ImageFilter
+
+    # Снимок с телефона: 4000x3000, JPEG 95
+    image = Image.radial_gradient("L").resize((4000, 3000)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for i in range(0, 4000, 37):
+        draw.line((i, 0, 4000 - i, 3000), fill=(i % 255, 90, 200 - i % 200), width=5)
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=95)
+    original = buffer.getvalue()
+
+    async def main():
+        pipeline = ImagePipeline()
+        await pipeline.process(original)  # запуск процесса пула
+        started = time.perf_counter()
+        photos = await asyncio.gather(*(pipeline.process(original) for _ in range(5)))
+        elapsed = (time.perf_counter() - started) / 5
+        pipeline.shutdown(wait=True)
+        photo = photos[0]
+        print(f"{len(original) / 1024:.0f} КБ → {photo.size / 1024:.0f} КБ "
+              f"({image_extension(photo.data)}), превью {len(photo.thumb) / 1024:.1f} КБ, "
+              f"{elapsed * 1000:.0f} мс на фото")
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    _demo()
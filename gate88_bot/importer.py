@@ -0,0 +1,256 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, select, and_
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from db_backend import make_engine
+from models import Base, Feedback, PlaceEnum, migrate_schema
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+
+
+class ImportErrorRow(ValueError):
+    """Строка не прошла проверку"""
+
+
+# ========== Чтение форматов выгрузки ==========
+
+def _parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in ("да", "yes", "true", "1"):
+        return True
+    if value in ("нет", "no", "false", "0"):
+        return False
+    raise ImportErrorRow(f"некорректное значение рекомендации: {value!r}")
+
+
+def _parse_rating(value: Any, name: str) -> int:
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        raise ImportErrorRow(f"{name}: не число: {value!r}")
+    if not 1 <= rating <= 5:
+        raise ImportErrorRow(f"{name}: оценка вне диапазона 1-5: {rating}")
+    return rating
+
+
+def _parse_place(value: Any) -> PlaceEnum:
+    try:
+        return PlaceEnum(value)
+    except ValueError:
+        # Допускаем и имя члена перечисления (POBEDA)
+        try:
+            return PlaceEnum[value]
+        except KeyError:
+            raise ImportErrorRow(f"неизвестное заведение: {value!r}")
+
+
+def _parse_date(value: str) -> datetime:
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ImportErrorRow(f"некорректная дата: {value!r}")
+    # created_at хранится без часового пояса, в UTC (как datetime.utcnow)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def row_from_csv(row: Dict[str, str]) -> Dict[str, Any]:
+    """Строка в формате export_to_csv -> значения колонок feedbacks"""
+    try:
+        return {
+            "user_id": int(row["User ID"]),
+            "place": _parse_place(row["Place"]),
+            "menu_rating": _parse_rating(row["Menu"], "Menu"),
+            "staff_rating": _parse_rating(row["Staff"], "Staff"),
+            "cleanliness_rating": _parse_rating(row["Clean"], "Clean"),
+            "recommend": _parse_bool(row["Recommend"]),
+            "review_text": row["Review"] or "",
+            "created_at": _parse_date(row["Date"]),
+        }
+    except ImportErrorRow:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise ImportErrorRow(f"некорректная строка: {e}")
+
+
+def row_from_json(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Запись в формате export_to_json -> значения колонок feedbacks"""
+    try:
+        ratings = item["ratings"]
+        return {
+            "user_id": int(item["user_id"]),
+            "place": _parse_place(item["place"]),
+            "menu_rating": _parse_rating(ratings["menu"], "menu"),
+            "staff_rating": _parse_rating(ratings["staff"], "staff"),
+            "cleanliness_rating": _parse_rating(ratings["clean"], "clean"),
+            "recommend": _parse_bool(item["recommend"]),
+            "review_text": item.get("review") or "",
+            "created_at": _parse_date(item["date"]),
+        }
+    except ImportErrorRow:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise ImportErrorRow(f"некорректная запись: {e}")
+
+
+def read_records(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[int, Any]]:
+    """Возвращает (номер строки, сырая запись) из CSV, JSON или NDJSON.
+
+    Вместо нечитаемой строки NDJSON возвращается ImportErrorRow, чтобы
+    одна битая строка не прерывала импорт.
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt == "csv":
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            for number, row in enumerate(csv.DictReader(file), start=2):
+                yield number, row
+    elif fmt == "json":
+        with open(path, encoding="utf-8") as file:
+            for number, item in enumerate(json.load(file), start=1):
+                yield number, item
+    elif fmt in ("ndjson", "jsonl"):
+        with open(path, encoding="utf-8") as file:
+            for number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield number, ImportErrorRow(f"некорректный JSON: {e.msg}")
+    else:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+
+
+def _natural_key(row: Dict[str, Any]) -> tuple:
+    # CSV-выгрузка пишет время до минуты: секунды в ключ не входят,
+    # иначе повторный импорт CSV не узнаёт уже загруженные строки
+    created_at = row["created_at"].replace(second=0, microsecond=0)
+    return (row["user_id"], row["place"], created_at, row["review_text"])
+
+
+# ========== Загрузка ==========
+
+async def _existing_keys(conn, rows: List[Dict[str, Any]]) -> set:
+    """Ключи строк чанка, которые уже есть в БД"""
+    created = [_natural_key(row)[2] for row in rows]
+    query = select(
+        Feedback.user_id, Feedback.place, Feedback.created_at, Feedback.review_text
+    ).where(and_(
+        Feedback.created_at >= min(created),
+        Feedback.created_at < max(created) + timedelta(minutes=1),
+        Feedback.user_id.in_({row["user_id"] for row in rows}),
+    ))
+    return {_natural_key(r._mapping) for r in (await conn.execute(query)).all()}
+
+
+async def import_rows(engine: AsyncEngine, rows: Iterable[Dict[str, Any]],
+                      chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+    """Вставляет строки пачками: один executemany и одна транзакция на чанк"""
+    stats = {"inserted": 0, "duplicates": 0}
+    seen = set()
+    statement = insert(Feedback.__table__)
+
+    async def flush(chunk):
+        async with engine.begin() as conn:
+            existing = await _existing_keys(conn, chunk)
+            fresh = [row for row in chunk if _natural_key(row) not in existing]
+            stats["duplicates"] += len(chunk) - len(fresh)
+            if fresh:
+                await conn.execute(statement, fresh)
+            stats["inserted"] += len(fresh)
+
+    chunk = []
+    for row in rows:
+        key = _natural_key(row)
+        if key in seen:
+            stats["duplicates"] += 1
+            continue
+        seen.add(key)
+        row.setdefault("photo_skipped", True)
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            await flush(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+    return stats
+
+
+async def import_file(engine: AsyncEngine, path: str, fmt: Optional[str] = None,
+                      chunk_size: int = CHUNK_SIZE) -> Dict[str, Any]:
+    """Импортирует файл выгрузки и возвращает отчёт"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    parse = row_from_csv if fmt == "csv" else row_from_json
+    errors = []
+
+    def valid_rows():
+        for number, record in read_records(path, fmt):
+            if isinstance(record, ImportErrorRow):
+                errors.append((number, str(record)))
+                continue
+            try:
+                yield parse(record)
+            except ImportErrorRow as e:
+                errors.append((number, str(e)))
+
+    start = time.perf_counter()
+    stats = await import_rows(engine, valid_rows(), chunk_size)
+    elapsed = time.perf_counter() - start
+
+    stats["errors"] = len(errors)
+    stats["seconds"] = round(elapsed, 2)
+    stats["rows_per_sec"] = round(stats["inserted"] / elapsed) if elapsed else 0
+    for number, message in errors[:20]:
+        logger.warning("Строка %s пропущена: %s", number, message)
+    return stats
+
+
+async def _main(args):
+    engine = make_engine(args.database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrate_schema)
+    try:
+        for path in args.files:
+            stats = await import_file(engine, path, args.format, args.chunk_size)
+            print(
+                f"{path}: добавлено {stats['inserted']}, "
+                f"дубликатов {stats['duplicates']}, ошибок {stats['errors']}, "
+                f"{stats['rows_per_sec']} строк/сек ({stats['seconds']} с)"
+            )
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Импорт исторических отзывов из CSV/JSON/NDJSON")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--format", choices=["csv", "json", "ndjson"])
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("DATABASE_URL", "sqlite+aiosqlite:///feedback.db"))
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,217 @@
+import json
+import queue
+import random
+import time
+import logging
+import logging.handlers
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Стандартные атрибуты LogRecord — всё остальное считаем полями из extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну строку JSON.
+
+    Сообщение собирается через record.getMessage() только здесь, в потоке
+    слушателя, поэтому аргументы в стиле logger.info("... %s", x)
+    не форматируются в event loop.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю записей уровня ниже min_level (остальные — всегда)"""
+
+    def __init__(self, rates: Dict[str, float], min_level: int = logging.INFO):
+        super().__init__()
+        self.rates = rates
+        self.min_level = min_level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.min_level:
+            return True
+        rate = self.rates.get(record.name)
+        if rate is None:
+            return True
+        return random.random() < rate
+
+
+class RateLimitFilter(logging.Filter):
+    """Ограничивает число записей в секунду для каждого логгера (token bucket)"""
+
+    def __init__(self, limits: Dict[str, float], min_level: int = logging.WARNING):
+        super().__init__()
+        self.limits = limits
+        self.min_level = min_level
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.min_level:
+            return True
+        limit = self.limits.get(record.name)
+        if limit is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(record.name, (limit, now))
+            tokens = min(limit, tokens + (now - last) * limit)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now)
+                self.dropped += 1
+                return False
+            self._buckets[record.name] = (tokens - 1, now)
+        return True
+
+
+def _parse_mapping(raw: str) -> Dict[str, float]:
+    """'main=0.1,aiogram.event=0.5' -> {'main': 0.1, 'aiogram.event': 0.5}"""
+    result = {}
+    for item in raw.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            result[name.strip()] = float(value)
+    return result
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = "INFO", json_output: bool = True,
+                  sample_rates: str = "", rate_limits: str = "",
+                  stream=None) -> logging.handlers.QueueListener:
+    """Настраивает неблокирующее логирование.
+
+    Корневой логгер пишет только в очередь; форматирование и вывод
+    выполняет QueueListener в отдельном потоке.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(
+        JsonFormatter() if json_output
+        else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(log_queue)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(_parse_mapping(sample_rates)))
+    if rate_limits:
+        queue_handler.addFilter(RateLimitFilter(_parse_mapping(rate_limits)))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Останавливает слушателя, дописав очередь.
+
+    Обработчик очереди на корневом логгере заменяется выводом слушателя:
+    записи после остановки пишутся синхронно, а не в очередь без читателя.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        root = logging.getLogger()
+        filters = []
+        for handler in root.handlers[:]:
+            if isinstance(handler, _LazyQueueHandler):
+                root.removeHandler(handler)
+                filters.extend(handler.filters)
+        for handler in _listener.handlers:
+            for log_filter in filters:
+                handler.addFilter(log_filter)
+            root.addHandler(handler)
+        _listener = None
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный prepare() вызывает format() и склеивает msg с args;
+    здесь запись уходит в очередь как есть, а сообщение собирает
+    форматтер слушателя. Аргументы не должны меняться после вызова лога.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# ========== Бенчмарк ==========
+
+def _bench(n: int = 2000):
+    """Сравнивает стоимость логирования одного отзыва: было / стало"""
+    import io
+
+    class _Feedback:
+        def __init__(self):
+            self.id = 1
+            self.user_id = 123456789
+            self.place = "Победа"
+            self.review_text = "Очень вкусно " * 20
+            self.photo_data = b"x" * 200_000
+
+    feedback = _Feedback()
+    data = {"user_id": 1, "place": "Победа", "menu_rating": 5, "staff_rating": 5,
+            "cleanliness_rating": 5, "recommend": True, "review_text": "ok"}
+    log = logging.getLogger("bench")
+
+    # Было: синхронный StreamHandler и f-строки с __dict__ и dir()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.StreamHandler(io.StringIO()))
+    root.setLevel(logging.INFO)
+    start = time.perf_counter()
+    for _ in range(n):
+        log.info(f"Создан объект Feedback: {feedback.__dict__}")
+        log.info(f"Тип feedback: {type(feedback)}")
+        log.info(f"Атрибуты: {dir(feedback)}")
+        log.info(f"Значения: {feedback.__dict__}")
+        log.info(f"Данные состояния: {data}")
+    before = (time.perf_counter() - start) / n
+
+    # Стало: очередь, ленивые аргументы, отладочные строки отфильтрованы уровнем
+    setup_logging("INFO", stream=io.StringIO())
+    start = time.perf_counter()
+    for _ in range(n):
+        log.debug("Создан объект Feedback: %s", feedback.__dict__)
+        log.info("Отзыв сохранён, ID %s", feedback.id)
+        log.debug("Данные состояния: %s", data)
+    after = (time.perf_counter() - start) / n
+    shutdown_logging()
+
+    print(f"до:    {before * 1e6:.1f} мкс на отзыв")
+    print(f"после: {after * 1e6:.1f} мкс на отзыв")
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,303 @@
+import re
+import time
+import logging
+import threading
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Collection, Dict, FrozenSet, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов гистограмм (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """Счётчик с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        """Копия текущих значений по меткам"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма длительностей с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по бакетам..., +Inf], сумма
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._sums[labels] = self._sums.get(labels, 0.0) + value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for labels, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(
+                        f"{self.name}_bucket"
+                        f"{_format_labels(self.labelnames + ('le',), labels + (repr(bound),))}"
+                        f" {cumulative}")
+                cumulative += counts[-1]
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{_format_labels(self.labelnames + ('le',), labels + ('+Inf',))}"
+                    f" {cumulative}")
+                label_str = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_str} {self._sums[labels]}")
+                lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Registry:
+    """Набор метрик, отдаваемых в формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, tuple(labelnames)))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, tuple(labelnames), buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "gate88_handler_duration_seconds",
+    "Время обработки апдейта",
+    ("event", "route", "state"),
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "gate88_handler_errors_total",
+    "Необработанные исключения в хендлерах",
+    ("event", "route", "state", "error"),
+)
+DB_QUERY_LATENCY = REGISTRY.histogram(
+    "gate88_db_query_duration_seconds",
+    "Время выполнения SQL-запросов",
+    ("operation", "table"),
+)
+BOT_API_LATENCY = REGISTRY.histogram(
+    "gate88_bot_api_duration_seconds",
+    "Время вызовов Bot API",
+    ("method",),
+)
+BOT_API_ERRORS = REGISTRY.counter(
+    "gate88_bot_api_errors_total",
+    "Ошибки вызовов Bot API",
+    ("method", "error"),
+)
+
+
+# ========== Хендлеры aiogram ==========
+
+def registered_commands(router) -> FrozenSet[str]:
+    """Команды из фильтров Command роутера и всех вложенных"""
+    commands = set()
+    for item in router.chain_tail:
+        for handler in item.message.handlers:
+            for handler_filter in handler.filters or ():
+                for command in getattr(handler_filter.callback, "commands", ()):
+                    if isinstance(command, str):
+                        commands.add(command.lower())
+    return frozenset(commands)
+
+
+def route_key(event: TelegramObject,
+              commands: Optional[Collection[str]] = None) -> Tuple[str, str]:
+    """Возвращает (тип события, маршрут) для меток метрик.
+
+    Команда попадает в метку, только если она есть в commands, иначе
+    маршрут — "/other": текст после "/" пишет пользователь.
+    """
+    if isinstance(event, CallbackQuery):
+        # "rate_5" -> "rate", "place_Победа" -> "place": без высокой кардинальности
+        data = event.data or ""
+        return "callback_query", data.split("_", 1)[0] or "empty"
+    if isinstance(event, Message):
+        text = event.text or ""
+        if text.startswith("/"):
+            command = text.split()[0].split("@", 1)[0][1:].lower()
+            return "message", f"/{command}" if command in (commands or ()) else "/other"
+        if event.photo:
+            return "message", "photo"
+        return "message", "text"
+    return type(event).__name__.lower(), "other"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware: латентность и ошибки по маршруту и состоянию FSM"""
+
+    def __init__(self, commands: Collection[str] = ()):
+        self.commands = frozenset(commands)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        event_type, route = route_key(event, self.commands)
+        state = data.get("raw_state") or "none"
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(event_type, route, state, type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, event_type, route, state)
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время исходящих запросов к Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            BOT_API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            BOT_API_LATENCY.observe(time.perf_counter() - start, name)
+
+
+# ========== SQLAlchemy ==========
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+\"?(\w+)", re.IGNORECASE)
+
+
+def statement_key(statement: str) -> Tuple[str, str]:
+    """Возвращает (операция, таблица) для SQL-запроса"""
+    stripped = statement.lstrip()
+    operation = stripped.split(None, 1)[0].upper() if stripped else "UNKNOWN"
+    match = _TABLE_RE.search(stripped)
+    return operation, match.group(1) if match else "none"
+
+
+def instrument_engine(engine):
+    """Подключает замер времени запросов к движку (sync или async)"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if not starts:
+            return
+        DB_QUERY_LATENCY.observe(
+            time.perf_counter() - starts.pop(), *statement_key(statement))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection else None
+        if starts:
+            starts.pop()
+
+
+# ========== Подключение ==========
+
+def setup_metrics(dp, bot, engine):
+    """Подключает все middleware и обработчики событий"""
+    # Вызывать после регистрации хендлеров: из них берутся имена команд
+    middleware = HandlerMetricsMiddleware(registered_commands(dp))
+    dp.message.outer_middleware(middleware)
+    dp.callback_query.outer_middleware(middleware)
+    bot.session.middleware(BotApiMetricsMiddleware())
+    instrument_engine(engine)
+
+
+async def start_metrics_server(host: str, port: int,
+                               registry: Optional[Registry] = None) -> web.AppRunner:
+    """Запускает HTTP-эндпоинт /metrics"""
+    registry = registry or REGISTRY
+
+    async def handle_metrics(request):
+        return web.Response(
+            text=registry.render(),
+            content_type="text/plain",
+            charset="utf-8",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Enum, LargeBinary
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, Boolean, DateTime, Enum, LargeBinary, Index, UniqueConstraint, inspect
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
 import enum
@@ -30,9 +30,16 @@ class PlaceEnum(str, enum.Enum):
 class Feedback(Base):
     """Модель для хранения отзывов"""
     __tablename__ = "feedbacks"
+    __table_args__ = (
+        # can_leave_feedback: последний отзыв пользователя по заведению
+        Index("ix_feedbacks_user_place_created", "user_id", "place", "created_at"),
+        # выборки за период и сортировка по дате
+        Index("ix_feedbacks_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False)
+    # ID в Telegram давно вышли за 2^31
+    user_id = Column(BigInteger, nullable=False)
     place = Column(Enum(PlaceEnum), nullable=False)
     menu_rating = Column(Integer, nullable=False)
     staff_rating = Column(Integer, nullable=False)
@@ -40,9 +47,29 @@ class Feedback(Base):
     recommend = Column(Boolean, nullable=False)
     review_text = Column(Text, nullable=False)
     photo_data = Column(LargeBinary, nullable=True)
+    # Фото хранится в Telegram; байты в photo_data — только архивная копия
+    photo_file_id = Column(String, nullable=True)
+    photo_file_unique_id = Column(String, nullable=True)
     photo_skipped = Column(Boolean, default=False)
+    # Превью для списков в админке и размеры фото до и после пережатия
+    photo_thumb = Column(LargeBinary, nullable=True)
+    photo_original_size = Column(Integer, nullable=True)
+    photo_size = Column(Integer, nullable=True)
+    # Почти дословная копия отзыва с этим ID: ждёт модерации и
+    # не учитывается в статистике
+    duplicate_of = Column(Integer, nullable=True)
+    # Тональность текста по аспектам, [-1, 1]; NULL — аспект не упомянут
+    menu_sentiment = Column(Float, nullable=True)
+    staff_sentiment = Column(Float, nullable=True)
+    cleanliness_sentiment = Column(Float, nullable=True)
+    # Версия словаря, которой посчитаны оценки (NULL — ещё не считали)
+    aspects_version = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+    @property
+    def has_photo(self) -> bool:
+        return bool(self.photo_file_id or self.photo_data)
+
     def to_dict(self) -> Dict[str, Any]:
         """Конвертирует отзыв в словарь"""
         return {
@@ -54,12 +81,80 @@ class Feedback(Base):
             "cleanliness_rating": self.cleanliness_rating,
             "recommend": self.recommend,
             "review_text": self.review_text,
-            "has_photo": bool(self.photo_data),
+            "has_photo": self.has_photo,
             "created_at": self.created_at.isoformat(),
             "photo_skipped": self.photo_skipped
         }
 
 
+class FeedbackRollup(Base):
+    """Суммы оценок заархивированных отзывов по заведению и месяцу.
+
+    Дубликаты (duplicate_of) сюда не попадают — как и в статистику.
+    """
+    __tablename__ = "feedback_rollups"
+    __table_args__ = (UniqueConstraint("place", "month"),)
+
+    id = Column(Integer, primary_key=True)
+    place = Column(Enum(PlaceEnum), nullable=False)
+    # Первое число месяца, UTC
+    month = Column(DateTime, nullable=False)
+    reviews = Column(Integer, nullable=False, default=0)
+    menu_sum = Column(Integer, nullable=False, default=0)
+    staff_sum = Column(Integer, nullable=False, default=0)
+    cleanliness_sum = Column(Integer, nullable=False, default=0)
+    recommended = Column(Integer, nullable=False, default=0)
+    with_photo = Column(Integer, nullable=False, default=0)
+
+
+class UserRollup(Base):
+    """Суммы оценок заархивированных отзывов пользователя (для «Мои отзывы»)"""
+    __tablename__ = "user_rollups"
+
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    reviews = Column(Integer, nullable=False, default=0)
+    menu_sum = Column(Integer, nullable=False, default=0)
+    staff_sum = Column(Integer, nullable=False, default=0)
+    cleanliness_sum = Column(Integer, nullable=False, default=0)
+
+
+def _widen_column(conn, table: str, column, current):
+    """INTEGER → BIGINT для колонок, ставших BigInteger.
+
+    В SQLite INTEGER и так 64-битный, менять нечего.
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    if (isinstance(column.type, BigInteger) and isinstance(current, Integer)
+            and not isinstance(current, BigInteger)):
+        conn.exec_driver_sql(
+            f'ALTER TABLE {table} ALTER COLUMN {column.name} TYPE BIGINT')
+        logger.info(f"Колонка {table}.{column.name} расширена до BIGINT")
+
+
+def migrate_schema(conn):
+    """Добавляет в существующие таблицы колонки, появившиеся после их создания,
+    и расширяет целочисленные колонки до BIGINT"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                _widen_column(conn, table.name, column, existing[column.name])
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(
+                f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            logger.info(f"Добавлена колонка {table.name}.{column.name}")
+        existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(conn)
+                logger.info(f"Создан индекс {index.name}")
+
+
 async def init_db():
     """Инициализирует таблицы в базе данных"""
     engine = create_async_engine("sqlite+aiosqlite:///feedback.db")
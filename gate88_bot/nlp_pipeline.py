@@ -1,13 +1,8 @@
 import re
 import json
 
-def clean_text(raw: str) -> str:
-    text = re.sub(r'<[^>]+>', ' ', raw)           
-    text = re.sub(r'https?://\S+', ' ', text)     
-    text = re.sub(r'[^\w\s]', ' ', text)          
-    text = text.lower().strip()
-    text = re.sub(r'\s{2,}', ' ', text)
-    return text
+# Очистка вынесена в text_utils: она нужна и без тяжёлых NLP-зависимостей
+from text_utils import clean_text
 
 import spacy
 nlp = spacy.load('ru_core_news_sm')  
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import BufferedInputFile, InputMediaPhoto
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_MESSAGES = REGISTRY.counter(
+    "gate88_channel_messages_total",
+    "Сообщения в канал уведомлений",
+    ("mode",),
+)
+
+MESSAGE_LIMIT = 4096
+ALBUM_SIZE = 10
+
+
+@dataclass
+class Notification:
+    text: str
+    # Строка для сводки во время всплеска
+    summary: str
+    photo: Optional[Union[str, BufferedInputFile]] = None
+
+
+class ChannelNotifier:
+    """Очередь уведомлений в канал с адаптивной группировкой.
+
+    Пока сообщений за последний period меньше burst_threshold, каждый
+    отзыв уходит отдельным сообщением. Выше порога очередь копит отзывы
+    window секунд и отправляет их сводкой: текстовые — одним сообщением,
+    с фото — альбомами send_media_group (не больше limit фото в альбоме).
+    Общий лимит limit сообщений за period не превышается; при RetryAfter
+    и сетевых ошибках отправка повторяется, так что уведомления не теряются.
+    """
+
+    def __init__(self, bot, chat_id: int, limit: int = 18, burst_threshold: int = 10,
+                 window: float = 30.0, period: float = 60.0, max_attempts: int = 5):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.limit = limit
+        self.burst_threshold = burst_threshold
+        self.window = window
+        self.period = period
+        self.max_attempts = max_attempts
+        self._sent = deque()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, notification: Notification):
+        """Ставит уведомление в очередь (не ждёт отправки)"""
+        self._ensure_started()
+        await self._queue.put(notification)
+
+    async def close(self):
+        """Отправляет всё, что осталось в очереди"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    # ========== Учёт лимита ==========
+
+    def _recent(self) -> int:
+        border = time.monotonic() - self.period
+        while self._sent and self._sent[0] <= border:
+            self._sent.popleft()
+        return len(self._sent)
+
+    async def _reserve(self, messages: int = 1):
+        """Ждёт, пока в окне лимита освободится место"""
+        while self._recent() + messages > self.limit and self._sent:
+            await asyncio.sleep(self._sent[0] + self.period - time.monotonic())
+        now = time.monotonic()
+        self._sent.extend([now] * messages)
+
+    # ========== Отправка ==========
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            notification = await self._queue.get()
+            if notification is None:
+                break
+            if self._recent() < self.burst_threshold:
+                await self._deliver("single", [notification])
+                continue
+
+            # Всплеск: копим окно и шлём сводкой
+            batch = [notification]
+            deadline = time.monotonic() + self.window
+            while (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    notification = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if notification is None:
+                    stopping = True
+                    break
+                batch.append(notification)
+            await self._deliver("digest", batch)
+        # После остановки дописываем хвост сводкой
+        rest = []
+        while self._queue is not None and not self._queue.empty():
+            notification = self._queue.get_nowait()
+            if notification is not None:
+                rest.append(notification)
+        if rest:
+            await self._deliver("digest", rest)
+
+    async def _deliver(self, mode: str, batch: List[Notification]):
+        if mode == "single" or len(batch) == 1:
+            notification = batch[0]
+            if notification.photo is not None:
+                await self._call(self.bot.send_photo, "single", chat_id=self.chat_id,
+                                 photo=notification.photo, caption=notification.text,
+                                 parse_mode=ParseMode.HTML)
+            else:
+                await self._call(self.bot.send_message, "single", chat_id=self.chat_id,
+                                 text=notification.text, parse_mode=ParseMode.HTML)
+            return
+
+        texts = [n for n in batch if n.photo is None]
+        photos = [n for n in batch if n.photo is not None]
+        for chunk in self._split_digest(texts):
+            await self._call(self.bot.send_message, "digest", chat_id=self.chat_id,
+                             text=chunk, parse_mode=ParseMode.HTML)
+        # Альбом из N фото — N сообщений: при WORKERS>1 limit бывает меньше 10
+        album_size = min(ALBUM_SIZE, self.limit)
+        for start in range(0, len(photos), album_size):
+            album = photos[start:start + album_size]
+            if len(album) == 1:
+                await self._call(self.bot.send_photo, "album", chat_id=self.chat_id,
+                                 photo=album[0].photo, caption=album[0].text,
+                                 parse_mode=ParseMode.HTML)
+                continue
+            media = [InputMediaPhoto(media=n.photo, caption=n.text[:1024],
+                                     parse_mode=ParseMode.HTML) for n in album]
+            # Telegram считает альбом как несколько сообщений
+            await self._call(self.bot.send_media_group, "album", messages=len(media),
+                             chat_id=self.chat_id, media=media)
+
+    @staticmethod
+    def _split_digest(notifications: List[Notification]) -> List[str]:
+        if not notifications:
+            return []
+        chunks = []
+        header = f"📢 Новые отзывы ({len(notifications)}):\n"
+        current = header
+        for notification in notifications:
+            line = "\n" + notification.summary
+            if len(current) + len(line) > MESSAGE_LIMIT:
+                chunks.append(current)
+                current = "📢 Новые отзывы (продолжение):\n"
+            current += line
+        chunks.append(current)
+        return chunks
+
+    async def _call(self, method, mode: str, messages: int = 1, **kwargs):
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            await self._reserve(messages)
+            try:
+                await method(**kwargs)
+                CHANNEL_MESSAGES.inc(mode, amount=messages)
+                return
+            except TelegramRetryAfter as e:
+                error = e
+                logger.warning("Лимит канала, повтор через %s с", e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except TelegramNetworkError as e:
+                error = e
+                logger.warning("Сеть недоступна (%s), попытка %s", e, attempt)
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                # Ошибку запроса повтор не исправит
+                error = e
+                break
+        # Текст остаётся в логе, чтобы уведомление можно было восстановить
+        logger.error("Не удалось отправить уведомление в канал: %s",
+                     kwargs.get("text") or kwargs.get("caption")
+                     or [m.caption for m in kwargs.get("media", [])], exc_info=error)
+
+
+# ========== Проверка на фейковом боте ==========
+
+class _FakeBot:
+    """Записывает вызовы; первый альбом отклоняет с RetryAfter"""
+
+    def __init__(self):
+        self.calls = []
+        self._rejected = False
+
+    async def _record(self, kind, **kwargs):
+        self.calls.append((time.monotonic(), kind, kwargs))
+
+    async def send_message(self, **kwargs):
+        await self._record("message", **kwargs)
+
+    async def send_photo(self, **kwargs):
+        await self._record("photo", **kwargs)
+
+    async def send_media_group(self, **kwargs):
+        if not self._rejected:
+            self._rejected = True
+            from aiogram.methods import SendMediaGroup
+            raise TelegramRetryAfter(SendMediaGroup(chat_id=0, media=kwargs["media"]),
+                                     "Too Many Requests", retry_after=0)
+        await self._record("album", **kwargs)
+
+
+def _burst_test():
+    async def main(limit: int):
+        bot = _FakeBot()
+        # Масштаб времени: минута лимита — 1 с, окно сводки — 0.2 с
+        notifier = ChannelNotifier(bot, chat_id=1, limit=limit, burst_threshold=min(5, limit),
+                                   window=0.2, period=1.0)
+
+        def review(i, photo=False):
+            return Notification(text=f"Отзыв #{i}", summary=f"#{i}",
+                                photo=f"file{i}" if photo else None)
+
+        for i in range(3):
+            await notifier.submit(review(i))
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.1)
+        assert [c[1] for c in bot.calls] == ["message"] * 3, bot.calls
+
+        # Всплеск: 120 отзывов, каждый третий с фото
+        for i in range(3, 123):
+            await notifier.submit(review(i, photo=i % 3 == 0))
+            await asyncio.sleep(0.002)
+        await notifier.close()
+
+        delivered, photos = set(), set()
+        for _, kind, kwargs in bot.calls:
+            if kind == "album":
+                photos.update(m.media for m in kwargs["media"])
+                delivered.update(m.caption.replace("Отзыв ", "") for m in kwargs["media"])
+            elif kind == "photo":
+                photos.add(kwargs["photo"])
+                delivered.add(kwargs["caption"].replace("Отзыв ", ""))
+            else:
+                delivered.update(line.replace("Отзыв ", "")
+                                 for line in kwargs["text"].splitlines() if "#" in line)
+        assert delivered == {f"#{i}" for i in range(123)}, "уведомления потеряны"
+        assert photos == {f"file{i}" for i in range(3, 123, 3)}, "фото потеряны"
+
+        # В любом окне period — не больше limit сообщений
+        times = []
+        for moment, kind, kwargs in bot.calls:
+            times += [moment] * (len(kwargs["media"]) if kind == "album" else 1)
+        worst = max(sum(1 for t in times if start <= t < start + 1.0) for start in times)
+        assert worst <= limit, worst
+        print(f"лимит {limit}: 123 отзыва → {len(bot.calls)} вызовов API, "
+              f"максимум {worst} сообщений в окне лимита")
+
+    # 18 — один процесс, 4 — CHANNEL_RATE_LIMIT // WORKERS при 4 воркерах
+    for limit in (18, 4):
+        asyncio.run(main(limit))
+
+
+if __name__ == "__main__":
+    _burst_test()
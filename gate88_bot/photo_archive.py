@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from aiogram import Bot
+from sqlalchemy import select
+
+from images import ImagePipeline
+from models import Feedback
+
+logger = logging.getLogger(__name__)
+
+
+async def archive_pending_photos(bot: Bot, session_maker, batch_size: int = 20,
+                                 pipeline: Optional[ImagePipeline] = None,
+                                 after_id: int = 0) -> Tuple[int, int, int]:
+    """Скачивает байты фото для отзывов, где сохранён только file_id.
+
+    С pipeline фото сохраняется уменьшенным и пережатым, с превью.
+    Просматриваются отзывы с id больше after_id, так что фото, которое
+    не скачивается, не загораживает следующие.
+
+    Возвращает (число заархивированных фото, число просмотренных
+    отзывов, id последнего из них).
+    """
+    async with session_maker() as session:
+        feedbacks = (await session.execute(
+            select(Feedback)
+            .where(Feedback.id > after_id,
+                   Feedback.photo_file_id.is_not(None),
+                   Feedback.photo_data.is_(None))
+            .order_by(Feedback.id)
+            .limit(batch_size)
+        )).scalars().all()
+
+        archived = 0
+        for feedback in feedbacks:
+            try:
+                file = await bot.get_file(feedback.photo_file_id)
+                data = await bot.download_file(file.file_path)
+            except Exception as e:
+                logger.warning("Не удалось скачать фото отзыва %s: %s",
+                               feedback.id, e)
+                continue
+            if pipeline is not None:
+                await pipeline.apply(feedback, data.getvalue())
+            else:
+                feedback.photo_data = data.getvalue()
+            archived += 1
+
+        if archived:
+            await session.commit()
+    last_id = feedbacks[-1].id if feedbacks else after_id
+    return archived, len(feedbacks), last_id
+
+
+async def run_photo_archiver(bot: Bot, session_maker, interval: float = 300,
+                             batch_size: int = 20,
+                             pipeline: Optional[ImagePipeline] = None):
+    """Фоновая задача: периодически архивирует новые фото.
+
+    Каждый проход идёт по id от начала; не скачавшиеся фото
+    повторяются на следующем проходе.
+    """
+    last_id = 0
+    while True:
+        try:
+            archived, scanned, last_id = await archive_pending_photos(
+                bot, session_maker, batch_size, pipeline, after_id=last_id)
+            if archived:
+                logger.info("Заархивировано фото: %s", archived)
+            # Есть ещё — сразу следующая порция
+            if scanned == batch_size:
+                continue
+        except Exception:
+            logger.exception("Ошибка архивации фото")
+        last_id = 0
+        await asyncio.sleep(interval)
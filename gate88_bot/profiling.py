@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter
+from typing import List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    "gate88_event_loop_lag_seconds",
+    "Задержка срабатывания таймера в event loop",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+# ========== Задержка event loop ==========
+
+class LoopLagMonitor:
+    """Измеряет задержку event loop и ловит того, кто её вызвал.
+
+    Задача в цикле спит interval секунд и записывает, насколько позже
+    проснулась. Отдельный поток-сторож раз в interval проверяет, давно ли
+    задача отмечалась; если дольше threshold — цикл занят синхронным
+    кодом, и сторож записывает в лог стек потока event loop прямо в
+    момент блокировки. Пока монитор не запущен, затрат нет.
+    """
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._last_tick = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def run(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog",
+                                          daemon=True)
+        self._watchdog.start()
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._last_tick = now
+                lag = max(0.0, now - expected)
+                LOOP_LAG.observe(lag)
+                self.max_lag = max(self.max_lag, lag)
+                if lag > self.threshold:
+                    logger.warning("Event loop задержан на %.0f мс", lag * 1000)
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        reported_tick = None
+        while not self._stop.wait(self.interval):
+            tick = self._last_tick
+            if time.monotonic() - tick < self.threshold or tick == reported_tick:
+                continue
+            # Один стек на каждую блокировку
+            reported_tick = tick
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                stack = "".join(traceback.format_stack(frame, limit=15))
+                logger.warning("Event loop заблокирован дольше %.0f мс:\n%s",
+                               self.threshold * 1000, stack)
+
+    def stats(self) -> str:
+        return f"макс. задержка {self.max_lag * 1000:.0f} мс, блокировок {self.stalls}"
+
+
+# ========== Сэмплирующий профайлер ==========
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Профайлер на sys._current_frames() из отдельного потока.
+
+    Раз в interval секунд снимает стеки всех потоков и считает
+    одинаковые. Результат — collapsed stacks (формат flamegraph.pl и
+    speedscope). Работает только во время профилирования, бот при этом
+    не перезапускается и не замедляется заметно.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def sample(self, duration: float) -> Counter:
+        """Собирает стеки duration секунд (блокирует вызывающий поток)"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Профилирование уже идёт")
+        try:
+            own = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = Counter()
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(thread_id, str(thread_id)))
+                    stacks[";".join(reversed(labels))] += 1
+                time.sleep(self.interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+    async def profile(self, duration: float) -> str:
+        """Профилирует duration секунд и возвращает collapsed stacks"""
+        stacks = await asyncio.to_thread(self.sample, duration)
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+# Потоки, которые просто ждут, в сводку не попадают
+_IDLE_LEAVES = ("select ", "poll ", "wait ", "sleep ", "_worker ", "dequeue ")
+
+
+def top_functions(collapsed: str, limit: int = 10) -> List[str]:
+    """Функции, чаще всего оказывавшиеся на вершине стека (без простоя)"""
+    leaves = Counter()
+    total = 0
+    for line in collapsed.splitlines():
+        stack, _, count = line.rpartition(" ")
+        leaf = stack.rsplit(";", 1)[-1]
+        if leaf.startswith(_IDLE_LEAVES):
+            continue
+        leaves[leaf] += int(count)
+        total += int(count)
+    return [f"{count * 100 / total:5.1f}% {name}" for name, count in leaves.most_common(limit)]
+
+
+# ========== Снимки памяти ==========
+
+class MemoryTracker:
+    """tracemalloc по требованию: старт, сравнение со стартом, стоп"""
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._baseline = tracemalloc.take_snapshot()
+
+    def stop(self):
+        tracemalloc.stop()
+        self._baseline = None
+
+    def diff(self, limit: int = 15) -> List[str]:
+        """Топ мест, где выросла память с момента start()"""
+        if self._baseline is None:
+            raise RuntimeError("Отслеживание памяти не запущено")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        stats = snapshot.compare_to(self._baseline, "lineno")
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Сейчас {current / 1024 / 1024:.1f} МБ, пик {peak / 1024 / 1024:.1f} МБ"]
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 1024:+9.1f} КБ ({stat.count_diff:+d}) "
+                         f"{os.path.basename(frame.filename)}:{frame.lineno}")
+        return lines
+
+
+# ========== Проверка ==========
+
+def _demo():
+    import json
+
+    def busy(seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            json.dumps(list(range(200)))
+
+    async def main():
+        monitor = LoopLagMonitor(interval=0.05, threshold=0.1)
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0.2)
+        busy(0.4)  # блокирует loop: сторож должен показать busy()
+        await asyncio.sleep(0.2)
+
+        profiler = SamplingProfiler()
+        profiling = asyncio.create_task(profiler.profile(0.5))
+        await asyncio.sleep(0.05)
+        busy(0.3)
+        collapsed = await profiling
+        print("\n".join(top_functions(collapsed, 3)))
+        task.cancel()
+        print(monitor.stats())
+
+        memory = MemoryTracker()
+        memory.start()
+        leak = [bytearray(1024) for _ in range(5000)]
+        print("\n".join(memory.diff(3)))
+        memory.stop()
+        del leak
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    _demo()
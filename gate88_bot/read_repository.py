@@ -0,0 +1,193 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from models import Feedback, PlaceEnum
+
+feedbacks = Feedback.__table__
+
+
+class ReviewRecord:
+    """Отзыв без фото, только для чтения.
+
+    Имена полей совпадают с Feedback, поэтому записи подходят
+    для тех же функций форматирования и экспорта.
+    """
+
+    __slots__ = ("id", "user_id", "place", "menu_rating", "staff_rating",
+                 "cleanliness_rating", "recommend", "review_text", "created_at")
+
+    def __init__(self, id, user_id, place, menu_rating, staff_rating,
+                 cleanliness_rating, recommend, review_text, created_at):
+        self.id = id
+        self.user_id = user_id
+        self.place = place
+        self.menu_rating = menu_rating
+        self.staff_rating = staff_rating
+        self.cleanliness_rating = cleanliness_rating
+        self.recommend = recommend
+        self.review_text = review_text
+        self.created_at = created_at
+
+    def __repr__(self):
+        return f"ReviewRecord(id={self.id}, place={self.place.value})"
+
+
+_REVIEW_COLUMNS = (
+    feedbacks.c.id, feedbacks.c.user_id, feedbacks.c.place,
+    feedbacks.c.menu_rating, feedbacks.c.staff_rating,
+    feedbacks.c.cleanliness_rating, feedbacks.c.recommend,
+    feedbacks.c.review_text, feedbacks.c.created_at,
+)
+
+# Запросы собираются один раз; параметры — через bindparam, поэтому
+# ключ кэша компиляции SQLAlchemy у каждого запроса всегда один
+_LATEST_REVIEWS = (
+    select(*_REVIEW_COLUMNS)
+    .order_by(feedbacks.c.created_at.desc())
+    .limit(bindparam("limit"))
+)
+_ALL_REVIEWS = select(*_REVIEW_COLUMNS).order_by(feedbacks.c.created_at.desc())
+_REVIEWS_BY_IDS = select(*_REVIEW_COLUMNS).where(
+    feedbacks.c.id.in_(bindparam("ids", expanding=True)))
+_THUMBNAILS = select(feedbacks.c.id, feedbacks.c.photo_thumb).where(
+    feedbacks.c.id.in_(bindparam("ids", expanding=True)),
+    feedbacks.c.photo_thumb.is_not(None))
+_REVIEWS_SINCE = (
+    select(*_REVIEW_COLUMNS)
+    .where(feedbacks.c.created_at >= bindparam("since"),
+           feedbacks.c.duplicate_of.is_(None))
+    .order_by(feedbacks.c.id)
+)
+# Оценки и тональность аспектов — для поиска расхождений
+_ASPECT_COLUMNS = (
+    feedbacks.c.id, feedbacks.c.place, feedbacks.c.review_text,
+    feedbacks.c.menu_rating, feedbacks.c.staff_rating,
+    feedbacks.c.cleanliness_rating, feedbacks.c.menu_sentiment,
+    feedbacks.c.staff_sentiment, feedbacks.c.cleanliness_sentiment,
+)
+_LAST_FEEDBACK_TIME = (
+    select(feedbacks.c.created_at)
+    .where(feedbacks.c.user_id == bindparam("user_id"),
+           feedbacks.c.place == bindparam("place"))
+    .order_by(feedbacks.c.created_at.desc())
+    .limit(1)
+)
+
+
+class ReadRepository:
+    """Чтение отзывов через SQLAlchemy Core, без ORM и identity map"""
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+
+    async def latest_reviews(self, limit: int = 10) -> List[ReviewRecord]:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(_LATEST_REVIEWS, {"limit": limit})
+            return [ReviewRecord(*row) for row in result]
+
+    async def all_reviews(self, partition: int = 1000) -> List[ReviewRecord]:
+        """Все отзывы (новые первыми), читаются порциями"""
+        records = []
+        async with self.engine.connect() as conn:
+            result = await conn.stream(_ALL_REVIEWS)
+            async for rows in result.partitions(partition):
+                records.extend(ReviewRecord(*row) for row in rows)
+        return records
+
+    async def reviews_by_ids(self, ids: List[int]) -> List[ReviewRecord]:
+        """Отзывы в порядке переданных id (отсутствующие пропускаются)"""
+        if not ids:
+            return []
+        async with self.engine.connect() as conn:
+            result = await conn.execute(_REVIEWS_BY_IDS, {"ids": list(ids)})
+            by_id = {row.id: ReviewRecord(*row) for row in result}
+        return [by_id[i] for i in ids if i in by_id]
+
+    async def thumbnails(self, ids: List[int]) -> Dict[int, bytes]:
+        """Превью фото по id отзывов (у кого оно есть)"""
+        if not ids:
+            return {}
+        async with self.engine.connect() as conn:
+            result = await conn.execute(_THUMBNAILS, {"ids": list(ids)})
+            return {row.id: row.photo_thumb for row in result}
+
+    async def reviews_since(self, since: datetime) -> List[ReviewRecord]:
+        """Отзывы (без копий), оставленные начиная с since, по возрастанию id"""
+        async with self.engine.connect() as conn:
+            result = await conn.execute(_REVIEWS_SINCE, {"since": since})
+            return [ReviewRecord(*row) for row in result]
+
+    async def aspect_reviews(self, condition, place: Optional[PlaceEnum] = None,
+                             limit: int = 10) -> list:
+        """Свежие отзывы (без копий) под condition: оценки и тональность аспектов"""
+        query = (
+            select(*_ASPECT_COLUMNS)
+            .where(condition, feedbacks.c.duplicate_of.is_(None))
+            .order_by(feedbacks.c.id.desc())
+            .limit(limit)
+        )
+        if place is not None:
+            query = query.where(feedbacks.c.place == place)
+        async with self.engine.connect() as conn:
+            return (await conn.execute(query)).all()
+
+    async def last_feedback_time(self, user_id: int,
+                                 place: PlaceEnum) -> Optional[datetime]:
+        async with self.engine.connect() as conn:
+            return (await conn.execute(
+                _LAST_FEEDBACK_TIME, {"user_id": user_id, "place": place}
+            )).scalar()
+
+
+# ========== Бенчмарк ==========
+
+async def _bench(rows: int = 10000):
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+    from sqlalchemy import insert
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(feedbacks), [{
+            "user_id": i % 700, "place": PlaceEnum.POBEDA, "menu_rating": 5,
+            "staff_rating": 4, "cleanliness_rating": 5, "recommend": True,
+            "review_text": "Очень вкусно и уютно " * 5, "created_at": datetime.utcnow(),
+            # Фото в старых строках — как в текущей gate88.db
+            "photo_data": b"\xff" * 20000 if i % 10 == 0 else None,
+        } for i in range(rows)])
+    session_maker = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    repository = ReadRepository(engine)
+
+    async def orm_path():
+        async with session_maker() as session:
+            return (await session.execute(
+                select(Feedback).order_by(Feedback.created_at.desc())
+            )).scalars().all()
+
+    for name, load in (("ORM", orm_path), ("Core", repository.all_reviews)):
+        await load()  # прогрев кэша компиляции
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = await load()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:4}: {len(result)} строк, {elapsed * 1000:7.1f} мс, "
+              f"пик памяти {peak / 1024 / 1024:6.1f} МБ")
+        del result
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(_bench())
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import REGISTRY
+
+CACHE_REQUESTS = REGISTRY.counter(
+    "gate88_cache_requests_total",
+    "Обращения к кэшу ответов",
+    ("cache", "result"),
+)
+
+
+class SingleFlightCache:
+    """TTL-кэш ответов с объединением одновременных промахов.
+
+    Если значения нет, первый вызов запускает вычисление, а остальные
+    ждут тот же future — в БД уходит ровно один запрос. invalidate()
+    сбрасывает кэш; результат вычисления, начатого до сброса,
+    отдаётся ожидающим, но не сохраняется.
+
+    С shared_state (несколько воркеров) invalidate(broadcast=True)
+    сбрасывает кэш во всех процессах: каждый сверяет общий счётчик
+    сбросов перед обращением к кэшу.
+    """
+
+    def __init__(self, name: str, ttl: float = 30, shared_state=None):
+        self.name = name
+        self.ttl = ttl
+        self.shared_state = shared_state
+        self._shared_key = f"cache_generation:{name}"
+        self._shared_generation = None
+        self._values: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_compute(self, key: Hashable,
+                             compute: Callable[[], Awaitable[Any]]) -> Any:
+        if self.shared_state is not None:
+            generation = await self.shared_state.get(self._shared_key, 0)
+            if generation != self._shared_generation:
+                self.invalidate()
+                self._shared_generation = generation
+        cached = self._values.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.hits += 1
+            CACHE_REQUESTS.inc(self.name, "hit")
+            return cached[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            CACHE_REQUESTS.inc(self.name, "coalesced")
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        CACHE_REQUESTS.inc(self.name, "miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Чтобы не было "Future exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            if generation == self._generation:
+                self._values[key] = (time.monotonic() + self.ttl, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, key: Optional[Hashable] = None, broadcast: bool = False):
+        """Сбрасывает одно значение или весь кэш (broadcast — во всех процессах)"""
+        if broadcast and self.shared_state is not None:
+            self._shared_generation = self.shared_state.incr_sync(self._shared_key)
+        self._generation += 1
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._values),
+        }
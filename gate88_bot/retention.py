@@ -0,0 +1,462 @@
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from dataclasses import astuple, dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import LargeBinary, case, delete, func, or_, select
+
+from models import Feedback, FeedbackRollup, PlaceEnum, UserRollup
+from read_repository import ReviewRecord
+
+logger = logging.getLogger(__name__)
+
+feedbacks = Feedback.__table__
+# Фото и превью хранятся в архиве в base64
+_BINARY_COLUMNS = [c.name for c in feedbacks.columns if isinstance(c.type, LargeBinary)]
+
+# Периоды статистики в админке — до 30 дней, они должны оставаться в горячей таблице
+MIN_KEEP_DAYS = 31
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_key(moment: datetime) -> str:
+    return moment.strftime("%Y-%m")
+
+
+# ========== Итоги для статистики ==========
+
+@dataclass
+class Totals:
+    reviews: int = 0
+    menu_sum: int = 0
+    staff_sum: int = 0
+    cleanliness_sum: int = 0
+    recommended: int = 0
+    with_photo: int = 0
+
+    def __add__(self, other: "Totals") -> "Totals":
+        return Totals(self.reviews + other.reviews,
+                      self.menu_sum + other.menu_sum,
+                      self.staff_sum + other.staff_sum,
+                      self.cleanliness_sum + other.cleanliness_sum,
+                      self.recommended + other.recommended,
+                      self.with_photo + other.with_photo)
+
+    def averages(self) -> Optional[Dict[str, float]]:
+        """Средние в формате calculate_average_ratings; None — отзывов нет"""
+        if not self.reviews:
+            return None
+        avg_menu = self.menu_sum / self.reviews
+        avg_staff = self.staff_sum / self.reviews
+        avg_clean = self.cleanliness_sum / self.reviews
+        return {
+            "total": self.reviews,
+            "avg_menu": round(avg_menu, 2),
+            "avg_staff": round(avg_staff, 2),
+            "avg_clean": round(avg_clean, 2),
+            "avg_total": round((avg_menu + avg_staff + avg_clean) / 3, 2),
+        }
+
+
+_HAS_PHOTO = or_(Feedback.photo_file_id.is_not(None), Feedback.photo_data.is_not(None))
+
+# Агрегаты считаются в БД: строки отзывов (и фото) в Python не загружаются
+_HOT_COLUMNS = (
+    func.count(Feedback.id),
+    func.coalesce(func.sum(Feedback.menu_rating), 0),
+    func.coalesce(func.sum(Feedback.staff_rating), 0),
+    func.coalesce(func.sum(Feedback.cleanliness_rating), 0),
+    func.coalesce(func.sum(case((Feedback.recommend, 1), else_=0)), 0),
+    func.coalesce(func.sum(case((_HAS_PHOTO, 1), else_=0)), 0),
+)
+_ROLLUP_COLUMNS = (
+    func.coalesce(func.sum(FeedbackRollup.reviews), 0),
+    func.coalesce(func.sum(FeedbackRollup.menu_sum), 0),
+    func.coalesce(func.sum(FeedbackRollup.staff_sum), 0),
+    func.coalesce(func.sum(FeedbackRollup.cleanliness_sum), 0),
+    func.coalesce(func.sum(FeedbackRollup.recommended), 0),
+    func.coalesce(func.sum(FeedbackRollup.with_photo), 0),
+)
+
+
+async def hot_totals(session, *conditions) -> Totals:
+    """Итоги по отзывам в таблице feedbacks"""
+    row = (await session.execute(select(*_HOT_COLUMNS).where(*conditions))).one()
+    return Totals(*map(int, row))
+
+
+async def archived_totals(session, place: Optional[PlaceEnum] = None) -> Totals:
+    """Итоги заархивированных отзывов (без дубликатов)"""
+    query = select(*_ROLLUP_COLUMNS)
+    if place is not None:
+        query = query.where(FeedbackRollup.place == place)
+    row = (await session.execute(query)).one()
+    return Totals(*map(int, row))
+
+
+async def totals_by_place(session) -> Dict[PlaceEnum, Totals]:
+    """Итоги за всё время по заведениям: таблица + архив, без дубликатов"""
+    totals = defaultdict(Totals)
+    hot = await session.execute(
+        select(Feedback.place, *_HOT_COLUMNS)
+        .where(Feedback.duplicate_of.is_(None))
+        .group_by(Feedback.place))
+    archived = await session.execute(
+        select(FeedbackRollup.place, *_ROLLUP_COLUMNS).group_by(FeedbackRollup.place))
+    for place, *values in [*hot.all(), *archived.all()]:
+        totals[place] = totals[place] + Totals(*map(int, values))
+    return dict(totals)
+
+
+async def user_totals(session, user_id: int) -> Totals:
+    """Итоги отзывов пользователя: таблица + архив"""
+    totals = await hot_totals(session, Feedback.user_id == user_id)
+    rollup = await session.get(UserRollup, user_id)
+    if rollup is not None:
+        totals = totals + Totals(rollup.reviews, rollup.menu_sum,
+                                 rollup.staff_sum, rollup.cleanliness_sum)
+    return totals
+
+
+# ========== Архивные файлы ==========
+
+def _encode(row) -> dict:
+    item = dict(row._mapping)
+    item["place"] = item["place"].value
+    item["created_at"] = item["created_at"].isoformat() if item["created_at"] else None
+    for name in _BINARY_COLUMNS:
+        if item[name] is not None:
+            item[name] = base64.b64encode(item[name]).decode("ascii")
+    return item
+
+
+def _decode(item: dict) -> dict:
+    item["place"] = PlaceEnum(item["place"])
+    if item["created_at"]:
+        item["created_at"] = datetime.fromisoformat(item["created_at"])
+    for name in _BINARY_COLUMNS:
+        if item.get(name) is not None:
+            item[name] = base64.b64decode(item[name])
+    return item
+
+
+def to_record(item: dict) -> ReviewRecord:
+    return ReviewRecord(
+        item["id"], item["user_id"], item["place"], item["menu_rating"],
+        item["staff_rating"], item["cleanliness_rating"], item["recommend"],
+        item["review_text"], item["created_at"])
+
+
+class ReviewArchive:
+    """Архив старых отзывов: файл YYYY-MM.jsonl.gz на каждый месяц.
+
+    Порции дописываются отдельными gzip-членами, так что файл никогда
+    не переписывается. В manifest.json — диапазон id по месяцам: поиск
+    по id открывает только те файлы, где эти id могут быть. Строка,
+    записанная дважды (сбой между записью и удалением из БД), при чтении
+    схлопывается по id.
+
+    Пишет архив один процесс, а читают и воркеры: manifest.json
+    перечитывается, когда файл заменён новым. find() и records() идут
+    в потоках параллельно с append(), поэтому манифест меняется под
+    блокировкой, а читается копия.
+    """
+
+    def __init__(self, directory: str = "archive"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_path = os.path.join(directory, "manifest.json")
+        self._manifest_stamp: Optional[tuple] = None
+        self.manifest: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._reload_manifest()
+
+    def _manifest_stat(self) -> tuple:
+        # os.replace каждый раз даёт новый inode, время — на случай его повтора
+        stat = os.stat(self._manifest_path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _reload_manifest(self):
+        try:
+            stamp = self._manifest_stat()
+        except FileNotFoundError:
+            return
+        if stamp != self._manifest_stamp:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            self._manifest_stamp = stamp
+
+    def _path(self, month: str) -> str:
+        return os.path.join(self.directory, f"{month}.jsonl.gz")
+
+    def _entries(self) -> Dict[str, dict]:
+        with self._lock:
+            self._reload_manifest()
+            return {month: dict(entry) for month, entry in self.manifest.items()}
+
+    def months(self) -> List[str]:
+        return sorted(self._entries())
+
+    def append(self, month: str, rows: List[dict]):
+        """Дописывает закодированные строки и дожидается записи на диск"""
+        with open(self._path(month), "ab") as f:
+            with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                for row in rows:
+                    gz.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        ids = [row["id"] for row in rows]
+        with self._lock:
+            self._reload_manifest()
+            entry = self.manifest.setdefault(
+                month, {"min_id": min(ids), "max_id": max(ids), "rows": 0})
+            entry["min_id"] = min(entry["min_id"], min(ids))
+            entry["max_id"] = max(entry["max_id"], max(ids))
+            entry["rows"] += len(rows)
+            tmp = self._manifest_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f)
+            os.replace(tmp, self._manifest_path)
+            self._manifest_stamp = self._manifest_stat()
+
+    def read_month(self, month: str) -> Dict[int, dict]:
+        rows = {}
+        with gzip.open(self._path(month), "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    item = json.loads(line)
+                    rows[item["id"]] = item
+            except EOFError:
+                # Порция дописывается прямо сейчас; её id ещё нет в манифесте
+                pass
+        return {review_id: _decode(item) for review_id, item in rows.items()}
+
+    def find(self, ids: Iterable[int]) -> Dict[int, dict]:
+        """Архивные отзывы по id (с фото)"""
+        wanted = set(ids)
+        found = {}
+        for month, entry in self._entries().items():
+            if not any(entry["min_id"] <= i <= entry["max_id"] for i in wanted):
+                continue
+            rows = self.read_month(month)
+            found.update((i, rows[i]) for i in wanted & rows.keys())
+        return found
+
+    def records(self) -> List[ReviewRecord]:
+        """Все архивные отзывы без фото, новые первыми"""
+        records = []
+        for month in reversed(self.months()):
+            records.extend(sorted((to_record(item) for item in self.read_month(month).values()),
+                                  key=lambda r: r.created_at, reverse=True))
+        return records
+
+
+# ========== Перенос в архив ==========
+
+class RetentionManager:
+    """Переносит отзывы старше keep_days в архив целыми месяцами.
+
+    Порядок для каждой порции: строки дописываются в архив с fsync,
+    затем в одной транзакции обновляются сводки и строки удаляются.
+    Сбой между шагами оставляет строки в таблице, и следующий запуск
+    перенесёт их снова — сводки при этом не задваиваются.
+    """
+
+    def __init__(self, session_maker, archive: ReviewArchive, keep_days: int,
+                 batch_size: int = 2000):
+        if keep_days < MIN_KEEP_DAYS:
+            raise ValueError(f"Срок хранения должен быть не меньше {MIN_KEEP_DAYS} дней")
+        self.session_maker = session_maker
+        self.archive = archive
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        """Архивируется всё раньше этого момента: начало месяца, не позже now - keep_days"""
+        now = now or datetime.utcnow()
+        return month_start(now - timedelta(days=self.keep_days))
+
+    async def archive_batch(self, cutoff: datetime) -> int:
+        async with self.session_maker() as session:
+            rows = (await session.execute(
+                select(feedbacks)
+                .where(feedbacks.c.created_at < cutoff)
+                .order_by(feedbacks.c.id)
+                .limit(self.batch_size)
+            )).all()
+            if not rows:
+                return 0
+
+            by_month = defaultdict(list)
+            for row in rows:
+                by_month[month_key(row.created_at)].append(_encode(row))
+            # Сначала архив на диске, потом удаление из БД
+            for month, items in by_month.items():
+                await asyncio.to_thread(self.archive.append, month, items)
+
+            await self._add_rollups(session, rows)
+            await session.execute(
+                delete(feedbacks).where(feedbacks.c.id.in_([row.id for row in rows])))
+            await session.commit()
+        return len(rows)
+
+    @staticmethod
+    async def _add_rollups(session, rows):
+        places = defaultdict(Totals)
+        users = defaultdict(Totals)
+        for row in rows:
+            ratings = Totals(1, row.menu_rating, row.staff_rating, row.cleanliness_rating)
+            users[row.user_id] = users[row.user_id] + ratings
+            if row.duplicate_of is not None:
+                continue
+            ratings.recommended = int(row.recommend)
+            ratings.with_photo = int(bool(row.photo_file_id or row.photo_data))
+            key = (row.place, month_start(row.created_at))
+            places[key] = places[key] + ratings
+
+        # Существующие сводки порции — двумя запросами, а не по одному на ключ
+        existing = {
+            (rollup.place, rollup.month): rollup
+            for rollup in (await session.execute(
+                select(FeedbackRollup)
+                .where(FeedbackRollup.month.in_({month for _, month in places}))
+            )).scalars()
+        }
+        for key, totals in places.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                rollup = FeedbackRollup(place=key[0], month=key[1], reviews=0, menu_sum=0,
+                                        staff_sum=0, cleanliness_sum=0, recommended=0,
+                                        with_photo=0)
+                session.add(rollup)
+            rollup.reviews += totals.reviews
+            rollup.menu_sum += totals.menu_sum
+            rollup.staff_sum += totals.staff_sum
+            rollup.cleanliness_sum += totals.cleanliness_sum
+            rollup.recommended += totals.recommended
+            rollup.with_photo += totals.with_photo
+
+        known_users = {
+            rollup.user_id: rollup
+            for rollup in (await session.execute(
+                select(UserRollup).where(UserRollup.user_id.in_(list(users)))
+            )).scalars()
+        }
+        for user_id, totals in users.items():
+            rollup = known_users.get(user_id)
+            if rollup is None:
+                rollup = UserRollup(user_id=user_id, reviews=0, menu_sum=0,
+                                    staff_sum=0, cleanliness_sum=0)
+                session.add(rollup)
+            rollup.reviews += totals.reviews
+            rollup.menu_sum += totals.menu_sum
+            rollup.staff_sum += totals.staff_sum
+            rollup.cleanliness_sum += totals.cleanliness_sum
+
+    async def run_once(self) -> int:
+        """Переносит все просроченные отзывы; возвращает их число"""
+        cutoff = self.cutoff()
+        archived = 0
+        while batch := await self.archive_batch(cutoff):
+            archived += batch
+        if archived:
+            logger.info("В архив перенесено отзывов: %s (до %s)", archived, cutoff.date())
+        return archived
+
+
+async def run_retention(manager: RetentionManager, interval: float = 86400,
+                        on_archived=None):
+    """Фоновая задача: раз в interval переносит старые отзывы в архив"""
+    while True:
+        try:
+            if await manager.run_once() and on_archived is not None:
+                on_archived()
+        except Exception:
+            logger.exception("Ошибка архивации отзывов")
+        await asyncio.sleep(interval)
+
+
+# ========== Проверка ==========
+
+def _demo(rows: int = 20000):
+    import random
+    import shutil
+    import tempfile
+    from sqlalchemy import insert
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base
+
+    async def main():
+        directory = tempfile.mkdtemp()
+        engine = create_async_engine(f"sqlite+aiosqlite:///{directory}/demo.db")
+        session_maker = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        rng = random.Random(1)
+        now = datetime.utcnow()
+        places = list(PlaceEnum)
+        data = [{
+            "user_id": rng.randrange(500),
+            "place": rng.choice(places),
+            "menu_rating": rng.randint(1, 5),
+            "staff_rating": rng.randint(1, 5),
+            "cleanliness_rating": rng.randint(1, 5),
+            "recommend": rng.random() < 0.7,
+            "review_text": f"Отзыв {i}",
+            "photo_data": b"\xff\xd8photo" if i % 50 == 0 else None,
+            "duplicate_of": 1 if i % 97 == 0 else None,
+            "created_at": now - timedelta(days=rng.uniform(0, 365)),
+        } for i in range(rows)]
+        async with session_maker() as session:
+            await session.execute(insert(Feedback), data)
+            await session.commit()
+
+        async def snapshot():
+            async with session_maker() as session:
+                return (await totals_by_place(session),
+                        await user_totals(session, 7),
+                        await hot_totals(session))
+
+        before_places, before_user, before_hot = await snapshot()
+        archive = ReviewArchive(os.path.join(directory, "archive"))
+        manager = RetentionManager(session_maker, archive, keep_days=90)
+        archived = await manager.run_once()
+        after_places, after_user, after_hot = await snapshot()
+
+        assert after_places == before_places, (before_places, after_places)
+        # По пользователям в архиве хранятся только оценки
+        assert astuple(after_user)[:4] == astuple(before_user)[:4], (before_user, after_user)
+        assert after_hot.reviews == before_hot.reviews - archived
+        assert await manager.run_once() == 0
+
+        records = archive.records()
+        assert len(records) == archived
+        with_photo = [r.id for r in records if r.id % 50 == 1][:3]
+        found = archive.find(with_photo)
+        assert all(found[i]["photo_data"] == b"\xff\xd8photo" for i in with_photo)
+        size = sum(os.path.getsize(os.path.join(archive.directory, name))
+                   for name in os.listdir(archive.directory))
+        print(f"В архиве {archived} из {rows} отзывов, {len(archive.months())} файлов, "
+              f"{size / 1024:.0f} КБ; итоги за всё время совпадают")
+        await engine.dispose()
+        shutil.rmtree(directory)
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    _demo()
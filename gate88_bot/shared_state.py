@@ -0,0 +1,132 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+
+class SharedState:
+    """Общее для всех процессов-воркеров хранилище ключ-значение с TTL.
+
+    Хранится в отдельном файле SQLite (WAL), поэтому кулдауны, лимиты
+    и кэши видны всем процессам. Синхронные операции выполняются
+    в пуле потоков, чтобы не блокировать event loop.
+    """
+
+    def __init__(self, path: str = "shared_state.db"):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ========== Синхронные операции ==========
+
+    def get_sync(self, key: str, default: Any = None) -> Any:
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM kv WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set_sync(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at),
+        )
+
+    def delete_sync(self, key: str):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def incr_sync(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Атомарно увеличивает счётчик и возвращает новое значение"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM kv WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                value, expires_at = amount, (now + ttl if ttl else None)
+            else:
+                value, expires_at = json.loads(row[0]) + amount, row[1]
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def acquire_cooldown_sync(self, key: str, seconds: float) -> float:
+        """Атомарно занимает кулдаун.
+
+        Возвращает 0, если кулдаун занят этим вызовом, иначе — сколько
+        секунд осталось ждать.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT expires_at FROM kv WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[0] is not None and row[0] > now:
+                conn.execute("COMMIT")
+                return row[0] - now
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(now), now + seconds),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return 0
+
+    def purge_expired_sync(self) -> int:
+        cursor = self._conn().execute(
+            "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (time.time(),),
+        )
+        return cursor.rowcount
+
+    # ========== Асинхронные обёртки ==========
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.get_sync, key, default)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await asyncio.to_thread(self.set_sync, key, value, ttl)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.delete_sync, key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return await asyncio.to_thread(self.incr_sync, key, amount, ttl)
+
+    async def acquire_cooldown(self, key: str, seconds: float) -> float:
+        return await asyncio.to_thread(self.acquire_cooldown_sync, key, seconds)
+
+    async def purge_expired(self) -> int:
+        return await asyncio.to_thread(self.purge_expired_sync)
@@ -0,0 +1,386 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+from datetime import date, datetime, timedelta, timezone
+from html import escape
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from digests import MOSCOW_TZ
+from models import Feedback, PlaceEnum
+from text_utils import clean_text, load_nlp
+
+logger = logging.getLogger(__name__)
+
+STOP_WORDS = {
+    "и", "в", "во", "на", "с", "со", "а", "но", "что", "это", "как", "я", "мы", "он",
+    "она", "они", "вы", "ты", "быть", "был", "была", "было", "были", "очень", "весь",
+    "все", "всё", "так", "же", "бы", "по", "за", "у", "к", "из", "от", "для", "то",
+    "там", "тут", "уже", "ещё", "еще", "нас", "нам", "мне", "меня", "мой", "наш",
+    "ваш", "его", "её", "их", "этот", "есть", "просто", "вообще", "который", "о",
+    "об", "при", "до", "или", "если", "когда", "чтобы", "тот", "свой", "себя",
+}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "little")
+
+
+# ========== Count-Min ==========
+
+class CountMinSketch:
+    """Частоты строк за фиксированную память: depth × width счётчиков.
+
+    Оценка никогда не меньше настоящей частоты и завышена не больше чем
+    на e/width от общего числа добавлений с вероятностью 1 − e^−depth.
+    Скетчи с одинаковыми размерами складываются поэлементно.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4,
+                 table: Optional[np.ndarray] = None):
+        self.width = width
+        self.depth = depth
+        self.table = table if table is not None else np.zeros((depth, width), dtype=np.uint32)
+        self._rows = np.arange(depth)
+
+    def _columns(self, item: str) -> np.ndarray:
+        # Двойное хэширование: depth хэшей из одного 64-битного
+        value = _hash64(item)
+        first, second = value & 0xFFFFFFFF, (value >> 32) | 1
+        return (first + self._rows * second) % self.width
+
+    def add(self, item: str, count: int = 1):
+        self.table[self._rows, self._columns(item)] += count
+
+    def estimate(self, item: str) -> int:
+        return int(self.table[self._rows, self._columns(item)].min())
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        return CountMinSketch(self.width, self.depth, self.table + other.table)
+
+
+class TopK:
+    """k самых частых строк по оценкам Count-Min"""
+
+    def __init__(self, k: int = 50, items: Optional[Dict[str, int]] = None):
+        self.k = k
+        self.items: Dict[str, int] = dict(items or {})
+
+    def offer(self, item: str, estimate: int):
+        if item in self.items or len(self.items) < self.k:
+            self.items[item] = estimate
+            return
+        weakest = min(self.items, key=self.items.get)
+        if estimate > self.items[weakest]:
+            del self.items[weakest]
+            self.items[item] = estimate
+
+    def top(self, limit: int) -> List[Tuple[str, int]]:
+        return sorted(self.items.items(), key=lambda pair: -pair[1])[:limit]
+
+
+class HeavyHitters:
+    """Count-Min + top-k: частые фразы потока"""
+
+    def __init__(self, k: int = 50, sketch: Optional[CountMinSketch] = None,
+                 top: Optional[TopK] = None):
+        self.sketch = sketch or CountMinSketch()
+        self.top = top or TopK(k)
+
+    def add(self, item: str):
+        self.sketch.add(item)
+        self.top.offer(item, self.sketch.estimate(item))
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        # Кандидаты — объединение обоих топов, оценки — по сумме скетчей
+        merged = HeavyHitters(self.top.k, self.sketch.merge(other.sketch))
+        for item in set(self.top.items) | set(other.top.items):
+            merged.top.offer(item, merged.sketch.estimate(item))
+        return merged
+
+
+# ========== HyperLogLog ==========
+
+class HyperLogLog:
+    """Число различных значений: 2^p регистров по байту, ошибка ≈ 1.04/√2^p"""
+
+    def __init__(self, p: int = 12, registers: Optional[np.ndarray] = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+
+    def add(self, value):
+        hashed = _hash64(str(value))
+        index = hashed >> (64 - self.p)
+        rest_bits = 64 - self.p
+        rest = hashed & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Мало значений — точнее линейный подсчёт
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        return HyperLogLog(self.p, np.maximum(self.registers, other.registers))
+
+
+# ========== Скетчи по дням ==========
+
+class DaySketch:
+    """Всё, что собирается за один день (по Москве)"""
+
+    def __init__(self):
+        self.phrases = HeavyHitters()
+        # Фразы из отзывов со средней оценкой 3 и ниже
+        self.complaints = HeavyHitters()
+        self.visitors: Dict[PlaceEnum, HyperLogLog] = {}
+
+    def visitors_for(self, place: PlaceEnum) -> HyperLogLog:
+        hll = self.visitors.get(place)
+        if hll is None:
+            hll = self.visitors[place] = HyperLogLog()
+        return hll
+
+    def save(self, path: str):
+        arrays = {
+            "phrases": self.phrases.sketch.table,
+            "complaints": self.complaints.sketch.table,
+            "top": np.array(json.dumps({"phrases": self.phrases.top.items,
+                                        "complaints": self.complaints.top.items},
+                                       ensure_ascii=False)),
+        }
+        for place, hll in self.visitors.items():
+            arrays[f"visitors_{place.name}"] = hll.registers
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DaySketch":
+        day = cls()
+        with np.load(path) as saved:
+            top = json.loads(str(saved["top"]))
+            day.phrases = HeavyHitters(sketch=CountMinSketch(table=saved["phrases"]),
+                                       top=TopK(items=top["phrases"]))
+            day.complaints = HeavyHitters(sketch=CountMinSketch(table=saved["complaints"]),
+                                          top=TopK(items=top["complaints"]))
+            for name in saved.files:
+                if name.startswith("visitors_"):
+                    place = PlaceEnum[name[len("visitors_"):]]
+                    day.visitors[place] = HyperLogLog(registers=saved[name])
+        return day
+
+
+def phrases(lemmas: Iterable[str]) -> List[str]:
+    """Униграммы и биграммы без служебных слов («не» сохраняется)"""
+    words = [w for w in lemmas if w not in STOP_WORDS and (len(w) > 2 or w == "не")]
+    bigrams = [f"{a} {b}" for a, b in zip(words, words[1:])]
+    # «не» само по себе ничего не говорит
+    return [w for w in words if w != "не"] + bigrams
+
+
+class TrendSketches:
+    """Частые фразы и уникальные посетители по дням.
+
+    Каждый день — свой набор скетчей фиксированного размера; неделя
+    получается слиянием семи дней, так что ответ на запрос не зависит от
+    числа отзывов. Дни хранятся сжатыми .npz в directory, старше
+    retention_days удаляются.
+    """
+
+    def __init__(self, directory: str = "sketches", retention_days: int = 35,
+                 save_every: int = 50):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.save_every = save_every
+        os.makedirs(directory, exist_ok=True)
+        self.days: Dict[date, DaySketch] = {}
+        self._dirty: set = set()
+        self._unsaved = 0
+        self._nlp = None
+        self._nlp_checked = False
+        self._load()
+
+    def _path(self, day: date) -> str:
+        return os.path.join(self.directory, f"{day.isoformat()}.npz")
+
+    def _load(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".npz") or ".tmp" in name:
+                continue
+            try:
+                day = date.fromisoformat(name[:-4])
+                self.days[day] = DaySketch.load(os.path.join(self.directory, name))
+            except Exception:
+                logger.exception("Не удалось загрузить скетч %s", name)
+        self._prune()
+
+    def _prune(self):
+        border = datetime.now(MOSCOW_TZ).date() - timedelta(days=self.retention_days)
+        for day in [d for d in self.days if d < border]:
+            del self.days[day]
+            try:
+                os.remove(self._path(day))
+            except OSError:
+                pass
+
+    def save(self):
+        for day in self._dirty:
+            if day in self.days:
+                self.days[day].save(self._path(day))
+        self._dirty.clear()
+        self._unsaved = 0
+
+    # ========== Запись ==========
+
+    def lemmas(self, text: str) -> List[str]:
+        """Леммы spaCy, если модель есть; иначе — слова очищенного текста"""
+        cleaned = clean_text(text or "")
+        if self._nlp is not None:
+            return [token.lemma_ for token in self._nlp(cleaned) if not token.is_space]
+        return cleaned.split()
+
+    async def observe(self, feedback: Feedback):
+        if not self._nlp_checked:
+            self._nlp = await asyncio.to_thread(load_nlp)
+            self._nlp_checked = True
+        text = feedback.review_text if (feedback.review_text or "").strip().lower() != "нет" else ""
+        lemmas = await asyncio.to_thread(self.lemmas, text) if self._nlp else self.lemmas(text)
+        self.add(feedback, phrases(lemmas))
+
+    def add(self, feedback: Feedback, items: List[str]):
+        created = (feedback.created_at or datetime.utcnow()).replace(tzinfo=timezone.utc)
+        day = created.astimezone(MOSCOW_TZ).date()
+        sketch = self.days.get(day)
+        if sketch is None:
+            sketch = self.days[day] = DaySketch()
+            self._prune()
+        complaint = (feedback.menu_rating + feedback.staff_rating
+                     + feedback.cleanliness_rating) <= 9
+        for item in items:
+            sketch.phrases.add(item)
+            if complaint:
+                sketch.complaints.add(item)
+        sketch.visitors_for(feedback.place).add(feedback.user_id)
+
+        self._dirty.add(day)
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    async def warm_up(self, repository, days: int = 7) -> int:
+        """Заполняет скетчи последних дней из БД, если их ещё нет.
+
+        Читаются только колонки ReviewRecord, без фото.
+        """
+        if self.days:
+            return 0
+        rows = await repository.reviews_since(datetime.utcnow() - timedelta(days=days))
+        for feedback in rows:
+            await self.observe(feedback)
+        self.save()
+        if rows:
+            logger.info("Скетчи трендов заполнены из БД: %s отзывов", len(rows))
+        return len(rows)
+
+    # ========== Запросы ==========
+
+    def _window(self, days: int) -> List[DaySketch]:
+        today = datetime.now(MOSCOW_TZ).date()
+        return [self.days[d] for d in (today - timedelta(days=i) for i in range(days))
+                if d in self.days]
+
+    def trending(self, days: int = 7, limit: int = 10,
+                 complaints: bool = False) -> List[Tuple[str, int]]:
+        window = self._window(days)
+        if not window:
+            return []
+        merged = window[0].complaints if complaints else window[0].phrases
+        for day in window[1:]:
+            merged = merged.merge(day.complaints if complaints else day.phrases)
+        return merged.top.top(limit)
+
+    def unique_visitors(self, place: Optional[PlaceEnum] = None,
+                        days: int = 1) -> int:
+        """Уникальные пользователи за days дней (объединение, а не сумма)"""
+        merged = HyperLogLog()
+        for day in self._window(days):
+            for visitor_place, hll in day.visitors.items():
+                if place is None or visitor_place == place:
+                    merged = merged.merge(hll)
+        return merged.count()
+
+
+def render_trends(sketches: TrendSketches, place: Optional[PlaceEnum]) -> str:
+    title = place.value if place else "все заведения"
+    text = "🔥 <b>Жалобы за неделю</b> (все заведения):\n"
+    complaints = sketches.trending(complaints=True)
+    text += "\n".join(f"• {escape(p)} — ~{c}" for p, c in complaints) or "нет данных"
+    text += "\n\n💬 <b>Частые фразы за неделю:</b>\n"
+    text += "\n".join(f"• {escape(p)} — ~{c}" for p, c in sketches.trending()) or "нет данных"
+    text += f"\n\n👥 <b>Уникальные гости</b> ({title}):\n"
+    text += (f"Сегодня: ~{sketches.unique_visitors(place, 1)}\n"
+             f"За 7 дней: ~{sketches.unique_visitors(place, 7)}\n"
+             f"За 30 дней: ~{sketches.unique_visitors(place, 30)}")
+    return text
+
+
+# ========== Проверка точности ==========
+
+def _check():
+    import random
+    import tempfile
+    import time
+
+    rng = random.Random(5)
+    hll = HyperLogLog()
+    for user in range(100_000):
+        hll.add(user)
+    # Пересекающиеся множества: 0..99999 и 50000..149999
+    other = HyperLogLog()
+    for user in range(50_000, 150_000):
+        other.add(user)
+    print(f"HLL: 100000 → {hll.count()}, объединение 150000 → {hll.merge(other).count()}")
+
+    words = [f"слово{i}" for i in range(5000)]
+    hot = ["холодный кофе", "долго ждать", "грубый официант"]
+    heavy = HeavyHitters(k=20)
+    start = time.perf_counter()
+    added = 0
+    for _ in range(200_000):
+        heavy.add(rng.choice(hot) if rng.random() < 0.05 else rng.choice(words))
+        added += 1
+    elapsed = time.perf_counter() - start
+    top = [p for p, _ in heavy.top.top(3)]
+    assert set(top) == set(hot), top
+    print(f"Count-Min: {added} фраз, {elapsed / added * 1e6:.1f} мкс на фразу, топ: {top}")
+
+    directory = tempfile.mkdtemp()
+    sketches = TrendSketches(directory)
+    now = datetime.utcnow()
+    for i in range(300):
+        feedback = Feedback(user_id=i % 120, place=list(PlaceEnum)[i % len(PlaceEnum)],
+                            menu_rating=2, staff_rating=2, cleanliness_rating=3,
+                            created_at=now - timedelta(days=i % 3))
+        sketches.add(feedback, phrases("принести холодный кофе долго ждать".split()))
+    sketches.save()
+    reloaded = TrendSketches(directory)
+    print("Жалобы:", reloaded.trending(complaints=True, limit=3),
+          "гостей за 3 дня:", reloaded.unique_visitors(days=3))
+    size = sum(os.path.getsize(os.path.join(directory, n)) for n in os.listdir(directory))
+    print(f"На диске: {size / 1024:.0f} КБ за {len(reloaded.days)} дн.")
+
+
+if __name__ == "__main__":
+    _check()
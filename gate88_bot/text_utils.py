@@ -0,0 +1,53 @@
+import logging
+import re
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+def clean_text(raw: str) -> str:
+    text = re.sub(r'<[^>]+>', ' ', raw)
+    text = re.sub(r'https?://\S+', ' ', text)
+    text = re.sub(r'[^\w\s]', ' ', text)
+    text = text.lower().strip()
+    text = re.sub(r'\s{2,}', ' ', text)
+    return text
+
+
+@lru_cache(maxsize=None)
+def load_nlp():
+    """spaCy-модель из nlp_pipeline или None, если NLP-зависимости не установлены.
+
+    Загрузка занимает секунды — вызывать из потока.
+    """
+    try:
+        from nlp_pipeline import nlp
+    except Exception as e:
+        logger.warning("NLP-модель недоступна, зависящие от неё функции отключены: %s", e)
+        return None
+    return nlp
+
+
+# Компоненты, не нужные для doc.vector: он усредняет статические векторы слов
+_VECTOR_EXCLUDE = ["tok2vec", "morphologizer", "parser", "senter",
+                   "attribute_ruler", "lemmatizer", "ner"]
+
+
+@lru_cache(maxsize=None)
+def load_vectors_nlp(name: str = "ru_core_news_md"):
+    """spaCy-модель со статическими векторами слов или None.
+
+    В ru_core_news_sm векторов нет, и doc.vector там не годится для
+    сравнения текстов — нужна ru_core_news_md или ru_core_news_lg.
+    Загрузка занимает секунды — вызывать из потока.
+    """
+    try:
+        import spacy
+        nlp = spacy.load(name, exclude=_VECTOR_EXCLUDE)
+    except Exception as e:
+        logger.warning("Модель %s недоступна, поиск похожих отзывов отключён: %s", name, e)
+        return None
+    if not nlp.vocab.vectors_length:
+        logger.warning("В модели %s нет векторов слов, поиск похожих отзывов отключён", name)
+        return None
+    return nlp
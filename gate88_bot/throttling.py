@@ -0,0 +1,122 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from metrics import REGISTRY
+
+THROTTLED = REGISTRY.counter(
+    "gate88_throttled_updates_total",
+    "Апдейты, отброшенные ограничением частоты",
+    ("scope", "reason"),
+)
+
+# Префиксы callback_data админских маршрутов
+ADMIN_PREFIXES = ("admin_", "analytics_", "chart_", "period_", "export_",
+                  "moderate_")
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, rate: float, capacity: float, now: float) -> bool:
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class BoundedLRU:
+    """Словарь с вытеснением давно не использованных ключей"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты апдейтов на пользователя (token bucket).
+
+    Срабатывает до хендлеров: лишние нажатия не доходят до БД и
+    edit_text. Повтор того же нажатия (callback_data, сообщение и
+    состояние FSM) чаще debounce секунд отбрасывается сразу (0 — выключено). Состояние хранится в LRU ограниченного
+    размера, так что память не растёт с числом пользователей.
+    """
+
+    def __init__(self, public_limit: Tuple[float, float] = (1.0, 5),
+                 admin_limit: Tuple[float, float] = (5.0, 20),
+                 debounce: float = 0.7, max_users: int = 10000):
+        # (токенов в секунду, размер корзины)
+        self.limits = {"public": public_limit, "admin": admin_limit}
+        self.debounce = debounce
+        self._buckets = BoundedLRU(max_users)
+        self._last_callback = BoundedLRU(max_users)
+
+    @staticmethod
+    def scope(event: TelegramObject) -> str:
+        if isinstance(event, CallbackQuery) and (event.data or "").startswith(ADMIN_PREFIXES):
+            return "admin"
+        return "public"
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        scope = self.scope(event)
+
+        if self.debounce and isinstance(event, CallbackQuery):
+            # Опрос шлёт rate_{i} на каждом шаге, редактируя одно сообщение:
+            # "5" на следующем шаге отличается только состоянием FSM
+            tap = (event.data,
+                   event.message.message_id if event.message else None,
+                   data.get("raw_state"))
+            last = self._last_callback.get(user.id)
+            if last is not None and last[0] == tap and now - last[1] < self.debounce:
+                THROTTLED.inc(scope, "debounce")
+                await event.answer()
+                return None
+            self._last_callback.put(user.id, (tap, now))
+
+        rate, capacity = self.limits[scope]
+        key = (user.id, scope)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(capacity, now)
+            self._buckets.put(key, bucket)
+        if not bucket.take(rate, capacity, now):
+            THROTTLED.inc(scope, "rate")
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Слишком часто, подождите немного")
+            return None
+
+        return await handler(event, data)
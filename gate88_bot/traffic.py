@@ -0,0 +1,463 @@
+import argparse
+import asyncio
+import contextvars
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, get_origin
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.base import BaseSession
+from aiogram.types import ChatFullInfo, File, Update, User
+
+from metrics import registered_commands, route_key
+from throttling import THROTTLED
+from workers import update_user_id
+
+logger = logging.getLogger(__name__)
+
+LOG_VERSION = 1
+
+
+# ========== Обезличивание ==========
+
+_NAME_FIELDS = ("first_name", "last_name", "username", "title")
+
+
+def anonymous_id(value: int, salt: bytes) -> int:
+    """Стабильный в пределах записи псевдоним id; знак сохраняется (группы < 0)"""
+    digest = hashlib.blake2b(str(abs(value)).encode(), key=salt, digest_size=5).digest()
+    anon = int.from_bytes(digest, "big") + 1
+    return -anon if value < 0 else anon
+
+
+# Поля с id пользователя вне объектов User и Chat (Contact.user_id и т. п.)
+_USER_ID_FIELDS = ("user_id", "user_chat_id")
+
+
+def anonymize(value: Any, salt: bytes) -> Any:
+    """Заменяет id и имена пользователей и чатов; тексты отзывов остаются"""
+    if isinstance(value, list):
+        return [anonymize(item, salt) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {key: anonymize(item, salt) for key, item in value.items()}
+    for key in _USER_ID_FIELDS:
+        if isinstance(result.get(key), int):
+            result[key] = anonymous_id(result[key], salt)
+    # User (is_bot) и Chat (type) — единственные объекты с числовым id
+    if isinstance(result.get("id"), int) and ("is_bot" in result or "type" in result):
+        result["id"] = anonymous_id(result["id"], salt)
+        for name in _NAME_FIELDS:
+            if name in result:
+                result[name] = f"user{abs(result['id'])}"
+    if "phone_number" in result:
+        # Contact: имя и vCard — такие же личные данные, как номер
+        result["phone_number"] = "0"
+        alias = f"user{abs(result.get('user_id') or 0)}"
+        for name in _NAME_FIELDS:
+            if name in result:
+                result[name] = alias
+        result.pop("vcard", None)
+    return result
+
+
+# ========== Запись ==========
+
+class UpdateRecorder(BaseMiddleware):
+    """Внешний middleware для dp.update: пишет входящие апдейты в журнал.
+
+    Журнал — NDJSON в gzip: строка метаданных, затем {"t": секунды от
+    начала записи, "update": апдейт}. id и имена заменяются псевдонимами
+    с солью, которая живёт только в памяти процесса, поэтому исходные id
+    по журналу не восстановить. Каждый процесс пишет свой файл.
+    """
+
+    def __init__(self, directory: str = "traffic", admin_ids: Iterable[int] = (),
+                 salt: Optional[bytes] = None, flush_interval: float = 1.0):
+        self.directory = directory
+        self.admin_ids = list(admin_ids)
+        self.salt = salt or os.urandom(16)
+        self.flush_interval = flush_interval
+        self.path: Optional[str] = None
+        self.recorded = 0
+        self._file = None
+        self._started = 0.0
+        self._flushed = 0.0
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(self.directory, f"updates-{stamp}-{os.getpid()}.ndjson.gz")
+        self._file = gzip.open(self.path, "wt", encoding="utf-8", compresslevel=6)
+        self._started = self._flushed = time.monotonic()
+        self._write({"meta": {
+            "version": LOG_VERSION,
+            "started": datetime.utcnow().isoformat(),
+            # Чтобы при воспроизведении админские маршруты остались админскими
+            "admins": [anonymous_id(i, self.salt) for i in self.admin_ids],
+        }})
+        logger.info("Запись апдейтов в %s", self.path)
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def record(self, update: Update):
+        if self._file is None:
+            self._open()
+        now = time.monotonic()
+        self._write({
+            "t": round(now - self._started, 3),
+            "update": anonymize(update.model_dump(mode="json", exclude_none=True, by_alias=True), self.salt),
+        })
+        self.recorded += 1
+        # Сброс на диск раз в flush_interval: при падении теряется не больше
+        if now - self._flushed >= self.flush_interval:
+            self._file.flush()
+            self._flushed = now
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            self.record(event)
+        except Exception:
+            logger.exception("Не удалось записать апдейт %s", event.update_id)
+        return await handler(event, data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info("Записано апдейтов: %s (%s)", self.recorded, self.path)
+
+
+def read_log(path: str) -> Tuple[dict, List[dict]]:
+    """Метаданные и записи журнала; оборванный хвост (процесс убит) пропускается"""
+    meta, records = {}, []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                item = json.loads(line)
+                if "meta" in item:
+                    meta = item["meta"]
+                else:
+                    records.append(item)
+        except (EOFError, json.JSONDecodeError):
+            logger.warning("Журнал %s оборван, прочитано записей: %s", path, len(records))
+    return meta, records
+
+
+# ========== Фейковый Bot API ==========
+
+class FakeSession(BaseSession):
+    """Сессия Bot API без сети: отвечает правдоподобными объектами.
+
+    Ответ собирается в JSON и проходит обычную проверку check_response,
+    так что хендлеры получают те же типы, что и от Telegram. latency
+    имитирует время запроса к API.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    def _message(self, method) -> dict:
+        self._message_id += 1
+        chat_id = getattr(method, "chat_id", None)
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id if isinstance(chat_id, int) else 1, "type": "private"},
+            "text": getattr(method, "text", None) or "",
+        }
+
+    def _result(self, method) -> Any:
+        returning = method.__returning__
+        if returning is bool:
+            return True
+        if get_origin(returning) is list:
+            return [self._message(method) for _ in getattr(method, "media", None) or [None]]
+        if returning is File:
+            return {"file_id": method.file_id, "file_unique_id": "replay",
+                    "file_path": f"photos/{method.file_id}.jpg"}
+        if returning is ChatFullInfo:
+            return {"id": method.chat_id if isinstance(method.chat_id, int) else 1,
+                    "type": "channel", "accent_color_id": 0, "max_reaction_count": 0,
+                    "accepted_gift_types": {"unlimited_gifts": False, "limited_gifts": False,
+                                            "unique_gifts": False, "premium_subscription": False}}
+        if returning is User:
+            return {"id": 1, "is_bot": True, "first_name": "Replay"}
+        return self._message(method)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self.json_dumps({"ok": True, "result": self._result(method)})
+        return self.check_response(bot, method, 200, content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                             raise_for_status=True):
+        yield b"\xff\xd8\xff\xd9"
+
+    async def close(self):
+        pass
+
+
+# ========== Воспроизведение ==========
+
+# Счётчик SQL-запросов текущего апдейта (наследуется задачами, созданными хендлером)
+_QUERIES: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar(
+    "replay_queries", default=None)
+
+
+def count_queries(engine) -> List[int]:
+    """Считает SQL-запросы каждого воспроизводимого апдейта.
+
+    Запросы вне апдейтов — групповая запись отзывов и другие общие
+    фоновые задачи — попадают в возвращаемый счётчик [n].
+    """
+    from sqlalchemy import event
+
+    background = [0]
+
+    @event.listens_for(getattr(engine, "sync_engine", engine), "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        counter = _QUERIES.get()
+        (background if counter is None else counter)[0] += 1
+
+    return background
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Replayer:
+    """Подаёт записанные апдейты в dp.feed_update с исходными интервалами.
+
+    speed — ускорение (1, 10, ...), 0 — без пауз. Апдейты одного
+    пользователя обрабатываются по очереди, как при polling'е, поэтому
+    сценарии FSM проходят в записанном порядке.
+    """
+
+    def __init__(self, dp, bot, speed: float = 1.0, concurrency: int = 100):
+        self.dp = dp
+        self.bot = bot
+        self.speed = speed
+        self.concurrency = concurrency
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.throttled: Counter = Counter()
+
+    async def _feed(self, update: Update, route: str, lock: asyncio.Lock,
+                    slots: asyncio.Semaphore):
+        try:
+            async with lock:
+                counter = [0]
+                token = _QUERIES.set(counter)
+                started = time.perf_counter()
+                try:
+                    await self.dp.feed_update(self.bot, update)
+                except Exception as e:
+                    self.errors[f"{route} {type(e).__name__}"] += 1
+                    logger.debug("Ошибка на апдейте %s", update.update_id, exc_info=True)
+                finally:
+                    self.latencies[route].append(time.perf_counter() - started)
+                    self.queries[route] += counter[0]
+                    _QUERIES.reset(token)
+        finally:
+            slots.release()
+
+    async def run(self, records: List[dict]) -> float:
+        """Воспроизводит записи; возвращает длительность в секундах"""
+        loop = asyncio.get_running_loop()
+        locks = defaultdict(asyncio.Lock)
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        commands = registered_commands(self.dp)
+        throttled_before = THROTTLED.values()
+        started = loop.time()
+        for record in records:
+            if self.speed:
+                delay = record["t"] / self.speed - (loop.time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.model_validate(record["update"], context={"bot": self.bot})
+            event_type, route = route_key(update.event, commands)
+            await slots.acquire()
+            tasks.append(asyncio.create_task(self._feed(
+                update, f"{event_type}:{route}", locks[update_user_id(record["update"])], slots)))
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - started
+        # Отброшенные лимитом апдейты хендлер не видит и ошибкой не считает
+        for labels, value in THROTTLED.values().items():
+            dropped = int(value - throttled_before.get(labels, 0))
+            if dropped:
+                self.throttled[" ".join(labels)] += dropped
+        return elapsed
+
+    def report(self, seconds: float, api_calls: Optional[Counter] = None,
+               background_queries: int = 0) -> dict:
+        routes = {}
+        for route, values in sorted(self.latencies.items()):
+            routes[route] = {
+                "count": len(values),
+                "p50_ms": round(_percentile(values, 0.5) * 1000, 2),
+                "p95_ms": round(_percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(_percentile(values, 0.99) * 1000, 2),
+                "max_ms": round(max(values) * 1000, 2),
+                "queries_per_update": round(self.queries[route] / len(values), 2),
+            }
+        updates = sum(len(values) for values in self.latencies.values())
+        return {
+            "speed": self.speed,
+            "updates": updates,
+            "seconds": round(seconds, 2),
+            "updates_per_second": round(updates / seconds, 1) if seconds else None,
+            "queries": sum(self.queries.values()),
+            "background_queries": background_queries,
+            "errors": dict(self.errors),
+            "throttled": dict(self.throttled),
+            "api_calls": dict(api_calls or {}),
+            "routes": routes,
+        }
+
+
+def _delta(current: float, baseline: Optional[float]) -> str:
+    if not baseline:
+        return ""
+    return f" ({(current - baseline) * 100 / baseline:+.0f}%)"
+
+
+def format_report(report: dict, baseline: Optional[dict] = None) -> str:
+    """Текстовый отчёт; с baseline — изменения p95 и числа запросов"""
+    base_routes = (baseline or {}).get("routes", {})
+    lines = [
+        f"Апдейтов: {report['updates']} за {report['seconds']} с "
+        f"({report['updates_per_second']}/с, скорость {report['speed'] or 'max'}), "
+        f"SQL-запросов: {report['queries']} в апдейтах, "
+        f"{report.get('background_queries', 0)} фоновых (групповая запись и т. п.)",
+        f"{'маршрут':<32}{'шт':>6}{'p50 мс':>9}{'p95 мс':>16}{'p99 мс':>9}{'SQL/апд':>16}",
+    ]
+    for route, stats in report["routes"].items():
+        base = base_routes.get(route, {})
+        p95 = f"{stats['p95_ms']}{_delta(stats['p95_ms'], base.get('p95_ms'))}"
+        queries = (f"{stats['queries_per_update']}"
+                   f"{_delta(stats['queries_per_update'], base.get('queries_per_update'))}")
+        lines.append(f"{route:<32}{stats['count']:>6}{stats['p50_ms']:>9}{p95:>16}"
+                     f"{stats['p99_ms']:>9}{queries:>16}")
+    errors = report["errors"]
+    base_errors = (baseline or {}).get("errors", {})
+    if errors or base_errors:
+        lines.append("Ошибки:")
+        for key in sorted(set(errors) | set(base_errors)):
+            lines.append(f"  {key}: {errors.get(key, 0)} (было {base_errors.get(key, 0)})"
+                         if baseline else f"  {key}: {errors[key]}")
+    else:
+        lines.append("Ошибок нет")
+    throttled = report.get("throttled")
+    if throttled:
+        lines.append("Отброшено ограничением частоты: " + ", ".join(
+            f"{key} — {count}" for key, count in sorted(throttled.items())))
+    return "\n".join(lines)
+
+
+# ========== Командная строка ==========
+
+def _prepare_environment(args, workdir: str):
+    """База и файлы состояния для воспроизведения — копии, не рабочие"""
+    if args.snapshot:
+        from backups import restore_snapshot
+        target = os.path.join(workdir, "replay.db")
+        restore_snapshot(args.snapshot, target)
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{target}"
+    elif args.database:
+        os.environ["DATABASE_URL"] = args.database
+    else:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'replay.db')}"
+    for name, default in (("SHARED_STATE_PATH", "shared_state.db"),
+                          ("ANOMALY_STATE_PATH", "anomaly_state.json"),
+                          ("CHART_CACHE_DIR", "chart_cache"), ("EMBEDDINGS_DIR", "embeddings"),
+                          ("DEDUP_DIR", "dedup"), ("SKETCHES_DIR", "sketches"),
+                          ("ARCHIVE_DIR", "archive"), ("BACKUP_DIR", "backups")):
+        os.environ[name] = os.path.join(workdir, default)
+    os.environ["RECORD_UPDATES"] = "0"
+    if args.speed != 1 and not args.keep_throttling:
+        # При ускорении лимит нажатий и подавление повторов (по реальным
+        # часам) отбросили бы апдейты, которые в жизни прошли
+        for name in ("THROTTLE_PUBLIC_RATE", "THROTTLE_PUBLIC_BURST",
+                     "THROTTLE_ADMIN_RATE", "THROTTLE_ADMIN_BURST"):
+            os.environ[name] = "1000000"
+        os.environ["THROTTLE_DEBOUNCE"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.setdefault("BOT_TOKEN", "42:replay")
+
+
+async def _replay_main(args):
+    import tempfile
+
+    meta, records = read_log(args.log)
+    with tempfile.TemporaryDirectory() as workdir:
+        _prepare_environment(args, workdir)
+        # Импорт после настройки окружения: bot_app читает его при загрузке
+        import bot_app
+
+        await bot_app.init_db()
+        session = FakeSession(latency=args.api_latency / 1000)
+        bot_app.bot.session = session
+        bot_app.ADMIN_IDS[:] = meta.get("admins", [])
+        background = count_queries(bot_app.engine)
+
+        replayer = Replayer(bot_app.dp, bot_app.bot, speed=args.speed)
+        seconds = await replayer.run(records)
+        await bot_app.feedback_writer.close()
+        report = replayer.report(seconds, session.calls, background[0])
+        await bot_app.engine.dispose()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов")
+    parser.add_argument("log", help="журнал updates-*.ndjson.gz")
+    parser.add_argument("--speed", default="1",
+                        help="ускорение: 1, 10, ... или max (без пауз)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--snapshot", help="снимок базы (*.db.gz) — восстанавливается во временный файл")
+    source.add_argument("--database", help="DATABASE_URL копии базы (в неё будут писаться отзывы)")
+    parser.add_argument("--api-latency", type=float, default=0,
+                        help="имитация задержки Bot API, мс")
+    parser.add_argument("--keep-throttling", action="store_true",
+                        help="не отключать лимит нажатий и подавление повторов при ускорении")
+    parser.add_argument("--baseline", help="отчёт прошлого прогона для сравнения")
+    parser.add_argument("--out", help="куда сохранить отчёт (JSON)")
+    args = parser.parse_args()
+    args.speed = 0 if args.speed == "max" else float(args.speed)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(_replay_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сигнал воркеру завершиться
+_STOP = None
+
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """Возвращает ID пользователя из сырого апдейта (или update_id)"""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+def shard_for(user_id: int, workers: int) -> int:
+    """Номер воркера для пользователя: все апдейты одного user_id
+    попадают в один процесс, поэтому FSM в памяти остаётся корректным"""
+    return zlib.crc32(str(user_id).encode()) % workers
+
+
+# ========== Воркер ==========
+
+def _worker_main(index: int, updates: multiprocessing.Queue):
+    """Точка входа процесса-воркера"""
+    asyncio.run(_worker_loop(index, updates))
+
+
+async def _worker_loop(index: int, updates: multiprocessing.Queue):
+    # Импорт здесь: каждый процесс создаёт свой Bot, Dispatcher и движок БД
+    os.environ["WORKER_INDEX"] = str(index)
+    import bot_app
+
+    background_tasks = await bot_app.on_startup(worker=index)
+    try:
+        await _consume(index, updates, bot_app)
+    finally:
+        await bot_app.on_shutdown(background_tasks)
+
+
+async def _consume(index: int, updates: multiprocessing.Queue, app):
+    loop = asyncio.get_running_loop()
+    logger.info("Воркер %s запущен", index)
+    pending = set()
+    while True:
+        update = await loop.run_in_executor(None, updates.get)
+        if update is _STOP:
+            break
+        # Апдейты обрабатываются конкурентно, как в обычном polling
+        task = asyncio.create_task(app.dp.feed_raw_update(app.bot, update))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    logger.info("Воркер %s остановлен", index)
+
+
+# ========== Супервизор ==========
+
+class Supervisor:
+    """Получает апдейты и раздаёт их воркерам по хэшу user_id"""
+
+    def __init__(self, workers: int, target: Callable = _worker_main,
+                 queue_size: int = 1000):
+        self.workers = workers
+        self.target = target
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [
+            self._ctx.Queue(maxsize=queue_size) for _ in range(workers)
+        ]
+        self.processes: List[multiprocessing.Process] = []
+
+    def start(self):
+        for index, updates in enumerate(self.queues):
+            process = self._ctx.Process(
+                target=self.target, args=(index, updates),
+                name=f"gate88-worker-{index}", daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def dispatch(self, update: Dict[str, Any]):
+        self.queues[shard_for(update_user_id(update), self.workers)].put(update)
+
+    def stop(self, timeout: float = 30):
+        for updates in self.queues:
+            updates.put(_STOP)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    async def poll(self, bot, allowed_updates: Optional[List[str]] = None):
+        """Long polling в супервизоре; обработка — только в воркерах"""
+        offset = None
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error("Ошибка получения апдейтов: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                raw = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+                # put() может заблокироваться, если воркер не успевает
+                await loop.run_in_executor(None, self.dispatch, raw)
+
+
+async def run_supervisor(bot, dp, workers: int, stop_timeout: float = 30):
+    """Запускает N воркеров и раздаёт им апдейты.
+
+    При остановке воркеры получают stop_timeout секунд на on_shutdown
+    (в том числе на отправку очереди уведомлений в канал).
+    """
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    logger.info("Запущено воркеров: %s", workers)
+    try:
+        await bot.delete_webhook(drop_pending_updates=False)
+        await supervisor.poll(bot, dp.resolve_used_update_types())
+    finally:
+        await asyncio.to_thread(supervisor.stop, stop_timeout)
+
+
+# ========== Бенчмарк пропускной способности ==========
+
+def _bench_worker(index: int, updates: multiprocessing.Queue):
+    """Воркер бенчмарка: имитирует CPU-нагрузку хендлера"""
+    while True:
+        update = updates.get()
+        if update is _STOP:
+            break
+        # Примерно столько же, сколько рендер статистики и сериализация
+        total = 0
+        for i in range(update["work"]):
+            total += i * i
+
+
+def _bench(updates_count: int = 4000, work: int = 20000):
+    for workers in (1, 2, 4):
+        supervisor = Supervisor(workers, target=_bench_worker)
+        supervisor.start()
+        start = time.perf_counter()
+        for update_id in range(updates_count):
+            supervisor.dispatch({
+                "update_id": update_id,
+                "message": {"from": {"id": update_id % 500}, "work": work},
+                "work": work,
+            })
+        supervisor.stop(timeout=600)
+        elapsed = time.perf_counter() - start
+        print(f"воркеров: {workers}  {updates_count / elapsed:8.1f} апдейтов/сек")
+
+
+if __name__ == "__main__":
+    _bench()
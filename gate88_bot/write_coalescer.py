@@ -0,0 +1,166 @@
+import asyncio
+import contextvars
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from models import Feedback
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackWriteCoalescer:
+    """Групповая запись отзывов.
+
+    Вызовы submit(), накопившиеся за время предыдущей записи (и, при
+    всплеске, в течение короткого окна), собираются в одну транзакцию
+    INSERT ... RETURNING id: один коммит (и один fsync в SQLite) на пачку
+    вместо коммита и SELECT на каждый отзыв. Future вызывающего
+    завершается только после коммита, так что гарантии сохранности
+    те же, что у прямой записи.
+    """
+
+    def __init__(self, engine: AsyncEngine, window: float = 0.005,
+                 max_batch: int = 200):
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._statement = insert(Feedback.__table__).returning(
+            Feedback.__table__.c.id, sort_by_parameter_order=True)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            # Пишущая задача общая: она не должна наследовать контекст
+            # первого submit() (например, счётчик запросов апдейта в traffic.py)
+            self._task = contextvars.Context().run(asyncio.create_task, self._run())
+
+    async def submit(self, row: Dict[str, Any]) -> Feedback:
+        """Ставит отзыв в очередь и ждёт его записи"""
+        self._ensure_started()
+        # created_at задаём здесь: он нужен для уведомления без повторного SELECT
+        row = dict(row)
+        row.setdefault("created_at", datetime.utcnow())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def close(self):
+        """Дописывает очередь и останавливает фоновую задачу"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # Забираем всё, что накопилось, пока шла прошлая запись
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            # Ждём окно только при всплеске: одиночная запись идёт сразу
+            deadline = time.monotonic() + self.window
+            while not stopping and len(batch) > 1 and len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+
+    async def _write(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        rows = [row for row, _ in batch]
+        try:
+            async with self.engine.begin() as conn:
+                ids = (await conn.execute(self._statement, rows)).scalars().all()
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error("Ошибка сохранения отзыва: %s", e, exc_info=True)
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Одна плохая строка не должна ронять всю пачку
+            logger.warning("Ошибка групповой записи (%s строк), пишем по одной",
+                           len(batch))
+            for item in batch:
+                await self._write([item])
+            return
+
+        for (row, future), feedback_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(Feedback(id=feedback_id, **row))
+        logger.debug("Записано отзывов одной транзакцией: %s", len(batch))
+
+
+# ========== Бенчмарк ==========
+
+async def _bench(rows_per_writer: int = 200):
+    import os
+    import tempfile
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base, PlaceEnum
+
+    row = {
+        "user_id": 1, "place": PlaceEnum.POBEDA, "menu_rating": 5,
+        "staff_rating": 4, "cleanliness_rating": 5, "recommend": True,
+        "review_text": "Всё понравилось", "photo_skipped": True,
+    }
+
+    for writers in (1, 10, 100):
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_maker = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+        async def direct_writer():
+            # Как прежний save_feedback: commit + refresh на каждый отзыв
+            for _ in range(rows_per_writer):
+                async with session_maker() as session:
+                    feedback = Feedback(**row)
+                    session.add(feedback)
+                    await session.commit()
+                    await session.refresh(feedback)
+
+        coalescer = FeedbackWriteCoalescer(engine)
+
+        async def coalesced_writer():
+            for _ in range(rows_per_writer):
+                await coalescer.submit(row)
+
+        results = []
+        for writer in (direct_writer, coalesced_writer):
+            start = time.perf_counter()
+            await asyncio.gather(*(writer() for _ in range(writers)))
+            results.append(writers * rows_per_writer / (time.perf_counter() - start))
+        await coalescer.close()
+        await engine.dispose()
+        print(f"писателей: {writers:3}  напрямую: {results[0]:8.0f}/с  "
+              f"группами: {results[1]:8.0f}/с")
+
+
+if __name__ == "__main__":
+    asyncio.run(_bench())